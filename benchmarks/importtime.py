@@ -0,0 +1,39 @@
+"""How long it takes to import the watcher, measured with `python -X importtime`.
+
+Run it with `python benchmarks/importtime.py`. Each module is imported in a fresh interpreter a few times and the best
+cumulative time is reported, along with whether Tk was loaded. Starting the watcher only imports
+aw_watcher_ask_away.__main__, the dialog module is imported on the dialog thread once it starts watching.
+"""
+
+import statistics
+import subprocess
+import sys
+
+MODULES = ["aw_watcher_ask_away.__main__", "aw_watcher_ask_away.dialog"]
+RUNS = 5
+
+
+def import_times(module: str) -> dict[str, int]:
+    """The cumulative import time of every module imported by `import module`, in microseconds."""
+    command = [sys.executable, "-X", "importtime", "-c", f"import {module}"]
+    result = subprocess.run(command, capture_output=True, text=True, check=True)  # noqa: S603
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    for module in MODULES:
+        runs = [import_times(module) for _ in range(RUNS)]
+        best = min(times[module] for times in runs)
+        median = statistics.median(times[module] for times in runs)
+        loads_tk = "_tkinter" in runs[0]
+        print(f"{module}: best {best / 1000:.1f} ms, median {median / 1000:.1f} ms, loads Tk: {loads_tk}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Generate afk bucket streams that look like the ones aw-watcher-afk produces.
+
+The streams alternate between not-afk and afk events with a few of the oddities mentioned in core.py mixed in: not-afk
+events duplicated with a slightly shifted timestamp, zero length not-afk events from opening a suspended computer, and
+events that overlap their neighbours.
+"""
+
+import random
+
+from aw_watcher_ask_away.core import Span, get_utc_now, to_micros
+
+SECOND = 1_000_000
+
+
+def afk_stream(n: int, seed: int = 0, end: int | None = None) -> list[Span]:
+    """About n afk/not-afk events ending at end (now by default), newest first like the server returns them."""
+    rng = random.Random(seed)
+    now = to_micros(get_utc_now()) if end is None else end
+    spans = []
+    t = now
+    while len(spans) < n:
+        # Mostly short breaks with the occasional long one.
+        afk = int(rng.choice([rng.expovariate(1 / 120), rng.expovariate(1 / 1800)]) * SECOND) + SECOND
+        not_afk = int(rng.expovariate(1 / 600) * SECOND) + SECOND
+        t -= not_afk
+        spans.append(Span(t, t + not_afk, "not-afk"))
+        roll = rng.random()
+        if roll < 0.05:  # noqa: PLR2004
+            # The same event again a millisecond earlier.
+            spans.append(Span(t - 1000, t + not_afk - 1000, "not-afk"))
+        elif roll < 0.08:  # noqa: PLR2004
+            # Opened the computer from suspend but did not touch it.
+            spans.append(Span(t - afk // 2, t - afk // 2, "not-afk"))
+        elif roll < 0.1:  # noqa: PLR2004
+            # Overlaps into the afk event before it.
+            spans.append(Span(t - afk // 3, t + SECOND, "not-afk"))
+        t -= afk
+        spans.append(Span(t, t + afk, "afk"))
+    return sorted(spans, key=lambda span: span.start, reverse=True)
+
+
+def logged_absences(stream: list[Span], n: int, seed: int = 0) -> list[Span]:
+    """n logged absences about half an hour apart up to the end of the stream, oldest first.
+
+    Each one is one of the gaps in the stream, so a long history reaches further back than the stream.
+    """
+    rng = random.Random(seed)
+    t = max(span.end for span in stream)
+    spans = []
+    for _ in range(n):
+        duration = rng.randint(5 * 60, 30 * 60) * SECOND
+        t -= duration + rng.randint(10 * 60, 50 * 60) * SECOND
+        spans.append(Span(t, t + duration, "answer"))
+    return spans[::-1]
@@ -0,0 +1,38 @@
+"""Benchmarks for filtering the abbreviations in the settings.
+
+Run them with `hatch run bench:run`. Each key typed into the filter runs a search, so it should stay well under a
+frame even with tens of thousands of abbreviations.
+"""
+
+import random
+
+import pytest
+
+from aw_watcher_ask_away.abbreviations import AbbreviationIndex
+
+SCALES = [1_000, 10_000, 100_000]
+WORDS = ["be", "right", "back", "thank", "you", "on", "my", "way", "lunch", "meeting", "with", "the", "team"]
+
+
+def _index(n: int) -> AbbreviationIndex:
+    rng = random.Random(0)
+    return AbbreviationIndex((f"abbr{i}", " ".join(rng.choices(WORDS, k=4))) for i in range(n))
+
+
+@pytest.mark.parametrize("n", SCALES)
+def test_filter_while_typing(benchmark, n):
+    index = _index(n)
+
+    def type_filter():
+        for i in range(1, len("meeting") + 1):
+            index.search("meeting"[:i])
+        index.search("")
+
+    benchmark(type_filter)
+
+
+@pytest.mark.parametrize("n", SCALES)
+def test_filter_from_scratch(benchmark, n):
+    index = _index(n)
+    queries = iter(["lunch", "team", "thank"] * 1_000_000)
+    benchmark(lambda: index.search(next(queries)))
@@ -0,0 +1,69 @@
+"""Benchmarks for finding unlogged absences in the afk events.
+
+Run them with `hatch run bench:run`, which saves the results under benchmarks/.results, and compare against the last
+saved run with `hatch run bench:compare`.
+"""
+
+import tracemalloc
+
+import pytest
+from synthetic import afk_stream, logged_absences
+
+from aw_watcher_ask_away.core import AWAskAwayState, get_gaps, is_afk, squash_overlaps
+
+SCALES = [100, 1_000, 10_000, 100_000]
+HISTORY_SIZES = [10, 1_000, 100_000]
+
+
+def _record_peak(benchmark, fn, *args):
+    """Run fn once more under tracemalloc and save the peak memory with the timings."""
+    tracemalloc.start()
+    try:
+        fn(*args)
+        benchmark.extra_info["peak_kib"] = tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize("n", SCALES)
+def test_squash_overlaps(benchmark, n):
+    spans = [span for span in afk_stream(n) if not is_afk(span)]
+    benchmark(squash_overlaps, spans)
+    _record_peak(benchmark, squash_overlaps, spans)
+
+
+@pytest.mark.parametrize("n", SCALES)
+def test_get_gaps(benchmark, n):
+    spans = [span for span in afk_stream(n) if not is_afk(span)]
+
+    def gaps():
+        return list(get_gaps(spans))
+
+    benchmark(gaps)
+    _record_peak(benchmark, gaps)
+
+
+@pytest.mark.parametrize("history", HISTORY_SIZES)
+@pytest.mark.parametrize("n", SCALES[:3])
+def test_get_unseen_afk_events(benchmark, n, history):
+    stream = afk_stream(n)
+    state = AWAskAwayState(logged_absences(stream, history))
+
+    def unseen():
+        return list(state.get_unseen_afk_events(stream, recency_thresh=float("inf"), durration_thresh=300))
+
+    benchmark(unseen)
+    _record_peak(benchmark, unseen)
+
+
+@pytest.mark.parametrize("history", HISTORY_SIZES)
+def test_has_event(benchmark, history):
+    stream = afk_stream(1_000)
+    state = AWAskAwayState(logged_absences(stream, history))
+    gaps = list(get_gaps(span for span in stream if not is_afk(span)))
+
+    def check():
+        return [state.has_event(gap) for gap in gaps]
+
+    benchmark(check)
+    _record_peak(benchmark, check)
@@ -0,0 +1,75 @@
+"""How long the prompt takes to show up, reusing one prompt window compared with building a new one each time.
+
+They need a display and are skipped without one. Run them with `hatch run bench:run benchmarks/test_dialog.py`.
+"""
+
+import tkinter as tk
+import tracemalloc
+
+import pytest
+
+from aw_watcher_ask_away.dialog import AWAskAwayDialog, get_dialog, get_root
+
+HISTORY = [f"answer {i}" for i in range(100)]
+PROMPTS = 2_000
+
+
+@pytest.fixture(scope="module")
+def root() -> tk.Tk:
+    try:
+        return get_root()
+    except tk.TclError as e:
+        pytest.skip(f"Tk needs a display: {e}")
+
+
+def show(dialog: AWAskAwayDialog):
+    dialog.show("AFK Checkin", "What were you doing?", HISTORY)
+    # Draw it, not only map it.
+    dialog.update_idletasks()
+
+
+@pytest.mark.benchmark(group="dialog")
+def test_show_reused(benchmark, root):  # noqa: ARG001
+    dialog = get_dialog()
+    benchmark.pedantic(show, args=(dialog,), teardown=dialog.cancel, rounds=50, warmup_rounds=1)
+
+
+@pytest.mark.benchmark(group="dialog")
+def test_show_built_per_prompt(benchmark, root):
+    """How the prompt used to be shown, building the whole window for every prompt and destroying it after."""
+    dialogs = []
+
+    def build_and_show():
+        dialogs.append(dialog := AWAskAwayDialog(root))
+        show(dialog)
+
+    def destroy():
+        dialogs.pop().destroy()
+
+    benchmark.pedantic(build_and_show, teardown=destroy, rounds=50, warmup_rounds=1)
+
+
+def test_memory_is_flat(root):
+    """Showing the same window over and over should not keep anything around, in Python or in Tcl."""
+    dialog = get_dialog()
+
+    def prompt():
+        show(dialog)
+        dialog.set_text("lunch")
+        dialog.resync_expander()
+        dialog.cancel()
+
+    for _ in range(100):
+        prompt()
+    commands = len(root.tk.call("info", "commands"))
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for _ in range(PROMPTS):
+            prompt()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    growth = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    assert growth < 64 * 1024
+    assert len(root.tk.call("info", "commands")) == commands
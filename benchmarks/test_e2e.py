@@ -0,0 +1,133 @@
+"""Run the whole watch loop against the fake server and measure it.
+
+This measures how long it takes from coming back to the computer until the prompt is shown, and how many calls the
+watcher makes to the server. Run `python -m benchmarks.test_e2e` for a report, or run it with the other benchmarks to
+save the numbers with them.
+"""
+
+import asyncio
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from aw_watcher_ask_away.core import ALL_HOSTS, AWAskAwayClient
+from aw_watcher_ask_away.outbox import Outbox
+from aw_watcher_ask_away.runtime import DialogWorker, Runtime
+from aw_watcher_ask_away.scheduler import PollScheduler
+from tests.fake_server import FakeActivityWatchClient
+
+BREAKS = 3
+
+
+def run_scenario(
+    *,
+    breaks: int = BREAKS,
+    away: float = 0.5,
+    back: float = 0.3,
+    latency: float = 0,
+    error_rate: float = 0,
+    min_interval: float = 0.05,
+    max_interval: float = 0.4,
+) -> dict[str, Any]:
+    """Take a few breaks of `away` seconds, `back` seconds apart, and answer every prompt right away.
+
+    Answers go through an outbox like they do in the watcher, so a failed insert is retried instead of lost.
+    """
+    fake = FakeActivityWatchClient(latency=latency)
+    fake.set_afk(False)
+    tmp_dir = tempfile.TemporaryDirectory()
+    outbox = Outbox(fake, Path(tmp_dir.name) / "outbox.jsonl")  # pyright: ignore[reportArgumentType]
+    outbox.start()
+    client = AWAskAwayClient(fake, outbox=outbox)
+    fake.error_rate = error_rate
+
+    returned: list[float] = []
+    prompted: list[float] = []
+
+    def ask(event, history):  # noqa: ARG001
+        prompted.append(time.perf_counter())
+        return f"break {len(prompted)}"
+
+    dialogs = DialogWorker()
+    runtime = Runtime(
+        client, dialogs, ask, PollScheduler(min_interval, max_interval), depth=60, length=away / 2, snooze=0
+    )
+
+    async def take_breaks():
+        task = asyncio.create_task(runtime.run())
+        for _ in range(breaks):
+            await asyncio.sleep(back)
+            fake.set_afk(True)
+            await asyncio.sleep(away)
+            fake.set_afk(False)
+            returned.append(time.perf_counter())
+            async with asyncio.timeout(10 * max_interval + 100 * latency + 5):
+                while len(prompted) < len(returned):
+                    await asyncio.sleep(0.005)
+        task.cancel()
+
+    started = time.perf_counter()
+    asyncio.run(take_breaks())
+    elapsed = time.perf_counter() - started
+    dialogs.stop()
+    # Let whatever is still waiting in the outbox through.
+    fake.error_rate = 0
+    outbox.stop()
+    tmp_dir.cleanup()
+
+    latencies = [p - r for p, r in zip(prompted, returned, strict=True)]
+    return {
+        "prompt_latency_median": statistics.median(latencies),
+        "prompt_latency_max": max(latencies),
+        "calls_per_hour": sum(fake.calls.values()) / elapsed * 3600,
+        "calls": dict(fake.calls),
+        "pending": outbox.depth,
+        "logged": len(fake.events(client.bucket_id)),
+    }
+
+
+def test_prompt_latency(benchmark):
+    result = benchmark.pedantic(run_scenario, rounds=1, iterations=1)
+    benchmark.extra_info.update(result)
+    assert result["logged"] == BREAKS
+    # The wait between polls doubles while away, so coming back is noticed within one max_interval plus a poll.
+    assert result["prompt_latency_max"] < 0.4 + 0.3
+
+
+def test_slow_and_flaky_server(benchmark):
+    result = benchmark.pedantic(run_scenario, kwargs={"latency": 0.01, "error_rate": 0.2}, rounds=1, iterations=1)
+    benchmark.extra_info.update(result)
+    # Every break is still asked about exactly once.
+    assert result["logged"] == BREAKS
+
+
+@pytest.mark.parametrize("hosts", [1, 4, 8])
+def test_poll_latency_with_many_hosts(benchmark, hosts):
+    """With 10 ms per request the buckets are fetched at once, so a poll should take about 10 ms for any count."""
+    fake = FakeActivityWatchClient(latency=0.01)
+    fake.set_afk(False)
+    for i in range(1, hosts):
+        fake.create_bucket(f"aw-watcher-afk_host{i}", "afkstatus")
+        fake.set_afk(False, bucket_id=f"aw-watcher-afk_host{i}")
+    client = AWAskAwayClient(fake, afk_hosts=[ALL_HOSTS])
+    assert len(client.afk_bucket_ids) == hosts
+    client.fetch_afk_events(600)
+    benchmark(client.fetch_afk_events, 600)
+
+
+if __name__ == "__main__":
+    for name, kwargs in [
+        ("fast server", {}),
+        ("10 ms latency", {"latency": 0.01}),
+        ("10 ms latency and 20% errors", {"latency": 0.01, "error_rate": 0.2}),
+    ]:
+        result = run_scenario(**kwargs)
+        print(
+            f"{name}: prompt after {result['prompt_latency_median'] * 1000:.0f} ms "
+            f"(max {result['prompt_latency_max'] * 1000:.0f} ms), {result['calls_per_hour']:.0f} calls per hour, "
+            f"{result['calls']}"
+        )
@@ -1,49 +1,195 @@
 # ruff: noqa: EM101, EM102
 import argparse
+import asyncio
+import contextlib
+import datetime
+import sys
 import time
-from collections.abc import Iterable
-from tkinter import messagebox
+from collections.abc import Callable
+from functools import partial
+from pathlib import Path
 
-import aw_core
 from aw_client.client import ActivityWatchClient
 from aw_core.log import setup_logging
-from requests.exceptions import ConnectionError
+from requests.exceptions import ConnectionError, Timeout
 
-import aw_watcher_ask_away.dialog as aw_dialog
+import aw_watcher_ask_away.repair as aw_repair
+from aw_watcher_ask_away import metrics
+from aw_watcher_ask_away.cache import StateCache
 from aw_watcher_ask_away.core import (
-    DATA_KEY,
+    ALL_HOSTS,
     LOCAL_TIMEZONE,
     WATCHER_NAME,
     AWAskAwayClient,
     AWWatcherAskAwayError,
+    Span,
+    from_micros,
+    get_utc_now,
     logger,
 )
+from aw_watcher_ask_away.outbox import Outbox
+from aw_watcher_ask_away.readiness import READY_TIMEOUT, Readiness, http_probe
+from aw_watcher_ask_away.runtime import DialogWorker, Runtime, Snooze
+from aw_watcher_ask_away.scheduler import PollScheduler
+from aw_watcher_ask_away.transport import READ_TIMEOUT, PooledClient
 
 
-def prompt(event: aw_core.Event, recent_events: Iterable[aw_core.Event]):
+def prompt_text(event: Span) -> str:
     # TODO: Allow for customizing the prompt from the prompt interface.
-    start_time_str = event.timestamp.astimezone(LOCAL_TIMEZONE).strftime("%I:%M")
-    end_time_str = (event.timestamp + event.duration).astimezone(LOCAL_TIMEZONE).strftime("%I:%M")
-    prompt = f"What were you doing from {start_time_str} - {end_time_str} ({event.duration.seconds / 60:.1f} minutes)?"
-    title = "AFK Checkin"
+    start_time_str = from_micros(event.start).astimezone(LOCAL_TIMEZONE).strftime("%I:%M")
+    end_time_str = from_micros(event.end).astimezone(LOCAL_TIMEZONE).strftime("%I:%M")
+    return f"What were you doing from {start_time_str} - {end_time_str} ({event.duration / 60_000_000:.1f} minutes)?"
 
-    return aw_dialog.ask_string(title, prompt, [event.data[DATA_KEY] for event in recent_events])
 
+def prompt(event: Span, history: list[str], suggest: Callable[..., list[str]] | None = None):
+    """Ask what you were doing during the absence. This must run on the DialogWorker thread."""
+    # Imported here so Tk is only loaded when a dialog is actually shown.
+    import aw_watcher_ask_away.dialog as aw_dialog
 
-def get_state_retries(client: ActivityWatchClient):
+    return aw_dialog.ask_string("AFK Checkin", prompt_text(event), history, suggest)
+
+
+def prepare_prompt():
+    """Build the prompt window ahead of time so it shows up quickly. This must run on the DialogWorker thread."""
+    import aw_watcher_ask_away.dialog as aw_dialog
+
+    aw_dialog.get_dialog()
+
+
+def prompt_stdin(event: Span, history: list[str]):  # noqa: ARG001
+    """Ask on stdin instead of with a dialog. An empty line skips the absence for now, like cancelling the dialog."""
+    print(prompt_text(event), flush=True)  # noqa: T201
+    line = sys.stdin.readline()
+    if not line:
+        raise AWWatcherAskAwayError("Reached the end of stdin, nothing is left to answer the prompts.")
+    return line.strip() or None
+
+
+def get_prompter(state: AWAskAwayClient, args: argparse.Namespace) -> Callable[[Span, list[str]], str | Snooze | None]:
+    if args.headless:
+        return prompt_stdin
+    return partial(prompt, suggest=state.suggestions.suggest)
+
+
+def show_error(message: str):
+    """Show an error message box. This must run on the DialogWorker thread."""
+    from tkinter import messagebox
+
+    from aw_watcher_ask_away.dialog import get_root
+
+    messagebox.showerror("AW Watcher Ask Away: Error", message, parent=get_root())
+
+
+def get_state_retries(
+    client: ActivityWatchClient,
+    history: datetime.timedelta,
+    cache: StateCache | None,
+    outbox: Outbox,
+    readiness: Readiness,
+    timeout: float = READY_TIMEOUT,
+    afk_hosts: list[str] | None = None,
+    *,
+    use_query: bool = False,
+    compact_within: float | None = None,
+):
     """When the computer is starting up sometimes the aw-server is not ready for requests yet.
 
-    So we sit and retry for a while before giving up.
+    So we wait for it to answer and try again, for up to timeout seconds. With a valid cache we do not need the server
+    to start.
     """
-    for _ in range(10):
+    deadline = time.monotonic() + timeout
+    while True:
         try:
             # This works because the constructor of AWAskAwayState tries to get bucket names.
             # If it didn't we'd need to do something else here.
-            return AWAskAwayClient(client)
-        except ConnectionError:
-            logger.exception("Cannot connect to client.")
-            time.sleep(10)  # 10 * 10 = wait for 100s before giving up.
-    raise AWWatcherAskAwayError("Could not get a connection to the server.")
+            return AWAskAwayClient(
+                client,
+                history,
+                cache,
+                outbox,
+                afk_hosts,
+                use_query=use_query,
+                compact_within=compact_within,
+                readiness=readiness,
+            )
+        except (ConnectionError, Timeout):
+            metrics.count("connect_retries")
+            logger.info("The server is not ready yet, waiting for it.")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise AWWatcherAskAwayError("Could not get a connection to the server.")
+        try:
+            waited = readiness.wait(remaining)
+        except AWWatcherAskAwayError:
+            raise AWWatcherAskAwayError("Could not get a connection to the server.") from None
+        logger.info(f"The server was ready after {waited:.2f} seconds.")
+
+
+def watch(state: AWAskAwayClient, args: argparse.Namespace, dialogs: DialogWorker):
+    if not args.headless:
+        # If there is no display this fails again on the first prompt, which reports it.
+        dialogs.submit(prepare_prompt)
+    runtime = Runtime(
+        state,
+        dialogs,
+        get_prompter(state, args),
+        PollScheduler(args.frequency, args.max_frequency),
+        depth=args.depth * 60,
+        length=args.length * 60,
+        readiness=Readiness(http_probe(state.client.server_address)),
+    )
+    asyncio.run(runtime.run())
+
+
+def backfill(state: AWAskAwayClient, args: argparse.Namespace, dialogs: DialogWorker):
+    # Imported here because NumPy is only needed for this command.
+    from aw_watcher_ask_away.backfill import backfill
+
+    if args.prompt and not args.headless:
+        dialogs.submit(prepare_prompt)
+
+    def ask(event: Span) -> str | None:
+        history = [e.label for e in state.state.recent_events]
+        response = dialogs.submit(get_prompter(state, args), event, history).result()
+        # There is nothing to come back to while backfilling, so a snooze is the same as a skip.
+        return response if isinstance(response, str) else None
+
+    backfill(
+        state,
+        since=args.since,
+        until=args.until or get_utc_now(),
+        durration_thresh=args.length * 60,
+        batch_size=args.batch_size,
+        ask=ask if args.prompt else None,
+    )
+
+
+def repair(state: AWAskAwayClient, args: argparse.Namespace, dialogs: DialogWorker):  # noqa: ARG001
+    aw_repair.repair(
+        state,
+        since=args.since or aw_repair.oldest_start(state),
+        until=args.until or get_utc_now(),
+        strategy=args.fix,
+        batch_size=args.batch_size,
+        dry_run=args.dry_run,
+    )
+
+
+def compact(state: AWAskAwayClient, args: argparse.Namespace, dialogs: DialogWorker):  # noqa: ARG001
+    aw_repair.compact(
+        state,
+        since=args.since or aw_repair.oldest_start(state),
+        until=args.until or get_utc_now(),
+        within=args.within * 60,
+        batch_size=args.batch_size,
+        dry_run=args.dry_run,
+    )
+
+
+def parse_datetime(value: str) -> datetime.datetime:
+    """Parse an ISO 8601 date or datetime, assuming the local timezone if none is given."""
+    timestamp = datetime.datetime.fromisoformat(value)
+    return timestamp if timestamp.tzinfo else timestamp.astimezone()
 
 
 def main():
@@ -52,13 +198,177 @@ def main():
         "--depth", type=float, default=10, help="The number of minutes to look into the past for events."
     )
     parser.add_argument(
-        "--frequency", type=float, default=5, help="The number of seconds to wait before checking for AFK events again."
+        "--frequency",
+        "--min-frequency",
+        dest="frequency",
+        type=float,
+        default=5,
+        help="The number of seconds to wait before checking for AFK events again while you are at the computer.",
+    )
+    parser.add_argument(
+        "--max-frequency",
+        type=float,
+        default=10,
+        help=(
+            "The most seconds to wait between checks while you are AFK. The wait doubles each check until it gets "
+            "here. Larger values mean fewer requests while you are away but a longer wait for the prompt when you "
+            "get back."
+        ),
     )
     parser.add_argument(
         "--length", type=float, default=5, help="The number of minutes you need to be away before reporting on it."
     )
+    parser.add_argument(
+        "--history",
+        type=float,
+        default=7,
+        help="The number of days of logged absences to remember so you are never asked about them twice.",
+    )
+    parser.add_argument(
+        "--afk-hosts",
+        nargs="+",
+        default=None,
+        metavar="HOST",
+        help=(
+            "Whose afk buckets to watch, this computer's by default. With several, being active on any of them counts "
+            f"as being back. Use {ALL_HOSTS} for every computer that reports to the server."
+        ),
+    )
+    parser.add_argument(
+        "--compact-within",
+        type=float,
+        default=None,
+        metavar="MINUTES",
+        help=(
+            "Join an answer onto the previous absence instead of logging a new one when they are the same and at most "
+            "this many minutes apart, so a short return in the middle of lunch does not leave two records."
+        ),
+    )
+    parser.add_argument(
+        "--query",
+        action="store_true",
+        help=(
+            "Have the server merge the not-afk events with a query and only send back the merged periods, instead of "
+            "fetching every afk event. It sends less with a long --depth or backfill, or a server on another computer."
+        ),
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Do not restore or save what the watcher knows between runs."
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="Ask on stdin instead of with dialogs, so the watcher can run without a display.",
+    )
+    parser.add_argument(
+        "--ready-timeout",
+        type=float,
+        default=READY_TIMEOUT,
+        help="The number of seconds to wait for the server to start before giving up. Use inf to wait forever.",
+    )
+    parser.add_argument(
+        "--request-timeout",
+        type=float,
+        default=READ_TIMEOUT,
+        help="The number of seconds to wait for the server to answer a request before giving up on it.",
+    )
+    parser.add_argument(
+        "--gzip", action="store_true", help="Ask the server to compress its responses, for when it is not local."
+    )
+    parser.add_argument(
+        "--metrics",
+        type=Path,
+        default=None,
+        help=(
+            "Time the polls, server calls and prompts and write snapshots to this file. A file ending in .prom is "
+            "overwritten in the Prometheus text format, anything else gets a JSON line per snapshot."
+        ),
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=metrics.INTERVAL,
+        help="The number of seconds between metrics snapshots.",
+    )
+    parser.add_argument(
+        "--profile", type=Path, default=None, help="Profile the watcher with cProfile and write the stats here on exit."
+    )
     parser.add_argument("--testing", action="store_true", help="Run in testing mode.")
     parser.add_argument("--verbose", action="store_true", help="I want to see EVERYTHING!")
+    parser.set_defaults(command=watch)
+
+    subparsers = parser.add_subparsers(title="commands")
+    backfill_parser = subparsers.add_parser(
+        "backfill",
+        help="Find absences that were never logged, like ones from while the watcher was not running.",
+        description="Find absences that were never logged. Needs NumPy installed.",
+    )
+    backfill_parser.add_argument(
+        "--since", type=parse_datetime, required=True, help="Where to start looking, as an ISO 8601 date or datetime."
+    )
+    backfill_parser.add_argument(
+        "--until", type=parse_datetime, default=None, help="Where to stop looking. Defaults to now."
+    )
+    backfill_parser.add_argument(
+        "--prompt", action="store_true", help="Ask what you were doing for each absence instead of listing them."
+    )
+    backfill_parser.add_argument(
+        "--batch-size", type=int, default=20, help="How many absences to list or log at a time."
+    )
+    backfill_parser.set_defaults(command=backfill)
+
+    repair_parser = subparsers.add_parser(
+        "repair",
+        help="Find logged absences that overlap or are logged twice, and optionally fix them.",
+        description=(
+            "Find logged absences that overlap or are logged twice. Duplicates are fixed by deleting the later one, "
+            "overlaps with the --fix strategy: merge them into one, trim the later one, or delete the later one."
+        ),
+    )
+    repair_parser.add_argument(
+        "--since",
+        type=parse_datetime,
+        default=None,
+        help="Where to start looking, as an ISO 8601 date or datetime. Defaults to the oldest record.",
+    )
+    repair_parser.add_argument(
+        "--until", type=parse_datetime, default=None, help="Where to stop looking. Defaults to now."
+    )
+    repair_parser.add_argument(
+        "--fix", choices=aw_repair.STRATEGIES, default=None, help="Fix the problems found this way."
+    )
+    repair_parser.add_argument(
+        "--dry-run", action="store_true", help="Say what --fix would change without changing anything."
+    )
+    repair_parser.add_argument("--batch-size", type=int, default=100, help="How many records to change at a time.")
+    repair_parser.set_defaults(command=repair)
+
+    compact_parser = subparsers.add_parser(
+        "compact",
+        help="Join runs of logged absences with the same answer into one.",
+        description=(
+            "Join each run of logged absences that have the same answer and are at most --within minutes apart into "
+            "one, like --compact-within does as they are logged. The records are rewritten a batch at a time."
+        ),
+    )
+    compact_parser.add_argument(
+        "--since",
+        type=parse_datetime,
+        default=None,
+        help="Where to start, as an ISO 8601 date or datetime. Defaults to the oldest record.",
+    )
+    compact_parser.add_argument("--until", type=parse_datetime, default=None, help="Where to stop. Defaults to now.")
+    compact_parser.add_argument(
+        "--within",
+        type=float,
+        default=aw_repair.COMPACT_WITHIN / 60,
+        help="How many minutes apart absences with the same answer can be and still be joined.",
+    )
+    compact_parser.add_argument(
+        "--dry-run", action="store_true", help="Say what would be joined without changing anything."
+    )
+    compact_parser.add_argument("--batch-size", type=int, default=100, help="How many records to change at a time.")
+    compact_parser.set_defaults(command=compact)
     args = parser.parse_args()
 
     # Set up logging
@@ -70,25 +380,52 @@ def main():
         log_file=True,
     )
 
+    metrics_writer = None
+    if args.metrics is not None:
+        metrics_writer = metrics.MetricsWriter(metrics.enable(), args.metrics, args.metrics_interval)
+        metrics_writer.start()
+
+    dialogs = DialogWorker()
     try:
-        client = ActivityWatchClient(  # pyright: ignore[reportPrivateImportUsage]
-            client_name=WATCHER_NAME, testing=args.testing
+        client = PooledClient(
+            client_name=WATCHER_NAME, testing=args.testing, read_timeout=args.request_timeout, gzip=args.gzip
         )
         with client:
-            state = get_state_retries(client)
-            logger.info("Successfully connected to the server.")
-
-            while True:
-                for event in state.get_new_afk_events_to_note(
-                    seconds=args.depth * 60, durration_thresh=args.length * 60
-                ):
-                    if response := prompt(event, state.state.recent_events):
-                        logger.info(response)
-                        state.post_event(event, response)
-                time.sleep(args.frequency)
+            cache = None if args.no_cache else StateCache()
+            outbox = Outbox(client)
+            outbox.start()
+            try:
+                readiness = Readiness(http_probe(client.server_address))
+                history = datetime.timedelta(days=args.history)
+                state = get_state_retries(
+                    client,
+                    history,
+                    cache,
+                    outbox,
+                    readiness,
+                    args.ready_timeout,
+                    args.afk_hosts,
+                    use_query=args.query,
+                    compact_within=None if args.compact_within is None else args.compact_within * 60,
+                )
+                logger.info("Successfully connected to the server.")
+                try:
+                    with metrics.profile(args.profile) if args.profile else contextlib.nullcontext():
+                        args.command(state, args, dialogs)
+                finally:
+                    state.save_cache()
+            finally:
+                outbox.stop()
+                if outbox.depth:
+                    logger.warning(f"{outbox.depth} events could not be sent yet, they will be sent on the next run.")
     except Exception as e:
-        messagebox.showerror("AW Watcher Ask Away: Error", f"An unhandled exception occurred: {e}")
+        if not args.headless:
+            dialogs.submit(show_error, f"An unhandled exception occurred: {e}").result()
         raise
+    finally:
+        dialogs.stop()
+        if metrics_writer is not None:
+            metrics_writer.stop()
 
 
 if __name__ == "__main__":
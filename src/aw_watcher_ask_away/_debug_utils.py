@@ -1,12 +1,10 @@
-# ruff: noqa: T203, T201
-import pprint
+# ruff: noqa: T201
 from functools import cache
-from itertools import pairwise
 
-import aw_transform
 from aw_client.client import ActivityWatchClient
 
 from aw_watcher_ask_away.core import AWAskAwayClient
+from aw_watcher_ask_away.repair import Record, Repair
 
 
 @cache
@@ -18,16 +16,16 @@ def find_overlapping_events():
     """Find overlapping aw-watcher-ask-away events.
 
     If any of these exist it means the user was asked for something twice which is annoying and should be fixed.
+    The repair command does the same for the whole bucket and can fix them.
     """
     with get_client() as client:
         state = AWAskAwayClient(client)
-        for e1, e2 in pairwise(aw_transform.sort_by_timestamp(client.get_events(state.bucket_id, limit=100))):
-            if e1.timestamp + e1.duration > e2.timestamp:
-                print("---" * 10)
-                print("Overlapping events:")
-                pprint.pprint(e1)
-                pprint.pprint(e2)
+        plan = Repair()
+        # The absences logged within the history window, which are already sorted by start.
+        plan.scan(Record(span.start, span.end, span.label) for span in state.state.logged)
+        for problem in plan.problems:
+            print(problem)
 
 
-if __name__:
+if __name__ == "__main__":
     find_overlapping_events()
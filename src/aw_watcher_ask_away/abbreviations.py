@@ -0,0 +1,325 @@
+"""Store abbreviations and expand them as they are typed.
+
+The abbreviations are kept in a trie and the Expander follows along with each typed character, so the work per
+keystroke depends on the length of the word being typed and not on how many abbreviations there are.
+"""
+
+import atexit
+import bisect
+import json
+import logging
+import os
+import threading
+from collections import Counter, UserDict
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+import appdirs
+
+from aw_watcher_ask_away.cache import write_atomically
+
+logger = logging.getLogger(__name__)
+
+SAVE_DELAY = 1
+"""How many seconds to wait after a change before saving, so a burst of changes is written once."""
+
+
+def is_token_char(char: str) -> bool:
+    """Whether the character can be part of an abbreviation.
+
+    ' counts so if you have s as an abbreviation "what's" doesn't expand to what is.
+    """
+    return char.isalnum() or char in "_'"
+
+
+class _Node:
+    __slots__ = ("children", "expansion")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        self.expansion: str | None = None
+
+
+class AbbreviationTrie:
+    """Abbreviations and their expansions in a character trie.
+
+    An abbreviation can be several words separated by single spaces, like "ty vm".
+    """
+
+    def __init__(self, items: Iterable[tuple[str, str]] = ()):
+        self.root = _Node()
+        self._lengths: Counter[int] = Counter()
+        for key, expansion in items:
+            self.add(key, expansion)
+
+    def __len__(self):
+        return self._lengths.total()
+
+    @property
+    def longest(self) -> int:
+        """The length of the longest abbreviation."""
+        return max(self._lengths, default=0)
+
+    def _find(self, key: str) -> _Node | None:
+        node = self.root
+        for char in key:
+            if (node := node.children.get(char)) is None:
+                return None
+        return node
+
+    def get(self, key: str) -> str | None:
+        node = self._find(key)
+        return None if node is None else node.expansion
+
+    def add(self, key: str, expansion: str):
+        node = self.root
+        for char in key:
+            node = node.children.setdefault(char, _Node())
+        if node.expansion is None:
+            self._lengths[len(key)] += 1
+        node.expansion = expansion
+
+    def remove(self, key: str):
+        path = [self.root]
+        for char in key:
+            if (node := path[-1].children.get(char)) is None:
+                return
+            path.append(node)
+        if path[-1].expansion is None:
+            return
+        path[-1].expansion = None
+        self._lengths[len(key)] -= 1
+        if not self._lengths[len(key)]:
+            del self._lengths[len(key)]
+        # Drop the nodes that no longer lead to any abbreviation.
+        for char, parent, node in zip(reversed(key), reversed(path[:-1]), reversed(path[1:]), strict=True):
+            if node.children or node.expansion is not None:
+                break
+            del parent.children[char]
+
+    def _walk(self, node: _Node, key: str) -> Iterator[tuple[str, str]]:
+        if node.expansion is not None:
+            yield key, node.expansion
+        for char in sorted(node.children):
+            yield from self._walk(node.children[char], key + char)
+
+    def completions(self, prefix: str, limit: int = 3) -> list[tuple[str, str]]:
+        """The first few (abbreviation, expansion) pairs that start with the prefix, in alphabetical order."""
+        if not prefix or (node := self._find(prefix)) is None:
+            return []
+        completions = []
+        for item in self._walk(node, prefix):
+            completions.append(item)
+            if len(completions) == limit:
+                break
+        return completions
+
+
+class Expander:
+    """Follow the text before the cursor as it is typed and say when an abbreviation was just finished.
+
+    It keeps the partial matches that started at the beginning of a word, so finishing an abbreviation only needs the
+    character that was just typed instead of scanning the text again. Anything other than typing a character (like
+    deleting or moving the cursor) should be followed by a call to reset with the text before the cursor.
+    """
+
+    def __init__(self, trie: AbbreviationTrie):
+        self.trie = trie
+        self.token = ""
+        """The part of the word before the cursor."""
+        self._matches: list[tuple[_Node, int]] = []
+        """The nodes for the abbreviations the text could still be finishing, with how many characters they cover."""
+        self._at_word_start = True
+
+    def reset(self, text_before_cursor: str = ""):
+        self.token = ""
+        self._matches = []
+        # Only the end of the text can be part of an abbreviation.
+        tail = text_before_cursor[-(self.trie.longest + 1) :]
+        self._at_word_start = len(tail) == len(text_before_cursor)
+        for char in tail:
+            self.feed(char)
+
+    def feed(self, char: str) -> tuple[int, str] | None:
+        """Follow a typed character.
+
+        Returns the length of the abbreviation right before it and its expansion, if it finished one.
+        """
+        if is_token_char(char):
+            self.token += char
+            matches = [(child, n + 1) for node, n in self._matches if (child := node.children.get(char))]
+            if self._at_word_start and (child := self.trie.root.children.get(char)):
+                matches.append((child, 1))
+            self._matches = matches
+            self._at_word_start = False
+            return None
+
+        finished = None
+        if char.isspace():
+            # The longest abbreviation that ends here wins.
+            finished = max(((n, node.expansion) for node, n in self._matches if node.expansion), default=None)
+        if char.isspace() and finished is None:
+            # Abbreviations with several words carry on through the space.
+            self._matches = [(child, n + 1) for node, n in self._matches if (child := node.children.get(char))]
+        else:
+            self._matches = []
+        self.token = ""
+        self._at_word_start = True
+        return finished
+
+    def completions(self, limit: int = 3) -> list[tuple[str, str]]:
+        """The abbreviations that start with the word being typed."""
+        return self.trie.completions(self.token, limit)
+
+
+class AbbreviationIndex:
+    """Find the abbreviations whose abbreviation or expansion contains some text, ignoring case.
+
+    This backs the filter in the settings, so it has to keep up with every key typed into it with thousands of
+    abbreviations. The last search is remembered and typing more of the filter only looks through what matched it,
+    since anything that contains the longer text also contains the shorter one.
+    """
+
+    def __init__(self, items: Iterable[tuple[str, str]] = ()):
+        self._text = {key: self._searchable(key, expansion) for key, expansion in items}
+        self._keys = sorted(self._text)
+        self._last: tuple[str, list[str]] = ("", self._keys)
+
+    @staticmethod
+    def _searchable(key: str, expansion: str) -> str:
+        return f"{key}\n{expansion}".casefold()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key: str, expansion: str):
+        if key not in self._text:
+            bisect.insort(self._keys, key)
+        self._text[key] = self._searchable(key, expansion)
+        self._last = ("", self._keys)
+
+    def remove(self, key: str):
+        if self._text.pop(key, None) is None:
+            return
+        del self._keys[bisect.bisect_left(self._keys, key)]
+        self._last = ("", self._keys)
+
+    def matches(self, key: str, query: str) -> bool:
+        return query.casefold() in self._text[key]
+
+    def search(self, query: str) -> list[str]:
+        """The abbreviations that match the query, in alphabetical order."""
+        query = query.casefold()
+        last_query, last = self._last
+        candidates = last if last_query in query else self._keys
+        results = [key for key in candidates if query in self._text[key]]
+        self._last = (query, results)
+        return list(results)
+
+
+class AbbreviationStore(UserDict[str, str]):
+    """A class to store abbreviations and their expansions.
+
+    And to manage saving this information to the config directory. Changes are saved in the background SAVE_DELAY
+    seconds after the first one (and when the program exits) so adding lots of abbreviations at once only writes the
+    file once. Call reload_if_changed to pick up changes another instance saved.
+    """
+
+    def __init__(self, path: Path | None = None, save_delay: float = SAVE_DELAY):
+        self.trie = AbbreviationTrie()
+        """The same abbreviations in a trie for the Expander, kept up to date with every change."""
+        super().__init__()
+        if path is None:
+            config_dir = Path(appdirs.user_config_dir("aw-watcher-ask-away"))
+            config_dir.mkdir(parents=True, exist_ok=True)
+            path = config_dir / "abbreviations.json"
+        self._config_file = path
+        self._save_delay = save_delay
+        self._lock = threading.RLock()
+        self._timer: threading.Timer | None = None
+        self._changes: dict[str, str | None] = {}
+        """What changed since the last save, with None for deleted abbreviations."""
+        self._mtime: int | None = None
+        """The modification time of the file when we last read or wrote it."""
+        self.reload_if_changed()
+        atexit.register(self.flush)
+
+    def _stat_mtime(self) -> int | None:
+        try:
+            return self._config_file.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _read_config(self) -> dict[str, str]:
+        try:
+            with self._config_file.open() as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError:
+            # Move it aside instead of overwriting it on the next save so nothing is lost for good.
+            broken = self._config_file.with_suffix(".broken.json")
+            logger.exception(f"Failed to load abbreviations from config file, moved it to {broken}.")
+            os.replace(self._config_file, broken)
+            return {}
+
+    def _with_changes(self, data: dict[str, str]) -> dict[str, str]:
+        for key, value in self._changes.items():
+            if value is None:
+                data.pop(key, None)
+            else:
+                data[key] = value
+        return data
+
+    def reload_if_changed(self):
+        """Load the file again if it changed since we last read or wrote it. Unsaved changes are kept."""
+        with self._lock:
+            if (mtime := self._stat_mtime()) == self._mtime:
+                return
+            loaded = self._with_changes(self._read_config())
+            self._mtime = mtime
+            # Update the trie in place since Expanders hold on to it.
+            for key in self.data.keys() - loaded.keys():
+                self.trie.remove(key)
+            for key, value in loaded.items():
+                if self.data.get(key) != value:
+                    self.trie.add(key, value)
+            self.data = loaded
+
+    def _change(self, key: str, value: str | None):
+        self._changes[key] = value
+        if self._timer is None:
+            self._timer = threading.Timer(self._save_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def __setitem__(self, key: str, value: str):
+        with self._lock:
+            self.data[key] = value
+            self.trie.add(key, value)
+            self._change(key, value)
+
+    def __delitem__(self, key: str) -> None:
+        with self._lock:
+            del self.data[key]
+            self.trie.remove(key)
+            self._change(key, None)
+
+    def flush(self):
+        """Save the changes now."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._changes:
+                return
+            if self._stat_mtime() == self._mtime:
+                data = self.data
+            else:
+                # Another instance saved in the meantime, so put our changes on top of theirs.
+                data = self._with_changes(self._read_config())
+            self._changes = {}
+            write_atomically(self._config_file, json.dumps(data, indent=4))
+            if data is self.data:
+                self._mtime = self._stat_mtime()
+            # Otherwise leave the old time so the next reload_if_changed picks up the other instance's changes.
@@ -0,0 +1,171 @@
+# ruff: noqa: EM101, EM102
+"""Find every absence in a date range that was never logged.
+
+The watcher only asks about absences that ended in the last --depth minutes, so anything that happened while it was
+not running is never asked about. This goes back over the whole afk bucket instead. It can be a lot of events, so the
+gaps are found with NumPy instead of a loop per event.
+"""
+
+import datetime
+from collections.abc import Callable, Iterable, Iterator
+
+from aw_watcher_ask_away.core import (
+    LOCAL_TIMEZONE,
+    OVERLAP_THRESH,
+    AWAskAwayClient,
+    AWWatcherAskAwayError,
+    Span,
+    from_micros,
+    is_afk,
+    logger,
+)
+from aw_watcher_ask_away.repair import Record, iter_records
+
+try:
+    import numpy as np
+except ImportError as e:
+    raise AWWatcherAskAwayError(
+        "The backfill command needs NumPy. Install it with `pipx inject aw-watcher-ask-away numpy`."
+    ) from e
+
+PAGE = datetime.timedelta(days=7)
+"""How much of a bucket to request at once."""
+
+
+def iter_periods(
+    since: datetime.datetime, until: datetime.datetime
+) -> Iterator[tuple[datetime.datetime, datetime.datetime]]:
+    start = since
+    while start < until:
+        end = min(start + PAGE, until)
+        yield start, end
+        start = end
+
+
+def iter_pages(
+    client: AWAskAwayClient, bucket_id: str, key: str, since: datetime.datetime, until: datetime.datetime
+) -> Iterator[list[Span]]:
+    for start, end in iter_periods(since, until):
+        yield client.get_events(bucket_id, key, start=start, end=end)
+
+
+def to_arrays(spans: Iterable[Span | Record]) -> tuple[np.ndarray, np.ndarray]:
+    """The (starts, ends) of the spans as int64 epoch microseconds."""
+    starts = []
+    ends = []
+    for span in spans:
+        starts.append(span.start)
+        ends.append(span.end)
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+
+def find_gaps(starts: np.ndarray, ends: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """The gaps between the union of the intervals, the same as core.find_gaps.
+
+    The running maximum of the ends (in start order) is how far the union reaches at each interval, so an interval
+    that starts past the reach of everything before it starts a new gap.
+    """
+    order = np.argsort(starts, kind="stable")
+    starts, ends = starts[order], ends[order]
+    reach = np.maximum.accumulate(ends)
+    is_gap = starts[1:] > reach[:-1]
+    return reach[:-1][is_gap], starts[1:][is_gap]
+
+
+def find_logged(
+    gap_starts: np.ndarray,
+    gap_ends: np.ndarray,
+    logged_starts: np.ndarray,
+    logged_ends: np.ndarray,
+    overlap_thresh: float = OVERLAP_THRESH,
+) -> np.ndarray:
+    """Which gaps have more than overlap_thresh of them covered by a single logged absence.
+
+    This is the same check as AWAskAwayState.has_event. The gaps must be sorted and not overlap, like the output of
+    find_gaps, but the logged absences can be in any order.
+    """
+    logged = np.zeros(len(gap_starts), dtype=bool)
+    # The gaps each logged absence touches are gaps[first:stop].
+    first = np.searchsorted(gap_ends, logged_starts, side="right")
+    stop = np.searchsorted(gap_starts, logged_ends, side="left")
+    touches = first < stop
+    first, stop, logged_starts, logged_ends = (
+        first[touches],
+        stop[touches],
+        logged_starts[touches],
+        logged_ends[touches],
+    )
+
+    # Every gap strictly between the first and last one is completely covered.
+    if overlap_thresh < 1:
+        inner = stop - first > 2  # noqa: PLR2004
+        depth = np.zeros(len(gap_starts) + 1, dtype=np.int64)
+        np.add.at(depth, first[inner] + 1, 1)
+        np.add.at(depth, stop[inner] - 1, -1)
+        logged |= np.cumsum(depth[:-1]) > 0
+
+    # The first and last gaps might only be partly covered.
+    for i in (first, stop - 1):
+        overlap = np.minimum(logged_ends, gap_ends[i]) - np.maximum(logged_starts, gap_starts[i])
+        covered = overlap / (gap_ends[i] - gap_starts[i]) > overlap_thresh
+        logged[i[covered]] = True
+    return logged
+
+
+def find_unlogged_absences(
+    client: AWAskAwayClient, since: datetime.datetime, until: datetime.datetime, durration_thresh: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """The absences longer than durration_thresh seconds between since and until that have not been logged."""
+    # With several afk buckets the gaps are in the union of their not-afk events, like in AWAskAwayState.
+    if client.use_query:
+        # Every page goes in one query and the server sends back only the merged not-afk periods.
+        not_afk = (span for not_afk, _ in client.query_not_afk(list(iter_periods(since, until))) for span in not_afk)
+    else:
+        afk_events = (
+            e
+            for bucket_id in client.afk_bucket_ids
+            for page in iter_pages(client, bucket_id, "status", since, until)
+            for e in page
+        )
+        not_afk = (e for e in afk_events if not is_afk(e))
+    # Zero length not-afk events are skipped for the same reason as in AWAskAwayState.get_unseen_afk_events.
+    gap_starts, gap_ends = find_gaps(*to_arrays(e for e in not_afk if e.duration > 0))
+    long_enough = gap_ends - gap_starts > durration_thresh * 1_000_000
+    gap_starts, gap_ends = gap_starts[long_enough], gap_ends[long_enough]
+
+    # Whole, since a logged absence cut in two where the pages meet does not cover most of its gap with either half.
+    logged_starts, logged_ends = to_arrays(iter_records(client, since, until))
+    unlogged = ~find_logged(gap_starts, gap_ends, logged_starts, logged_ends)
+    logger.info(f"Found {unlogged.sum()} unlogged absences out of {len(gap_starts)}.")
+    return gap_starts[unlogged], gap_ends[unlogged]
+
+
+def backfill(
+    client: AWAskAwayClient,
+    since: datetime.datetime,
+    until: datetime.datetime,
+    durration_thresh: float,
+    batch_size: int,
+    ask: Callable[[Span], str | None] | None = None,
+):
+    """Print the unlogged absences, or ask about each of them and log the answers a batch at a time."""
+    gap_starts, gap_ends = find_unlogged_absences(client, since, until, durration_thresh)
+    for batch_start in range(0, len(gap_starts), batch_size):
+        batch_stop = batch_start + batch_size
+        batch = [
+            span
+            for start, end in zip(
+                gap_starts[batch_start:batch_stop].tolist(), gap_ends[batch_start:batch_stop].tolist(), strict=True
+            )
+            # Already answered but still waiting in the outbox, or logged since the bucket was read.
+            if not client.state.has_event(span := Span(start, end))
+        ]
+        if ask is None:
+            for span in batch:
+                start = from_micros(span.start).astimezone(LOCAL_TIMEZONE)
+                print(f"{start:%Y-%m-%d %H:%M} {span.duration / 60_000_000:.1f} minutes")  # noqa: T201
+            continue
+
+        answered = [(span, response) for span in batch if (response := ask(span))]
+        if answered:
+            client.post_events(answered)
@@ -0,0 +1,62 @@
+"""Remember what the watcher knows between runs so it can start without waiting on the server."""
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any
+
+import appdirs
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 4
+"""Bump this whenever the layout of the cache changes so old caches are ignored instead of misread."""
+
+
+def write_atomically(path: Path, text: str):
+    """Replace the file at path with text so a reader or a crash only ever sees the old file or the new one.
+
+    The text is written to a temporary file next to it and flushed to disk before that replaces the file, otherwise a
+    power cut soon after can leave an empty file behind.
+    """
+    tmp_path = path.with_suffix(".tmp")
+    with tmp_path.open("w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class StateCache:
+    """A small JSON file in the user cache directory.
+
+    It holds the resolved bucket ids, the logged absences, the afk timeline with its poll cursor, and the suggestion
+    index. The file is keyed on the server address and hostname so a cache from a different server (like the testing
+    one) is ignored.
+    """
+
+    def __init__(self, path: Path | None = None):
+        if path is None:
+            cache_dir = Path(appdirs.user_cache_dir("aw-watcher-ask-away"))
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            path = cache_dir / "state.json"
+        self.path = path
+
+    def load(self, server_address: str, hostname: str) -> dict[str, Any] | None:
+        """The cached state for this server and host, or None if there is no usable cache."""
+        try:
+            with self.path.open() as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError):
+            logger.exception("Failed to read the state cache, starting from the server.")
+            return None
+        if data.get("key") != [CACHE_VERSION, server_address, hostname]:
+            logger.info("The state cache is for a different server or version, starting from the server.")
+            return None
+        return data
+
+    def save(self, server_address: str, hostname: str, data: dict[str, Any]):
+        write_atomically(self.path, json.dumps({**data, "key": [CACHE_VERSION, server_address, hostname]}))
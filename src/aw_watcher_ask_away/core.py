@@ -1,22 +1,55 @@
 # ruff: noqa: EM101, EM102
+import bisect
 import datetime
+import functools
+import heapq
+import json
 import logging
+import threading
+import time
 from collections import deque
-from collections.abc import Iterable
-from copy import deepcopy
-from functools import cached_property
-from itertools import pairwise
-from typing import Any
+from collections.abc import Collection, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+from typing import TYPE_CHECKING, Any, NamedTuple
 
 import aw_core
-import aw_transform
 from aw_client.client import ActivityWatchClient
-from requests.exceptions import HTTPError
+from requests.exceptions import ConnectionError, HTTPError, Timeout
+
+from aw_watcher_ask_away import metrics
+from aw_watcher_ask_away.cache import StateCache
+from aw_watcher_ask_away.suggestions import SuggestionIndex
+
+if TYPE_CHECKING:
+    from aw_watcher_ask_away.outbox import Outbox
+    from aw_watcher_ask_away.readiness import Readiness
 
 WATCHER_NAME = "aw-watcher-ask-away"
 LOCAL_TIMEZONE = datetime.datetime.now().astimezone().tzinfo
 DATA_KEY = "message"
 """What field in the event data to store the user's message in."""
+POLL_OVERLAP = datetime.timedelta(seconds=1)
+"""How far before the newest afk event we have seen to start the next incremental fetch.
+
+The latest afk event keeps growing with heartbeats and the server sometimes reports slightly shifted timestamps for
+the same event (see AWAskAwayState.has_event), so we always re-fetch a little bit of what we already know.
+"""
+DEFAULT_HISTORY = datetime.timedelta(days=7)
+"""How far back to remember logged absences so we never ask about them twice."""
+OVERLAP_THRESH = 0.95
+"""How much of an absence another one has to cover for them to be the same absence.
+
+Not all of it, since the ends of an absence can move a little between polls, see AWAskAwayState.has_event.
+"""
+ALL_HOSTS = "*"
+"""Stands for every host when choosing afk buckets."""
+FETCH_WORKERS = 8
+"""The most afk buckets to fetch at once."""
+CACHE_CHECK_RETRY = 10
+"""How many seconds to wait before checking the cache against the server again, when there is nothing to wait on."""
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.UTC)
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
 
 
 class AWWatcherAskAwayError(Exception):
@@ -27,59 +60,435 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def find_afk_bucket(buckets: dict[str, Any]):
-    match [bucket for bucket in buckets if "afk" in bucket]:
-        case []:
-            raise AWWatcherAskAwayError("Cannot find the afk bucket.")
-        case [bucket]:
-            return bucket
-        case _:
-            raise AWWatcherAskAwayError(f"Found too many afk buckets: {buckets}.")
+def find_afk_buckets(buckets: dict[str, Any], hosts: Collection[str]) -> list[str]:
+    """The afk buckets for the hosts, or all of them if hosts has ALL_HOSTS.
+
+    If there is only one afk bucket it is used whatever host it is for, since with a single computer the bucket's
+    hostname does not always match ours (like after renaming the computer).
+    """
+    afk_buckets = sorted(bucket for bucket in buckets if "afk" in bucket)
+    if not afk_buckets:
+        raise AWWatcherAskAwayError("Cannot find the afk bucket.")
+    if ALL_HOSTS in hosts or len(afk_buckets) == 1:
+        return afk_buckets
+
+    def hostname(bucket_id: str) -> str:
+        return (buckets[bucket_id] or {}).get("hostname") or bucket_id.partition("_")[2]
+
+    if found := [bucket for bucket in afk_buckets if hostname(bucket) in hosts]:
+        return found
+    raise AWWatcherAskAwayError(f"Cannot find an afk bucket for {', '.join(hosts)} in {afk_buckets}.")
+
+
+class Span(NamedTuple):
+    """A compact stand-in for an aw_core.Event.
+
+    aw_core.Event is a dict holding a tz-aware datetime, a timedelta and a data dict. We keep a lot of these around
+    and compare them on every poll, so internally we only keep the start and end as epoch microseconds plus the one
+    piece of data we care about: the status for afk events and the message for logged absences. Events are only
+    converted to and from these when talking to the server.
+    """
+
+    start: int
+    end: int
+    label: str = ""
+
+    @classmethod
+    def from_event(cls, event: aw_core.Event, key: str) -> "Span":
+        start = to_micros(event.timestamp)
+        return cls(start, start + event.duration // ONE_MICROSECOND, event.data.get(key, ""))
 
+    def to_event(self, key: str = DATA_KEY) -> aw_core.Event:
+        return aw_core.Event(
+            None, from_micros(self.start), datetime.timedelta(microseconds=self.duration), {key: self.label}
+        )
 
-def is_afk(event: aw_core.Event) -> bool:
-    return event.data["status"] == "afk"
+    @property
+    def duration(self) -> int:
+        return self.end - self.start
 
+    def __str__(self):
+        start = from_micros(self.start).astimezone(LOCAL_TIMEZONE).isoformat()
+        return f"({start}, {self.duration / 1_000_000}, {self.label!r})"
 
-def squash_overlaps(events: list[aw_core.Event]) -> list[aw_core.Event]:
-    # Make a deep copy because the period_union function edits the events instead of returning new ones.
-    return aw_transform.sort_by_timestamp(aw_transform.period_union(deepcopy(events), []))
+
+def is_afk(span: Span) -> bool:
+    return span.label == "afk"
+
+
+def is_afk_everywhere(latest: Iterable[Span], cutoff: datetime.datetime) -> bool | None:
+    """Whether you are AFK given the latest afk event from each computer, None if none has reported since cutoff.
+
+    You are only AFK if you are AFK on every computer that is still reporting.
+    """
+    newest = [span for span in latest if span.end >= to_micros(cutoff)]
+    return all(map(is_afk, newest)) if newest else None
 
 
 def get_utc_now():
     return datetime.datetime.now().astimezone(datetime.UTC)
 
 
-def get_gaps(events: list[aw_core.Event]):
-    flattened_events = aw_transform.sort_by_timestamp(squash_overlaps(events))
-    for first, second in pairwise(flattened_events):
-        first_end = first.timestamp + first.duration
-        if first_end < second.timestamp:
-            yield aw_core.Event(None, first_end, second.timestamp - first_end)
+def to_micros(timestamp: datetime.datetime) -> int:
+    """Microseconds since the epoch. Exact, since datetimes only have microsecond resolution."""
+    return (timestamp - EPOCH) // ONE_MICROSECOND
 
 
-class AWAskAwayClient:
-    def __init__(self, client: ActivityWatchClient):
-        self.client = client
-        self.bucket_id = f"{WATCHER_NAME}_{self.client.client_hostname}"
+def from_micros(micros: int) -> datetime.datetime:
+    return EPOCH + datetime.timedelta(microseconds=micros)
 
-        if self.bucket_id not in self._all_buckets:
-            # TODO: Look into why aw-watcher-afk uses queued=True here.
-            client.create_bucket(self.bucket_id, event_type="afktask")
 
-        recent_events = deque(maxlen=10)
-        recent_events.extend(aw_transform.sort_by_timestamp(client.get_events(self.bucket_id, limit=10)))
-        self.state = AWAskAwayState(recent_events)
+def sweep(intervals: Iterable[tuple[int, int]]) -> Iterator[tuple[bool, int, int]]:
+    """Sweep over (start, end) intervals once, yielding the merged intervals and the gaps between them in order.
+
+    Yields (is_gap, start, end) tuples. Intervals that overlap or touch are merged, the same as
+    aw_transform.period_union does.
+    """
+    # Timsort is linear on input that is already sorted (or sorted newest first, like the aw-server returns it),
+    # so this is the only sort we need.
+    it = iter(sorted(intervals))
+    if (first := next(it, None)) is None:
+        return
+    merged_start, merged_end = first
+    for start, end in it:
+        if start > merged_end:
+            yield False, merged_start, merged_end
+            yield True, merged_end, start
+            merged_start, merged_end = start, end
+        elif end > merged_end:
+            merged_end = end
+    yield False, merged_start, merged_end
+
 
-        self.afk_bucket_id = find_afk_bucket(self._all_buckets)
+def merge_intervals(intervals: Iterable[tuple[int, int]]) -> Iterator[tuple[int, int]]:
+    return ((start, end) for is_gap, start, end in sweep(intervals) if not is_gap)
 
-    @cached_property
-    def _all_buckets(self):
-        return self.client.get_buckets()
 
-    def post_event(self, event: aw_core.Event, message: str):
-        self.state.add_event(event, message)
-        self.client.insert_event(self.bucket_id, event)
+def find_gaps(intervals: Iterable[tuple[int, int]]) -> Iterator[tuple[int, int]]:
+    return ((start, end) for is_gap, start, end in sweep(intervals) if is_gap)
+
+
+def squash_overlaps(spans: Iterable[Span]) -> list[Span]:
+    return [Span(start, end) for start, end in merge_intervals((s.start, s.end) for s in spans)]
+
+
+def get_gaps(spans: Iterable[Span]) -> Iterator[Span]:
+    for start, end in find_gaps((s.start, s.end) for s in spans):
+        yield Span(start, end)
+
+
+@functools.cache
+def not_afk_query(afk_bucket_ids: tuple[str, ...]) -> str:
+    """A query2 program for the union of the not-afk events in the afk buckets and the newest event in each of them.
+
+    It only depends on the buckets, so it is built once and sent with a different time period every time.
+    """
+    lines = []
+    for i, bucket_id in enumerate(afk_bucket_ids):
+        union_so_far = "not_afk" if i else "[]"
+        lines += [
+            f"events_{i} = query_bucket({json.dumps(bucket_id)});",
+            # The events come newest first. merge_events_by_keys makes a copy, since period_union clears the data of
+            # the events it is given.
+            f'latest_{i} = merge_events_by_keys(limit_events(events_{i}, 1), ["status"]);',
+            f'not_afk = period_union(filter_keyvals(events_{i}, "status", ["not-afk"]), {union_so_far});',
+        ]
+    latest = ", ".join(f"latest_{i}" for i in range(len(afk_bucket_ids)))
+    lines.append(f'RETURN = {{"not_afk": not_afk, "latest": [{latest}]}};')
+    return "\n".join(lines)
+
+
+class AWAskAwayClient:
+    def __init__(
+        self,
+        client: ActivityWatchClient,
+        history: datetime.timedelta = DEFAULT_HISTORY,
+        cache: StateCache | None = None,
+        outbox: "Outbox | None" = None,
+        afk_hosts: Collection[str] | None = None,
+        *,
+        use_query: bool = False,
+        compact_within: float | None = None,
+        readiness: "Readiness | None" = None,
+    ):
+        """
+        Parameters
+        ----------
+        afk_hosts
+            Whose afk buckets to watch, just this computer's by default. With several, being active on any of them
+            counts as not being AFK. ALL_HOSTS watches every afk bucket on the server.
+        use_query
+            Have the server merge the not-afk events with a query instead of fetching the afk events, see
+            query_afk_events.
+        compact_within
+            Join an answer onto the previous one instead of logging a new absence when they are the same and at most
+            this many seconds apart, like a heartbeat. Off by default.
+        readiness
+            Used to wait for the server when the restored cache cannot be checked against it yet. Without one the
+            check is tried again every CACHE_CHECK_RETRY seconds.
+        """
+        self.client = client
+        self.bucket_id = f"{WATCHER_NAME}_{self.client.client_hostname}"
+        self.history = history
+        self.cache = cache
+        self.outbox = outbox
+        """Where to queue posted events so posting never waits on the server. Without one they are sent right away."""
+        self.afk_hosts = afk_hosts or [client.client_hostname]
+        self.afk_bucket_ids: list[str] = []
+        self.afk_timelines: dict[str, AFKTimeline] = {}
+        self._fetch_pool: ThreadPoolExecutor | None = None
+        self.use_query = use_query
+        self.compact_within = compact_within
+        self.readiness = readiness
+        self._query_start: datetime.datetime | None = None
+        """Where the last query found the not-afk period before the window, so the next one can start there."""
+        self.is_afk: bool | None = None
+        """Whether you were AFK on every watched computer on the last poll, None if we could not tell."""
+        self.connected = True
+        """Whether the last poll reached the server."""
+        self.snoozed = SnoozeQueue()
+
+        # Set by the background check of the cache and picked up on the next poll.
+        self._cache_is_stale = False
+        self._missed_logged_events: list[Span] | None = None
+
+        if cache is not None and (cached := cache.load(client.server_address, client.client_hostname)):
+            self._restore(cached)
+            threading.Thread(target=self._check_cache, args=(cached["saved_at"],), daemon=True).start()
+        else:
+            self._load_from_server()
+
+    def _load_from_server(self):
+        buckets = self.client.get_buckets()
+        if self.bucket_id not in buckets:
+            # TODO: Look into why aw-watcher-afk uses queued=True here.
+            self.client.create_bucket(self.bucket_id, event_type="afktask")
+
+        # Every answer ever given is used for suggestions, but only the recent ones are checked for overlaps.
+        all_logged_events = self.get_events(self.bucket_id, DATA_KEY)
+        self.suggestions = SuggestionIndex.from_spans(all_logged_events)
+        cutoff = to_micros(get_utc_now() - self.history)
+        logged_events = [span for span in all_logged_events if span.end >= cutoff]
+        if self.outbox is not None:
+            # The server does not have these yet but we should not ask about them again.
+            logged_events += self.outbox.pending(self.bucket_id)
+        self.state = AWAskAwayState(sorted(logged_events), self.history)
+
+        self.afk_bucket_ids = find_afk_buckets(buckets, self.afk_hosts)
+
+    def _restore(self, cached: dict[str, Any]):
+        self.afk_bucket_ids = cached["afk_bucket_ids"]
+        self.state = AWAskAwayState([Span(*span) for span in cached["logged"]], self.history)
+        self.state.logged.prune(to_micros(get_utc_now() - self.history))
+        if self.outbox is not None:
+            # Answers still waiting to be sent, which the cache might have been saved before.
+            self.state.merge_logged(self.outbox.pending(self.bucket_id))
+        self.suggestions = SuggestionIndex.from_json(cached["suggestions"])
+        self.snoozed = SnoozeQueue.from_json(cached["snoozed"])
+        for bucket_id, (events, cursor, fetched_at) in cached["afk_timelines"].items():
+            timeline = self.afk_timelines[bucket_id] = AFKTimeline()
+            timeline.events = [Span(*span) for span in events]
+            timeline.cursor = cursor
+            timeline.fetched_at = fetched_at
+        logger.info("Restored the state from the cache.")
+
+    def _check_cache(self, saved_at: int):
+        """Check the restored state against the server. This runs in a background thread until the check is done."""
+        while True:
+            try:
+                buckets = self.client.get_buckets()
+                afk_bucket_ids = find_afk_buckets(buckets, self.afk_hosts)
+                if self.bucket_id not in buckets or afk_bucket_ids != self.afk_bucket_ids:
+                    logger.info("The cached buckets are out of date, reloading from the server.")
+                    self._cache_is_stale = True
+                    return
+                # Pick up anything logged since the cache was saved, like from the web UI.
+                missed = self.get_whole_events(self.bucket_id, start=from_micros(saved_at))
+                self._missed_logged_events = [Span.from_event(event, DATA_KEY) for event in missed]
+                return
+            except (ConnectionError, Timeout):
+                logger.exception("Cannot connect to the server to check the cache, waiting for it.")
+                if self.readiness is not None:
+                    self.readiness.wait()
+                else:
+                    time.sleep(CACHE_CHECK_RETRY)
+            except (HTTPError, AWWatcherAskAwayError):
+                logger.exception("Failed to check the cache, reloading from the server.")
+                self._cache_is_stale = True
+                return
+
+    def _apply_cache_check(self):
+        if self._cache_is_stale:
+            self._cache_is_stale = False
+            self._load_from_server()
+            self.afk_timelines = {}
+        if (missed := self._missed_logged_events) is not None:
+            self._missed_logged_events = None
+            self.state.merge_logged(missed)
+            for span in missed:
+                self.suggestions.add(span.label, span.end)
+
+    def save_cache(self):
+        if self.cache is None:
+            return
+        data = {
+            "saved_at": to_micros(get_utc_now()),
+            "afk_bucket_ids": self.afk_bucket_ids,
+            "logged": list(self.state.logged),
+            "afk_timelines": {
+                bucket_id: [timeline.events, timeline.cursor, timeline.fetched_at]
+                for bucket_id, timeline in self.afk_timelines.items()
+            },
+            "suggestions": self.suggestions.to_json(),
+            "snoozed": self.snoozed.to_json(),
+        }
+        self.cache.save(self.client.server_address, self.client.client_hostname, data)
+
+    def get_events(self, bucket_id: str, key: str, **kwargs) -> list[Span]:
+        with metrics.timer("get_events"):
+            events = self.client.get_events(bucket_id, **kwargs)
+        metrics.count("events_fetched", len(events))
+        return [Span.from_event(event, key) for event in events]
+
+    def get_whole_events(
+        self, bucket_id: str, start: datetime.datetime | None = None, end: datetime.datetime | None = None
+    ) -> list[aw_core.Event]:
+        """The events that intersect [start, end] as they are stored instead of trimmed to it.
+
+        The aw-server crops the events that reach past start or end, so those are fetched again by their id.
+        """
+        with metrics.timer("get_events"):
+            events = self.client.get_events(bucket_id, start=start, end=end)
+            for i, event in enumerate(events):
+                if (start is not None and event.timestamp <= start) or (
+                    end is not None and event.timestamp + event.duration >= end
+                ):
+                    events[i] = (
+                        self.client.get_event(bucket_id, event.id) or event
+                    )  # pyright: ignore[reportArgumentType]
+        metrics.count("events_fetched", len(events))
+        return events
+
+    def post_event(self, span: Span, message: str):
+        pulsetime = None
+        if self.compact_within is not None and self.state.join_event(span, message, self.compact_within):
+            # Sent as a heartbeat so the server extends the previous event, or inserts it if it cannot.
+            pulsetime = self.compact_within
+            logged = span._replace(label=message)
+            metrics.count("events_compacted")
+        else:
+            logged = self.state.add_event(span, message)
+        self.suggestions.add(message, logged.end)
+        if self.outbox is not None:
+            with metrics.timer("outbox_put"):
+                self.outbox.put(self.bucket_id, logged, pulsetime)
+        elif pulsetime is not None:
+            with metrics.timer("heartbeat"):
+                self.client.heartbeat(self.bucket_id, logged.to_event(), pulsetime)
+        else:
+            with metrics.timer("insert_event"):
+                self.client.insert_event(self.bucket_id, logged.to_event())
+        metrics.count("events_posted")
+        self.save_cache()
+
+    def post_events(self, answered: list[tuple[Span, str]]):
+        """Post several events in a single request."""
+        logged = [self.state.add_event(span, message) for span, message in answered]
+        for span in logged:
+            self.suggestions.add(span.label, span.end)
+        if self.outbox is not None:
+            for span in logged:
+                self.outbox.put(self.bucket_id, span)
+        else:
+            self.client.insert_events(self.bucket_id, [span.to_event() for span in logged])
+        self.save_cache()
+
+    def _update_timeline(
+        self, bucket_id: str, timeline: "AFKTimeline", now: datetime.datetime, cutoff: datetime.datetime
+    ) -> "AFKTimeline":
+        start = timeline.fetch_start
+        if start is None or timeline.fetched_at < to_micros(cutoff):
+            # On the first poll (or when we have not polled in a long time, like after a restart) also get the events
+            # right before the window so we know when a gap that is still inside the window started.
+            timeline = AFKTimeline()
+            start = to_micros(cutoff)
+            timeline.merge(self.get_events(bucket_id, "status", limit=10, end=cutoff), start)
+        timeline.merge(self.get_events(bucket_id, "status", start=from_micros(start)), start)
+        timeline.prune(to_micros(cutoff))
+        timeline.fetched_at = to_micros(now)
+        return timeline
+
+    def fetch_afk_events(self, seconds: float) -> list[Span]:
+        """Bring the local afk timelines up to date and return their events merged together, newest first.
+
+        Only the events at or after each timeline's high-water mark are requested, so the size of each request does
+        not depend on how much history we hold. With several afk buckets they are all requested at once, so a poll
+        takes about as long as the slowest request instead of all of them added up.
+        """
+        now = get_utc_now()
+        cutoff = now - datetime.timedelta(seconds=seconds)
+        timelines = [self.afk_timelines.get(bucket_id, AFKTimeline()) for bucket_id in self.afk_bucket_ids]
+        if len(timelines) == 1:
+            timelines = [self._update_timeline(self.afk_bucket_ids[0], timelines[0], now, cutoff)]
+        else:
+            if self._fetch_pool is None:
+                self._fetch_pool = ThreadPoolExecutor(FETCH_WORKERS, thread_name_prefix="fetch")
+            timelines = list(
+                self._fetch_pool.map(self._update_timeline, self.afk_bucket_ids, timelines, repeat(now), repeat(cutoff))
+            )
+        self.afk_timelines = dict(zip(self.afk_bucket_ids, timelines, strict=True))
+
+        self.is_afk = is_afk_everywhere((t.events[0] for t in timelines if t.events), cutoff)
+
+        if len(timelines) == 1:
+            return timelines[0].events
+        return list(heapq.merge(*(t.events for t in timelines), key=lambda e: e.start, reverse=True))
+
+    def query_not_afk(
+        self, timeperiods: list[tuple[datetime.datetime, datetime.datetime]]
+    ) -> list[tuple[list[Span], list[Span]]]:
+        """For each time period, the union of the not-afk events in it and the newest event in each afk bucket.
+
+        The union is worked out by the server, so only a handful of periods are sent back however many events there are.
+        """
+        query = not_afk_query(tuple(self.afk_bucket_ids))
+        with metrics.timer("query"):
+            results = self.client.query(query, timeperiods)
+        periods = []
+        for result in results:
+            not_afk = [
+                Span.from_event(aw_core.Event(**e), "status")._replace(label="not-afk") for e in result["not_afk"]
+            ]
+            latest = [Span.from_event(aw_core.Event(**e), "status") for events in result["latest"] for e in events]
+            metrics.count("events_fetched", len(not_afk) + len(latest))
+            periods.append((not_afk, latest))
+        return periods
+
+    def query_afk_events(self, seconds: float) -> list[Span]:
+        """Like fetch_afk_events, but the server merges the not-afk events and only the merged periods are sent back.
+
+        query2 has no way to take the logged absences away from the gaps, so the gaps and the check against what was
+        logged are still done here, only on a handful of periods instead of every event. Like the events before the
+        window fetched in _update_timeline, we need the last not-afk period that started before the window to know when
+        an absence in progress at the start of the window started. So if none is found the window is doubled until
+        one is, or until it covers the history.
+        """
+        now = get_utc_now()
+        cutoff = now - datetime.timedelta(seconds=seconds)
+        earliest = now - self.history
+        start = min(cutoff, self._query_start or cutoff)
+        while True:
+            [(not_afk, latest)] = self.query_not_afk([(start, now)])
+            # Zero length periods are left over from zero length events, see AWAskAwayState.get_unseen_afk_events.
+            not_afk = [span for span in not_afk if span.duration > 0]
+            before = [span.start for span in not_afk if span.start <= to_micros(cutoff)]
+            if before or start <= earliest:
+                break
+            start = max(earliest, start - (now - start))
+        self._query_start = from_micros(max(before)) if before else start
+
+        self.is_afk = is_afk_everywhere(latest, cutoff)
+        return sorted(not_afk, reverse=True)
 
     def get_new_afk_events_to_note(self, seconds: float, durration_thresh: float):
         """Check whether we recently finished a large AFK event.
@@ -91,29 +500,218 @@ class AWAskAwayClient:
         durration_thresh : float
             The number of seconds you need to be away before reporting on it.
         """
+        metrics.count("polls")
         try:
-            events = self.client.get_events(self.afk_bucket_id, limit=10)
-            if is_afk(events[0]):  # Currently AFK, wait to bring up the prompt.
-                return
-            yield from self.state.get_unseen_afk_events(events, seconds, durration_thresh)
-        except HTTPError:
+            self._apply_cache_check()
+            events = self.query_afk_events(seconds) if self.use_query else self.fetch_afk_events(seconds)
+        except (ConnectionError, Timeout):
+            metrics.count("server_errors")
             logger.exception("Failed to get events from the server.")
+            self.connected = False
             return
+        except HTTPError:
+            # The server is there but failed the request, so waiting for it to come back would not help.
+            metrics.count("server_errors")
+            logger.exception("The server failed to get events.")
+            self.connected = True
+            return
+        self.connected = True
+        if not events or self.is_afk:  # Currently AFK, wait to bring up the prompt.
+            return
+        with metrics.timer("find_absences"):
+            unseen = list(self.state.get_unseen_afk_events(events, seconds, durration_thresh))
+        yield from unseen
+
+
+class AFKTimeline:
+    """A local copy of the recent afk bucket events that is kept up to date with incremental fetches.
+
+    Events are kept newest first, the same order the aw-server returns them in.
+    """
+
+    def __init__(self, overlap: datetime.timedelta = POLL_OVERLAP):
+        self.events: list[Span] = []
+        self.cursor: int | None = None
+        """The start of the newest event we have seen (the high-water mark)."""
+        self.fetched_at = 0
+        """When the timeline was last brought up to date."""
+        self.overlap = overlap // ONE_MICROSECOND
+
+    @property
+    def fetch_start(self) -> int | None:
+        """Where the next fetch should start, or None if nothing has been fetched yet."""
+        return None if self.cursor is None else self.cursor - self.overlap
+
+    def merge(self, fetched: list[Span], fetch_start: int):
+        """Merge in the events the server returned for everything from fetch_start onwards.
+
+        The server trims the events it returns to the range asked for, so an event that started before fetch_start
+        comes back cut off there. The copy we hold keeps its start and is only extended to the end of the returned one,
+        which picks up events that were extended by heartbeats. Anything we hold that starts at or after fetch_start is
+        replaced, which drops events that the server no longer has, like the zero length not-afk events described in
+        AWAskAwayState.get_unseen_afk_events.
+        """
+        kept = [e for e in self.events if e.start < fetch_start]
+        added = []
+        for event in fetched:
+            held = None
+            if event.start <= fetch_start:
+                # The event the server cut off, if this is not one that really starts at fetch_start.
+                held = next((i for i, e in enumerate(kept) if e.label == event.label and e.end >= event.start), None)
+            if held is not None:
+                kept[held] = kept[held]._replace(end=max(kept[held].end, event.end))
+            else:
+                added.append(event)
+        self.events = sorted([*added, *kept], key=lambda e: e.start, reverse=True)
+        if self.events:
+            self.cursor = self.events[0].start
+
+    def prune(self, cutoff: int):
+        """Forget events that ended before the cutoff.
+
+        The newest not-afk event that ended before the cutoff is kept because it marks where the first gap in the
+        window started.
+        """
+        keep = []
+        have_start = False
+        for event in self.events:
+            if event.end >= cutoff:
+                keep.append(event)
+            elif not have_start and not is_afk(event) and event.duration > 0:
+                keep.append(event)
+                have_start = True
+        self.events = keep
+
+
+class AbsenceIndex:
+    """The absences logged to the aw-watcher-ask-away bucket, indexed for fast overlap checks.
+
+    Logged absences are kept in parallel lists sorted by start time so the records that could overlap a new event
+    can be found with bisect instead of checking every record.
+    """
+
+    def __init__(self, spans: Iterable[Span] = ()):
+        self._starts: list[int] = []
+        self._spans: list[Span] = []
+        self._max_ends: list[int] = []
+        """The running maximum of the ends of self._spans.
+
+        Logged absences should not overlap but older versions of this watcher did sometimes log overlapping ones.
+        This lets us stop looking backwards once no earlier record can reach the new event."""
+        for span in spans:
+            self.add(span)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __iter__(self):
+        return iter(self._spans)
+
+    @property
+    def latest(self) -> Span | None:
+        """The absence that started last."""
+        return self._spans[-1] if self._spans else None
+
+    def add(self, span: Span):
+        i = bisect.bisect_right(self._starts, span.start)
+        self._starts.insert(i, span.start)
+        self._spans.insert(i, span)
+        # Absences are almost always logged in order, so this usually only touches the last element.
+        running = self._max_ends[i - 1] if i else span.end
+        self._max_ends[i:] = [running := max(running, s.end) for s in self._spans[i:]]
+
+    def remove(self, span: Span):
+        i = self._spans.index(span, bisect.bisect_left(self._starts, span.start))
+        del self._starts[i], self._spans[i], self._max_ends[i]
+        running = self._max_ends[i - 1] if i else 0
+        self._max_ends[i:] = [running := max(running, s.end) for s in self._spans[i:]]
+
+    def overlaps(self, new: Span, overlap_thresh: float) -> bool:
+        """Whether any logged absence covers more than overlap_thresh of the new event."""
+        new_start, new_end = new.start, new.end
+        # Only the records that start before the new event ends can overlap it.
+        i = bisect.bisect_left(self._starts, new_end) - 1
+        while i >= 0 and self._max_ends[i] > new_start:
+            overlap = min(self._spans[i].end, new_end) - max(self._starts[i], new_start)
+            if overlap / new.duration > overlap_thresh:
+                return True
+            i -= 1
+        return False
 
+    def prune(self, cutoff: int):
+        """Forget the absences that started before the cutoff."""
+        i = bisect.bisect_left(self._starts, cutoff)
+        del self._starts[:i], self._spans[:i], self._max_ends[:i]
 
-class AWAskAwayState:
-    def __init__(self, recent_events: Iterable[aw_core.Event]):
-        self.recent_events = recent_events if isinstance(recent_events, deque) else deque(recent_events, 10)
-        """The recent events we have posted to the aw-watcher-ask-away bucket.
 
-        This is used to avoid asking the user to log an absence that they have already logged.
+class SnoozeQueue:
+    """Snoozed absences and when to ask about them again, in epoch microseconds.
+
+    They are kept in a heap so the next one to wake up is always on top, and in an AbsenceIndex so polls can skip
+    them while they sleep. Safe to use from several threads.
+    """
+
+    def __init__(self, snoozed: Iterable[tuple[int, Span]] = ()):
+        self._heap: list[tuple[int, Span]] = []
+        self._index = AbsenceIndex()
+        self._lock = threading.Lock()
+        for wake_at, span in snoozed:
+            self.snooze(span, wake_at)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def snooze(self, span: Span, wake_at: int):
+        with self._lock:
+            heapq.heappush(self._heap, (wake_at, span))
+            self._index.add(span)
+
+    def is_snoozed(self, span: Span) -> bool:
+        with self._lock:
+            return self._index.overlaps(span, OVERLAP_THRESH)
+
+    def next_wake(self) -> int | None:
+        """When the next absence wakes up, None if nothing is snoozed."""
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: int) -> list[Span]:
+        """Stop snoozing the absences that are due by now and return them, the earliest due first."""
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, span = heapq.heappop(self._heap)
+                self._index.remove(span)
+                due.append(span)
+        return due
+
+    def to_json(self) -> list[Any]:
+        with self._lock:
+            return [[wake_at, *span] for wake_at, span in self._heap]
+
+    @classmethod
+    def from_json(cls, data: list[Any]) -> "SnoozeQueue":
+        return cls((wake_at, Span(*span)) for wake_at, *span in data)
+
+
+class AWAskAwayState:
+    def __init__(self, recent_events: Iterable[Span], history: datetime.timedelta | None = None):
+        recent_events = list(recent_events)
+        self.recent_events = deque(recent_events, 10)
+        """The most recent events we have posted to the aw-watcher-ask-away bucket.
 
         Sorted from earliest to most recent."""
+        self.logged = AbsenceIndex(recent_events)
+        """Every absence posted within the history window.
+
+        This is used to avoid asking the user to log an absence that they have already logged."""
+        self.history = history
+        """How long to remember logged absences for, forever if None."""
 
-    def has_event(self, new: aw_core.Event, overlap_thresh: float = 0.95) -> bool:
+    def has_event(self, new: Span, overlap_thresh: float = OVERLAP_THRESH) -> bool:
         """Check whether we have already posted an event that overlaps with the new event.
 
-        The self.recent_events data structure used to be a dictionary with keys as timestamp/durration.
+        The recent events data structure used to be a dictionary with keys as timestamp/durration.
         This method merely checked to see if the new event's (timestamp, durration) tuple was in the dictionary.
 
         However, for some reason the events coming from the aw-server seem to be slightly inconsistent at times.
@@ -126,54 +724,74 @@ class AWAskAwayState:
         This duplication + offset combination was causing us to double ask the user for input.
         Using overlaps with a percentage is more robust against this kind of thing.
         """  # noqa: E501
-        for recent in self.recent_events:
-            overlap_start = max(recent.timestamp, new.timestamp)
-            overlap_end = min(recent.timestamp + recent.duration, new.timestamp + new.duration)
-            overlap = overlap_end - overlap_start
-            if overlap / new.duration > overlap_thresh:
-                return True
-        return False
-
-    def add_event(self, event: aw_core.Event, message: str):
-        assert not self.has_event(event)  # noqa: S101
-        event.data[DATA_KEY] = message
-        event["id"] = None  # Wipe the ID so we don't edit the AFK event.
-        logger.debug(f"Posting event: {event}")
-        self.recent_events.append(event)
-
-    def get_unseen_afk_events(self, events: list[aw_core.Event], recency_thresh: float, durration_thresh: float):
+        return self.logged.overlaps(new, overlap_thresh)
+
+    def add_event(self, span: Span, message: str) -> Span:
+        assert not self.has_event(span)  # noqa: S101
+        logged = span._replace(label=message)
+        logger.debug("Posting event: %s", logged)
+        self.recent_events.append(logged)
+        self.logged.add(logged)
+        if self.history is not None:
+            self.logged.prune(to_micros(get_utc_now() - self.history))
+        return logged
+
+    def join_event(self, span: Span, message: str, pulsetime: float) -> Span | None:
+        """Extend the latest logged absence over the new one, like the aw-server merges a heartbeat into its last event.
+
+        They are joined if they have the same message and the new one starts at most pulsetime seconds after the latest
+        one ended. Returns the joined absence, or None if they cannot be joined and the new one should be added instead.
+        """
+        previous = self.logged.latest
+        if previous is None or previous.label != message or not 0 <= span.start - previous.end <= pulsetime * 1e6:
+            return None
+        assert not self.has_event(span)  # noqa: S101
+        joined = Span(previous.start, max(previous.end, span.end), message)
+        logger.debug("Joining event %s onto %s", span, previous)
+        self.logged.remove(previous)
+        self.logged.add(joined)
+        if self.recent_events and self.recent_events[-1] == previous:
+            self.recent_events[-1] = joined
+        else:
+            self.recent_events.append(joined)
+        return joined
+
+    def merge_logged(self, spans: Iterable[Span]):
+        """Add absences that were logged somewhere else, skipping ones we already know about."""
+        for span in spans:
+            if span.duration > 0 and not self.has_event(span):
+                self.logged.add(span)
+        self.recent_events = deque(self.logged, 10)
+
+    def get_unseen_afk_events(self, events: list[Span], recency_thresh: float, durration_thresh: float):
         """Check whether we recently finished a large AFK event.
 
         Parameters
         ----------
-        events : list[aw_core.Event]
+        events : list[Span]
             The events to check for AFK events.
         seconds : float
             Events more than this many seconds ago will be ignored.
         durration_thresh : float
             Events with a durration less than this many seconds will be ignored.
         """
-        events_log = [
-            (e.timestamp.astimezone(LOCAL_TIMEZONE).isoformat(), e.duration.total_seconds(), e.data["status"])
-            for e in events
-        ]
-        logger.debug(f"Checking for unseen in: {events_log}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Checking for unseen in: [{', '.join(map(str, events))}]")
 
         # Filter out events that have zero length. Sometimes a zero length not-afk event is generated if you open
         # up your computer from being suspended but don't do anything with it. This event is overwritten soon and
         # doesn't exist in later queries. If we don't filter them out we can ask the user to fill the time in twice.
-        events = [e for e in events if e.duration.total_seconds() > 0]
+        events = [e for e in events if e.duration > 0]
 
         # Use gaps in non-afk events instead of the afk-events themselves to handle when the computer
         # is suspended or powered off.
-        non_afk_events = squash_overlaps([e for e in events if not is_afk(e)])
-        pseudo_afk_events = list(get_gaps(non_afk_events))
+        pseudo_afk_events = list(get_gaps([e for e in events if not is_afk(e)]))
 
         pseudo_afk_events = [e for e in pseudo_afk_events if not self.has_event(e)]
-        buffered_now = get_utc_now() - datetime.timedelta(seconds=recency_thresh)
+        buffered_now = to_micros(get_utc_now()) - recency_thresh * 1_000_000
         for event in pseudo_afk_events:
-            long_enough = event.duration.seconds > durration_thresh
-            recent_enough = event.timestamp + event.duration > buffered_now
+            long_enough = event.duration > durration_thresh * 1_000_000
+            recent_enough = event.end > buffered_now
             if long_enough and recent_enough:
-                logger.debug(f"Found event to note: {event}")
+                logger.debug("Found event to note: %s", event)
                 yield event
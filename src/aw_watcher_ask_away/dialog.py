@@ -1,59 +1,34 @@
-import json
+import bisect
+import datetime
 import logging
 import re
-import time
 import tkinter as tk
-from collections import UserDict
-from itertools import chain
-from pathlib import Path
+from collections.abc import Callable
+from functools import cache, partial
 from tkinter import messagebox, simpledialog, ttk
 
-import appdirs
+from aw_watcher_ask_away.abbreviations import AbbreviationIndex, AbbreviationStore, Expander
+from aw_watcher_ask_away.runtime import SNOOZE_CHOICES, Snooze
 
 logger = logging.getLogger(__name__)
 
-root = tk.Tk()
-root.withdraw()
 
+@cache
+def get_root() -> tk.Tk:
+    """The hidden Tk root every dialog hangs off, created on first use.
 
-def open_link(link: str):
-    import webbrowser
-
-    webbrowser.open(link)
-
-
-class _AbbreviationStore(UserDict[str, str]):
-    """A class to store abbreviations and their expansions.
-
-    And to manage saving this information to the config directory.
+    Creating it connects to the display, so it is put off until a dialog is actually shown. It must only be used from
+    the thread that first calls this.
     """
+    root = tk.Tk()
+    root.withdraw()
+    return root
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(self, *args, **kwargs)
-        config_dir = Path(appdirs.user_config_dir("aw-watcher-ask-away"))
-        config_dir.mkdir(parents=True, exist_ok=True)
-        self._config_file = config_dir / "abbreviations.json"
-        self._load_from_config()
-
-    def _load_from_config(self):
-        if self._config_file.exists():
-            with self._config_file.open() as f:
-                try:
-                    self.update(json.load(f))
-                except json.JSONDecodeError:
-                    logger.exception("Failed to load abbreviations from config file.")
-
-    def _save_to_config(self):
-        with self._config_file.open("w") as f:
-            json.dump(self.data, f, indent=4)
 
-    def __setitem__(self, key: str, value: str):
-        self.data[key] = value
-        self._save_to_config()
+def open_link(link: str):
+    import webbrowser
 
-    def __delitem__(self, key: str) -> None:
-        super().__delitem__(key)
-        self._save_to_config()
+    webbrowser.open(link)
 
 
 class ConfigDialog(simpledialog.Dialog):
@@ -97,89 +72,235 @@ class AddAbbreviationDialog(simpledialog.Dialog):
         self.result = (self.abbr.get(), self.expansion.get())
 
 
+def confirm_abbreviation(parent: tk.Misc, abbr: str) -> bool:
+    """Check that a new abbreviation is valid and, if it already exists, that it is alright to overwrite it."""
+    if not re.fullmatch(r"(\w+ )*\w+", abbr):
+        messagebox.showerror(
+            "Invalid abbreviation",
+            "Abbreviations must be alphanumeric words separated by single spaces.",
+            parent=parent,
+        )
+        return False
+    if existing := get_abbreviations().get(abbr):
+        return messagebox.askyesno(
+            "Overwrite confirmation",
+            f"That abbreviation ({abbr}) already exists as '{existing}', would you like to over write?",
+            parent=parent,
+        )
+    return True
+
+
 # TODO: Link the abbreviations json file for editing directly.
 class AbbreviationPane(ttk.Frame):
+    """The abbreviations in a table with a filter above it.
+
+    A Treeview only draws the rows that are on screen, and rows are added, changed and removed one at a time as the
+    abbreviations are instead of drawing the whole table again. Filtering detaches the rows that stop matching and
+    moves back the ones that start to, so it keeps up with thousands of abbreviations. Double click a cell to edit it.
+    """
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-
-        # Set up a canvas so we can get a scroll bar.
-        # TODO: Think of a better way to display these abbreviations?
-        self.canvas = tk.Canvas(self, borderwidth=0, background="#ffffff")
-        self.canvas.grid(row=0, column=0, sticky=tk.N + tk.S + tk.E + tk.W)
-        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.canvas.yview)
-        self.scrollbar.grid(row=0, column=1, sticky=tk.N + tk.S)
-        self.canvas.configure(yscrollcommand=self.scrollbar.set)
-        self.canvas.bind("<Configure>", lambda _: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
-        self.canvas.bind_all("<MouseWheel>", lambda e: self.canvas.yview_scroll(int(-1 * (e.delta / 120)), "units"))
-        # enable scroll on a track pad
-        self.canvas.bind_all("<Button-4>", lambda _: self.canvas.yview_scroll(-1, "units"))
-        self.canvas.bind_all("<Button-5>", lambda _: self.canvas.yview_scroll(1, "units"))
-
-        self.frame = ttk.Frame(self.canvas)
-        self.frame.grid(row=0, column=0, sticky=tk.N + tk.S + tk.E + tk.W)
-
-        self.canvas.create_window((0, 0), window=self.frame, anchor="nw")
-
-        ttk.Label(self.frame, text="Abbr", justify=tk.LEFT).grid(row=0, column=0, sticky=tk.W)
-        ttk.Label(self.frame, text="Expansion", justify=tk.LEFT).grid(row=0, column=1, sticky=tk.W)
-
-        self.new_abbr = ttk.Entry(self.frame)
-        self.new_abbr.grid(row=1, column=0)
-        self.new_expansion = ttk.Entry(self.frame)
-        self.new_expansion.grid(row=1, column=1)
-        ttk.Button(self.frame, text="+", command=self.add_abbreviation).grid(row=1, column=2)
-
-        self.other_rows = []
-
-        self.draw_abbreviations()
-
-    def _make_del_function(self, key):
-        def del_function():
-            abbreviations.pop(key)
-            self.draw_abbreviations()
-
-        return del_function
-
-    def draw_abbreviations(self):
-        for child in chain(*self.other_rows):
-            child.destroy()
-        self.other_rows = []
-
-        for i, (abbr_key, abbr_value) in enumerate(sorted(abbreviations.items())):
-            row_index = i + 2
-            # TODO: Allow _editing_ abbreviations in place instead of remove and re-add.
-            # Maybe by using a readonly entry and double clicking to activate it?
-            abbr = ttk.Label(self.frame, text=abbr_key, justify=tk.LEFT)
-            abbr.grid(row=row_index, column=0, sticky=tk.W)
-            expansion = ttk.Label(self.frame, text=abbr_value, justify=tk.LEFT)
-            expansion.grid(row=row_index, column=1, sticky=tk.W)
-            button = ttk.Button(self.frame, text="-", command=self._make_del_function(abbr_key))
-            button.grid(row=row_index, column=2)
-            self.other_rows.append((abbr, expansion, button))
+        abbreviations = get_abbreviations()
+        self.index = AbbreviationIndex(abbreviations.items())
+
+        ttk.Label(self, text="Filter").grid(row=0, column=0, sticky=tk.W)
+        self.filter = ttk.Entry(self)
+        self.filter.grid(row=0, column=1, columnspan=3, sticky=tk.W + tk.E)
+        self.filter.bind("<KeyRelease>", self.apply_filter)
+
+        self.tree = ttk.Treeview(self, columns=("abbr", "expansion"), show="headings", height=15)
+        self.tree.heading("abbr", text="Abbr", anchor=tk.W)
+        self.tree.heading("expansion", text="Expansion", anchor=tk.W)
+        self.tree.column("abbr", width=120, stretch=False)
+        self.tree.column("expansion", width=300)
+        self.tree.grid(row=1, column=0, columnspan=4, sticky=tk.N + tk.S + tk.E + tk.W)
+        scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.tree.yview)
+        scrollbar.grid(row=1, column=4, sticky=tk.N + tk.S)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.bind("<Double-1>", self.start_edit)
+        self.tree.bind("<Delete>", self.remove_selected)
+        self.editor: ttk.Entry | None = None
+
+        self.new_abbr = ttk.Entry(self)
+        self.new_abbr.grid(row=2, column=0, columnspan=2, sticky=tk.W + tk.E)
+        self.new_expansion = ttk.Entry(self)
+        self.new_expansion.grid(row=2, column=2, sticky=tk.W + tk.E)
+        ttk.Button(self, text="+", width=3, command=self.add_abbreviation).grid(row=2, column=3)
+        ttk.Button(self, text="-", width=3, command=self.remove_selected).grid(row=2, column=4)
+
+        # The rows are identified by their abbreviation.
+        self.shown = self.index.search("")
+        """The abbreviations in the table, in the same alphabetical order. The others are detached."""
+        for abbr in self.shown:
+            self.tree.insert("", tk.END, iid=abbr, values=(abbr, abbreviations[abbr]))
+
+    def apply_filter(self, event=None):  # noqa: ARG002
+        matches = self.index.search(self.filter.get())
+        keep = set(matches)
+        if hidden := [abbr for abbr in self.shown if abbr not in keep]:
+            self.tree.detach(*hidden)
+        shown = set(self.shown)
+        # Everything before i is already in place, so moving the new rows in order puts them all where they belong.
+        for i, abbr in enumerate(matches):
+            if abbr not in shown:
+                self.tree.move(abbr, "", i)
+        self.shown = matches
+
+    def set_abbreviation(self, abbr: str, expansion: str):
+        get_abbreviations()[abbr] = expansion
+        self.index.add(abbr, expansion)
+        if self.tree.exists(abbr):
+            self.tree.item(abbr, values=(abbr, expansion))
+        else:
+            self.tree.insert("", tk.END, iid=abbr, values=(abbr, expansion))
+            self.tree.detach(abbr)
+        position = bisect.bisect_left(self.shown, abbr)
+        is_shown = position < len(self.shown) and self.shown[position] == abbr
+        if self.index.matches(abbr, self.filter.get()) and not is_shown:
+            self.shown.insert(position, abbr)
+            self.tree.move(abbr, "", position)
+        elif not self.index.matches(abbr, self.filter.get()) and is_shown:
+            del self.shown[position]
+            self.tree.detach(abbr)
+
+    def remove_abbreviation(self, abbr: str):
+        get_abbreviations().pop(abbr, None)
+        self.index.remove(abbr)
+        self.tree.delete(abbr)
+        position = bisect.bisect_left(self.shown, abbr)
+        if position < len(self.shown) and self.shown[position] == abbr:
+            del self.shown[position]
+
+    def remove_selected(self, event=None):  # noqa: ARG002
+        for abbr in self.tree.selection():
+            self.remove_abbreviation(abbr)
 
     def add_abbreviation(self):
-        abbr = self.new_abbr.get()
-        expansion = self.new_expansion.get()
-        if not abbr or not expansion:
+        abbr = self.new_abbr.get().strip()
+        expansion = self.new_expansion.get().strip()
+        if not abbr or not expansion or not confirm_abbreviation(self, abbr):
             return
-        abbreviations[abbr] = expansion
+        self.set_abbreviation(abbr, expansion)
         self.new_abbr.delete(0, tk.END)
         self.new_expansion.delete(0, tk.END)
-        self.draw_abbreviations()
+        if abbr in self.shown:
+            self.tree.selection_set(abbr)
+            self.tree.see(abbr)
+
+    def start_edit(self, event):
+        """Put an entry over the double clicked cell to edit it in place."""
+        self.finish_edit()
+        abbr = self.tree.identify_row(event.y)
+        column = self.tree.identify_column(event.x)
+        if not abbr or column not in ("#1", "#2"):
+            return
+        x, y, width, height = self.tree.bbox(abbr, column)  # pyright: ignore[reportGeneralTypeIssues]
+        self.editor = ttk.Entry(self.tree)
+        self.editor.insert(0, self.tree.set(abbr, column))
+        self.editor.select_range(0, tk.END)
+        self.editor.place(x=x, y=y, width=width, height=height)
+        self.editor.focus_set()
+        # Break so Return and Escape do not also close the settings.
+        self.editor.bind("<Return>", lambda _: self.finish_edit(abbr, column) or "break")
+        self.editor.bind("<KP_Enter>", lambda _: self.finish_edit(abbr, column) or "break")
+        self.editor.bind("<Escape>", lambda _: self.finish_edit() or "break")
+        self.editor.bind("<FocusOut>", lambda _: self.finish_edit(abbr, column))
+
+    def finish_edit(self, abbr: str | None = None, column: str | None = None):
+        """Close the editor, saving what was typed into the cell if it is given."""
+        if self.editor is None:
+            return
+        value = self.editor.get().strip()
+        # Cleared first since the message boxes below take the focus, which would finish the edit again.
+        editor, self.editor = self.editor, None
+        editor.destroy()
+        if abbr is None or not value or value == self.tree.set(abbr, column):
+            return
+        if column == "#2":
+            self.set_abbreviation(abbr, value)
+        elif confirm_abbreviation(self, value):
+            expansion = get_abbreviations()[abbr]
+            self.remove_abbreviation(abbr)
+            self.set_abbreviation(value, expansion)
+
 
+@cache
+def _load_abbreviations() -> AbbreviationStore:
+    return AbbreviationStore()
 
-# Singleton
-abbreviations = _AbbreviationStore()
+
+def get_abbreviations() -> AbbreviationStore:
+    """The abbreviation store, loaded from the config directory on first use.
+
+    It is reloaded if another instance changed the file since.
+    """
+    abbreviations = _load_abbreviations()
+    abbreviations.reload_if_changed()
+    return abbreviations
 
 
 # TODO: This widget pops up off-center when using multiple screes on Linux, possibly other platforms.
 # See https://stackoverflow.com/questions/30312875/tkinter-winfo-screenwidth-when-used-with-dual-monitors/57866046#57866046
 class AWAskAwayDialog(simpledialog.Dialog):
-    def __init__(self, title: str, prompt: str, history: list[str]) -> None:
-        self.prompt = prompt
+    """The prompt window. It is built once and hidden between prompts instead of destroyed.
+
+    simpledialog.Dialog builds its widgets and waits for them in its constructor and destroys them all when it is
+    closed, which on a slow display is a noticeable wait every time you come back. Here the constructor only builds
+    the window, show fills in the prompt and puts it on screen, and closing it only hides it again.
+    """
+
+    def __init__(self, parent: tk.Misc | None = None) -> None:
+        # Not Dialog.__init__, which would show the window and wait for it.
+        tk.Toplevel.__init__(self, parent or get_root())
+        self.withdraw()
+        self.parent = parent
+        self.result: str | Snooze | None = None
+        self.history: list[str] = []
+        self.history_index = 0
+        self.suggest: Callable[..., list[str]] | None = None
+        """Looks up past answers for what has been typed, like SuggestionIndex.suggest."""
+        self.closed = tk.BooleanVar(self, value=True)
+
+        body = ttk.Frame(self)
+        self.initial_focus = self.body(body)
+        body.pack(padx=5, pady=5)
+        self.buttonbox()
+        self.protocol("WM_DELETE_WINDOW", self.cancel)
+
+    def show(self, title: str, prompt: str, history: list[str], suggest: Callable[..., list[str]] | None = None):
+        """Reset the dialog for a new prompt and put it on screen."""
+        self.title(title)
+        self.prompt_label.configure(text=prompt)
         self.history = history
         self.history_index = len(history)
-        super().__init__(root, title)
+        self.suggest = suggest
+        self.result = None
+
+        self.set_text("")
+        self.completions.delete(0, tk.END)
+        if suggest is None:
+            self.completions.grid_remove()
+        else:
+            self.completions.grid()
+        # The abbreviations may have been changed by another instance since the last prompt.
+        self.expander = Expander(get_abbreviations().trie)
+        self.show_abbreviation_hints()
+
+        self.closed.set(False)
+        simpledialog._place_window(self)
+        self.initial_focus.focus_set()
+        # Wait for the window to appear on screen before grabbing, like Dialog does.
+        self.wait_visibility()
+        self.grab_set()
+
+    def ask(
+        self, title: str, prompt: str, history: list[str], suggest: Callable[..., list[str]] | None = None
+    ) -> str | Snooze | None:
+        """Show the dialog and wait for it to be closed."""
+        self.show(title, prompt, history, suggest)
+        self.wait_variable(self.closed)
+        return self.result
 
     # @override (when we get to 3.12)
     def body(self, master):
@@ -190,13 +311,24 @@ class AWAskAwayDialog(simpledialog.Dialog):
 
         # Prompt
         # Copied from the simpledialog source code.
-        w = ttk.Label(master, text=self.prompt, justify=tk.LEFT)
-        w.grid(row=0, padx=5, sticky=tk.W)
+        self.prompt_label = ttk.Label(master, justify=tk.LEFT)
+        self.prompt_label.grid(row=0, padx=5, sticky=tk.W)
 
         # Input field
         self.entry = ttk.Entry(master, name="entry", width=40)
         self.entry.grid(row=1, padx=5, sticky=tk.W + tk.E)
 
+        # Abbreviations that start with the word being typed
+        self.abbreviation_hints = ttk.Label(master, foreground="gray", width=40)
+        self.abbreviation_hints.grid(row=2, padx=5, sticky=tk.W)
+
+        # Past answers that match what has been typed, hidden by show when there is nothing to look them up in
+        self.completions = tk.Listbox(master, height=5, activestyle="none", exportselection=False)
+        self.completions.grid(row=3, padx=5, sticky=tk.W + tk.E)
+        self.completions.bind("<<ListboxSelect>>", self.use_completion)
+        self.entry.bind("<KeyRelease>", self.show_completions)
+        self.entry.bind("<Control-space>", self.use_completion)
+
         # README link
         doc_label = ttk.Label(master, text="Documentation", foreground="blue", cursor="hand2", justify=tk.RIGHT)
         doc_label.grid(row=0, padx=5, sticky=tk.W, column=1)
@@ -223,7 +355,9 @@ class AWAskAwayDialog(simpledialog.Dialog):
         self.bind("<Control-k>", self.previous_entry)
 
         # Expand abbreviations the user types
-        self.entry.bind("<KeyRelease>", self.expand_abbreviations)
+        self.expander = Expander(get_abbreviations().trie)
+        self.entry.bind("<KeyPress>", self.track_typing)
+        self.entry.bind("<Tab>", self.complete_abbreviation)
 
         # Add a new abbreviation from a highlighted section of text.
         self.entry.bind("<Control-n>", self.save_new_abbreviation)
@@ -261,32 +395,72 @@ class AWAskAwayDialog(simpledialog.Dialog):
             abbr, expansion = result
             abbr = abbr.strip()
             expansion = expansion.strip()
-            if not re.fullmatch(r"\w+", abbr):
-                messagebox.showerror("Invalid abbreviation", "Abbreviations must be alphanumeric and without spaces.")
+            if not confirm_abbreviation(self, abbr):
                 return
-
-            if existing := abbreviations.get(abbr):
-                if not messagebox.askyesno(
-                    "Overwrite confirmation",
-                    f"That abbreviation ({abbr}) already exists as '{existing}', would you like to over write?",
-                ):
-                    return
-            abbreviations[abbr] = expansion
+            get_abbreviations()[abbr] = expansion
+            self.resync_expander()
 
         # Refocus on the main text entry
         self.entry.focus_set()
 
-    def expand_abbreviations(self, event=None):  # noqa: ARG002
-        text = self.entry.get()
-        cursor_index = self.entry.index(tk.INSERT)
-
-        # Get the potential appreviation
-        abbr_regex = r"(['\w]+)\s$"  # Include ' so if you has s as an abbreviation "what's" doesn't expand to what is.
-        abbr = re.search(abbr_regex, text[:cursor_index])
-        if abbr and abbr.group(1) in abbreviations:
-            before_index = len(re.sub(abbr_regex, "", text[:cursor_index]))
-            self.entry.delete(before_index, cursor_index - 1)
-            self.entry.insert(before_index, abbreviations[abbr.group(1)])
+    def track_typing(self, event):
+        # This runs before the Entry inserts the character, which also keeps up with keys pressed quickly together.
+        ctrl = event.state & 0x4
+        if len(event.char) == 1 and event.char.isprintable() and not ctrl and not self.entry.selection_present():
+            finished = self.expander.feed(event.char)
+            self.show_abbreviation_hints()
+            if finished:
+                self.expand_abbreviation(*finished, event.char)
+                # We inserted the character ourselves.
+                return "break"
+        else:
+            # Deleting, moving the cursor, pasting and so on could change anything, so start over from the text.
+            self.after_idle(self.resync_expander)
+        return None
+
+    def resync_expander(self):
+        self.expander.reset(self.entry.get()[: self.entry.index(tk.INSERT)])
+        self.show_abbreviation_hints()
+
+    def expand_abbreviation(self, length: int, expansion: str, char: str):
+        """Replace the abbreviation right before the cursor with its expansion and the character that finished it."""
+        start = self.entry.index(tk.INSERT) - length
+        self.entry.delete(start, tk.INSERT)
+        self.entry.insert(start, expansion + char)
+
+    def show_abbreviation_hints(self):
+        self.abbreviation_hints.configure(
+            text="   ".join(f"{abbr} → {expansion}" for abbr, expansion in self.expander.completions())
+        )
+
+    def complete_abbreviation(self, event=None):  # noqa: ARG002
+        """Replace the word being typed with the expansion of the first suggestion."""
+        if completions := self.expander.completions(1):
+            cursor = self.entry.index(tk.INSERT)
+            start = cursor - len(self.expander.token)
+            self.entry.delete(start, cursor)
+            self.entry.insert(start, completions[0][1] + " ")
+            self.resync_expander()
+        # Do not move the focus to the next widget.
+        return "break"
+
+    def show_completions(self, event=None):  # noqa: ARG002
+        if self.suggest is None:
+            return
+        completions = self.suggest(self.entry.get(), now=datetime.datetime.now().astimezone())
+        if list(self.completions.get(0, tk.END)) != completions:
+            self.completions.delete(0, tk.END)
+            self.completions.insert(tk.END, *completions)
+
+    def use_completion(self, event=None):  # noqa: ARG002
+        """Fill in the selected past answer, or the best one if none is selected."""
+        selection = self.completions.curselection()
+        index = selection[0] if selection else 0
+        if index < self.completions.size():
+            self.set_text(self.completions.get(index))
+            self.resync_expander()
+        self.entry.focus_set()
+        return "break"
 
     def set_text(self, text: str):
         self.entry.delete(0, tk.END)
@@ -329,20 +503,22 @@ class AWAskAwayDialog(simpledialog.Dialog):
     def open_config(self, event=None):  # noqa: ARG002
         ConfigDialog(self)
 
+    def snooze(self, seconds: float):
+        """Close without an answer and ask again about this absence after seconds."""
+        self.result = Snooze(seconds)
+        self.cancel()
+
     def cancel(self, event=None):  # noqa: ARG002
-        # Call withdraw first because it is faster.
-        # The process should wait on the destroy instead of the human.
+        # Hide the window instead of destroying it so the next prompt can show it again.
+        self.grab_release()
         self.withdraw()
-        self.destroy()
-        # Wait a minute so we do not spam the user with the prompt again in like 5 seconds.
-        # TODO: Make this configurable in the settings dialog.
-        time.sleep(60)
+        self.closed.set(True)
 
     # @override (when we get to 3.12)
     def buttonbox(self):
         """The buttons at the bottom of the dialog.
 
-        This is overridden to add a "snooze" button.
+        This is overridden to add a "snooze" menu. Cancel snoozes for the default time.
         """
         box = ttk.Frame(self)
 
@@ -351,7 +527,13 @@ class AWAskAwayDialog(simpledialog.Dialog):
         w = ttk.Button(box, text="Cancel", width=10, command=self.cancel)
         w.pack(side=tk.LEFT, padx=5, pady=5)
 
-        # TODO: Figure out a quick easy way to pick how long to snooze for.
+        w = ttk.Menubutton(box, text="Snooze", width=10)
+        menu = tk.Menu(w, tearoff=False)
+        for label, length in SNOOZE_CHOICES.items():
+            menu.add_command(label=label, command=partial(self.snooze, length.total_seconds()))
+        w["menu"] = menu
+        w.pack(side=tk.LEFT, padx=5, pady=5)
+
         w = ttk.Button(box, text="Settings", command=self.open_config)
         w.pack(side=tk.LEFT, padx=5, pady=5)
 
@@ -361,9 +543,17 @@ class AWAskAwayDialog(simpledialog.Dialog):
         box.pack()
 
 
-def ask_string(title: str, prompt: str, history: list[str]):
-    d = AWAskAwayDialog(title, prompt, history)
-    return d.result
+@cache
+def get_dialog() -> AWAskAwayDialog:
+    """The prompt window, built on first use and reused for every prompt after that.
+
+    Like get_root, it must only be used from the thread that first calls this.
+    """
+    return AWAskAwayDialog()
+
+
+def ask_string(title: str, prompt: str, history: list[str], suggest: Callable[..., list[str]] | None = None):
+    return get_dialog().ask(title, prompt, history, suggest)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,205 @@
+"""Timings and counters for the hot paths, to see where the time goes when the watcher feels slow.
+
+The watcher calls count and timer around the interesting bits. Until enable is called (by the --metrics option) they
+do nothing but check a global, so leaving them in costs next to nothing.
+"""
+
+import contextlib
+import cProfile
+import datetime
+import json
+import logging
+import pstats
+import re
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+from aw_watcher_ask_away.cache import write_atomically
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "aw_watcher_ask_away"
+"""What the Prometheus metric names start with."""
+INTERVAL = 60
+"""How many seconds to wait between writing snapshots."""
+
+
+class Timing:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class _Timer:
+    __slots__ = ("recorder", "name", "started")
+
+    def __init__(self, recorder: "Recorder", name: str):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.recorder.observe(self.name, time.perf_counter() - self.started)
+
+
+class Recorder:
+    """Counters and timings by name. Safe to use from several threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: dict[str, float] = {}
+        self.timings: dict[str, Timing] = {}
+
+    def count(self, name: str, n: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            if (timing := self.timings.get(name)) is None:
+                timing = self.timings[name] = Timing()
+            timing.count += 1
+            timing.total += seconds
+            timing.max = max(timing.max, seconds)
+
+    def timer(self, name: str) -> _Timer:
+        return _Timer(self, name)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "time": datetime.datetime.now(datetime.UTC).isoformat(),
+                "counters": dict(self.counters),
+                "timings": {name: {"count": t.count, "sum": t.total, "max": t.max} for name, t in self.timings.items()},
+            }
+
+    def to_prometheus(self) -> str:
+        """The metrics in the Prometheus text format. Timings are summaries without quantiles plus a max gauge."""
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            metric = _metric_name(name) + "_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, timing in sorted(snapshot["timings"].items()):
+            metric = _metric_name(name) + "_seconds"
+            lines += [
+                f"# TYPE {metric} summary",
+                f"{metric}_sum {timing['sum']}",
+                f"{metric}_count {timing['count']}",
+                f"# TYPE {metric}_max gauge",
+                f"{metric}_max {timing['max']}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+def _metric_name(name: str) -> str:
+    return f"{PREFIX}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}"
+
+
+_recorder: Recorder | None = None
+_NULL_TIMER = contextlib.nullcontext()
+
+
+def enable() -> Recorder:
+    global _recorder  # noqa: PLW0603
+    _recorder = Recorder()
+    return _recorder
+
+
+def disable():
+    global _recorder  # noqa: PLW0603
+    _recorder = None
+
+
+def count(name: str, n: float = 1):
+    if _recorder is not None:
+        _recorder.count(name, n)
+
+
+def observe(name: str, seconds: float):
+    if _recorder is not None:
+        _recorder.observe(name, seconds)
+
+
+def timer(name: str) -> contextlib.AbstractContextManager:
+    """Time the with block. While metrics are disabled this is the same do-nothing context manager every time."""
+    return _NULL_TIMER if _recorder is None else _recorder.timer(name)
+
+
+class MetricsWriter:
+    """Write snapshots of a Recorder every so often from a background thread, and once more when stopped.
+
+    A path ending in .prom is overwritten with the Prometheus text format each time, so it can be picked up by the
+    node exporter's textfile collector. Anything else gets a JSON line appended for each snapshot.
+    """
+
+    def __init__(self, recorder: Recorder, path: Path, interval: float = INTERVAL):
+        self.recorder = recorder
+        self.path = path
+        self.interval = interval
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def write(self):
+        if self.path.suffix == ".prom":
+            write_atomically(self.path, self.recorder.to_prometheus())
+        else:
+            with self.path.open("a") as f:
+                f.write(json.dumps(self.recorder.snapshot()) + "\n")
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                logger.exception(f"Failed to write metrics to {self.path}.")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="metrics", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write()
+
+
+@contextlib.contextmanager
+def profile(path: Path) -> Iterator[None]:
+    """Profile the with block with cProfile and dump the stats to the path when it exits.
+
+    Before Python 3.12 cProfile only sees the thread it was enabled on, so threads started inside the block (like the
+    one polling runs on) get a profiler of their own and everything is added up at the end. Since 3.12 one profiler
+    sees every thread, and only one can be enabled at a time.
+    """
+    profiles = [cProfile.Profile()]
+
+    def profile_thread(*_):
+        thread_profile = cProfile.Profile()
+        # This replaces the profile function for the thread, so it only runs once per thread.
+        thread_profile.enable()
+        profiles.append(thread_profile)
+
+    per_thread = sys.version_info < (3, 12)
+    if per_thread:
+        threading.setprofile(profile_thread)
+    profiles[0].enable()
+    try:
+        yield
+    finally:
+        profiles[0].disable()
+        if per_thread:
+            threading.setprofile(None)  # pyright: ignore[reportArgumentType]
+        stats = pstats.Stats(*profiles)
+        stats.dump_stats(path)
+        logger.info(f"Wrote the profile to {path}, look at it with `python -m pstats {path}`.")
@@ -0,0 +1,225 @@
+"""A durable queue of events waiting to be sent to the server.
+
+Posting an answer should never block the dialog or lose what the user typed because the server is slow or down. So
+answers are first appended to a log on disk, then a background thread sends them to the server in batches.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import appdirs
+from aw_client.client import ActivityWatchClient
+from requests.exceptions import RequestException
+
+from aw_watcher_ask_away import metrics
+from aw_watcher_ask_away.core import DATA_KEY, Span, from_micros
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+"""The most events to send in one request."""
+MIN_BACKOFF = 1
+MAX_BACKOFF = 5 * 60
+"""How long to wait before retrying after a failed flush, in seconds. The wait doubles after each failure."""
+
+
+def _as_stored(span: Span) -> Span:
+    """The span as the server will store it. aw_core.Event rounds timestamps to milliseconds."""
+    return Span.from_event(span.to_event(DATA_KEY), DATA_KEY)
+
+
+class Outbox:
+    """A write-ahead log of events to insert, drained to the server by a background thread.
+
+    The log is a JSON lines file with "put" records for new events and "ack" records for events the server has.
+    Events put with a pulsetime are sent one at a time as heartbeats, so the server joins them onto its latest event.
+    Every write is fsync'd before returning so an answer survives a crash as soon as put returns.
+
+    A flush that fails might still have reached the server (say the connection dropped before the response came back)
+    so before retrying we check which events the server already has. This also happens for events left in the log by
+    a previous run.
+    """
+
+    def __init__(self, client: ActivityWatchClient, path: Path | None = None):
+        if path is None:
+            data_dir = Path(appdirs.user_data_dir("aw-watcher-ask-away"))
+            data_dir.mkdir(parents=True, exist_ok=True)
+            # Keep the testing server's events away from the real one.
+            path = data_dir / ("outbox-testing.jsonl" if client.testing else "outbox.jsonl")
+        self.client = client
+        self.path = path
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+
+        self._pending: dict[str, tuple[str, Span, float | None]] = {}
+        """The events the server might not have yet with their pulsetimes, by key, in the order they were put."""
+        self._load()
+        self._uncertain = bool(self._pending)
+        """Whether the server might already have some of the pending events."""
+
+        self.last_flush_latency: float | None = None
+        """How long the last successful flush took, in seconds."""
+        self.failures = 0
+        """The number of failed flushes in a row."""
+
+    @property
+    def depth(self) -> int:
+        """How many events are waiting to be sent."""
+        return len(self._pending)
+
+    def pending(self, bucket_id: str) -> list[Span]:
+        """The events for the bucket that are waiting to be sent."""
+        with self._lock:
+            return [span for bucket, span, _ in self._pending.values() if bucket == bucket_id]
+
+    def _load(self):
+        try:
+            f = self.path.open()
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Only the last line can be broken, by a crash part way through writing it.
+                    logger.warning(f"Skipping a broken line in the outbox: {line!r}")
+                    continue
+                if record["op"] == "put":
+                    pending = (record["bucket_id"], Span(*record["span"]), record.get("pulsetime"))
+                    self._pending[record["key"]] = pending
+                elif record["op"] == "ack":
+                    for key in record["keys"]:
+                        self._pending.pop(key, None)
+        if self._pending:
+            logger.info(f"{len(self._pending)} events from the last run are still waiting to be sent.")
+
+    def _append(self, record: dict):
+        with self.path.open("a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def put(self, bucket_id: str, span: Span, pulsetime: float | None = None):
+        """Queue an event for the bucket. Once this returns the event is safely on disk.
+
+        With a pulsetime it is sent as a heartbeat instead of inserted.
+        """
+        key = uuid.uuid4().hex
+        record = {"op": "put", "key": key, "bucket_id": bucket_id, "span": span}
+        if pulsetime is not None:
+            record["pulsetime"] = pulsetime
+        with self._lock:
+            self._append(record)
+            self._pending[key] = (bucket_id, span, pulsetime)
+        self._wake.set()
+
+    def _next_batch(self) -> tuple[str, dict[str, Span], float | None]:
+        """The next events to send with their pulsetime.
+
+        Either a run of inserts or a single heartbeat, so a heartbeat reaches the server after the event it extends.
+        """
+        with self._lock:
+            key, (bucket_id, span, pulsetime) = next(iter(self._pending.items()))
+            if pulsetime is not None:
+                return bucket_id, {key: span}, pulsetime
+            batch = {}
+            for key, (bucket, span, pulse) in self._pending.items():
+                if bucket != bucket_id:
+                    continue
+                if pulse is not None or len(batch) == BATCH_SIZE:
+                    break
+                batch[key] = span
+        return bucket_id, batch, None
+
+    def _already_sent(self, bucket_id: str, batch: dict[str, Span]) -> set[str]:
+        start = from_micros(min(span.start for span in batch.values()))
+        end = from_micros(max(span.end for span in batch.values()))
+        on_server = {
+            Span.from_event(event, DATA_KEY) for event in self.client.get_events(bucket_id, start=start, end=end)
+        }
+        return {key for key, span in batch.items() if _as_stored(span) in on_server}
+
+    def flush_once(self):
+        """Send one batch to the server. Raises if the server cannot be reached."""
+        bucket_id, batch, pulsetime = self._next_batch()
+        started = time.perf_counter()
+        if self._uncertain and (sent := self._already_sent(bucket_id, batch)):
+            logger.info(f"The server already has {len(sent)} of the queued events, not sending them again.")
+            batch = {key: span for key, span in batch.items() if key not in sent}
+            self._ack(sent)
+        if batch and pulsetime is not None:
+            # Sending a heartbeat again after a lost response extends the event to the same place, so it is safe.
+            [span] = batch.values()
+            self.client.heartbeat(bucket_id, span.to_event(DATA_KEY), pulsetime)
+            self._ack(batch.keys())
+        elif batch:
+            self.client.insert_events(bucket_id, [span.to_event(DATA_KEY) for span in batch.values()])
+            self._ack(batch.keys())
+        self._uncertain = False
+        self.last_flush_latency = time.perf_counter() - started
+        metrics.observe("outbox_flush", self.last_flush_latency)
+        logger.info(f"Sent {len(batch)} events in {self.last_flush_latency * 1000:.0f} ms, {self.depth} still waiting.")
+
+    def _ack(self, keys):
+        keys = list(keys)
+        with self._lock:
+            for key in keys:
+                self._pending.pop(key, None)
+            if self._pending:
+                self._append({"op": "ack", "keys": keys})
+            else:
+                # Nothing is waiting, so start the log over instead of letting it grow forever.
+                with self.path.open("w") as f:
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def flush(self):
+        """Send everything that is waiting. Raises if the server cannot be reached."""
+        while self._pending:
+            try:
+                self.flush_once()
+            except RequestException:
+                self._uncertain = True
+                raise
+
+    def _run(self):
+        backoff = MIN_BACKOFF
+        while True:
+            # Clear before flushing so a put during the flush is not missed.
+            self._wake.clear()
+            try:
+                self.flush()
+                self.failures = 0
+                backoff = MIN_BACKOFF
+                wait = None
+            except RequestException:
+                self.failures += 1
+                metrics.count("outbox_failures")
+                logger.exception(f"Failed to send events, {self.depth} waiting. Trying again in {backoff} seconds.")
+                wait = backoff
+                backoff = min(backoff * 2, MAX_BACKOFF)
+            if self._stopping:
+                return
+            self._wake.wait(wait)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        """Stop the background thread, giving it a little time to send what is waiting.
+
+        Anything that is not sent stays on disk and is sent on the next run.
+        """
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,100 @@
+# ruff: noqa: EM102
+"""Wait for the aw-server to be ready, at startup or after it went away.
+
+At login the watcher often starts before the server. Instead of sleeping a fixed time between attempts, we ask the
+server for its info with a short timeout and back off exponentially from a few tens of milliseconds, so we notice it
+is up soon after it actually is.
+"""
+
+import asyncio
+import logging
+import math
+import random
+import time
+from collections.abc import Callable, Iterator
+
+import requests
+from requests.exceptions import RequestException
+
+from aw_watcher_ask_away import metrics
+from aw_watcher_ask_away.core import AWWatcherAskAwayError
+
+logger = logging.getLogger(__name__)
+
+PROBE_TIMEOUT = 1
+"""How many seconds to give the server to answer a probe."""
+MIN_BACKOFF = 0.05
+MAX_BACKOFF = 5
+"""How long to wait between probes, in seconds. The wait doubles after each failed probe."""
+READY_TIMEOUT = 120
+"""How many seconds to wait for the server at startup before giving up."""
+
+
+def http_probe(server_address: str, timeout: float = PROBE_TIMEOUT) -> Callable[[], bool]:
+    """A probe that asks the server for its info, the cheapest thing it can answer."""
+
+    def probe() -> bool:
+        try:
+            requests.get(f"{server_address}/api/0/info", timeout=timeout).raise_for_status()
+        except RequestException:
+            return False
+        return True
+
+    return probe
+
+
+class Readiness:
+    """Probe the server until it answers, with jittered exponential back-off between probes.
+
+    The jitter keeps a lot of watchers that lost the same server from all coming back at the same moment.
+    """
+
+    def __init__(
+        self,
+        probe: Callable[[], bool],
+        *,
+        min_backoff: float = MIN_BACKOFF,
+        max_backoff: float = MAX_BACKOFF,
+        sleep: Callable[[float], None] = time.sleep,
+        clock: Callable[[], float] = time.monotonic,
+        rng: random.Random | None = None,
+    ):
+        self.probe = probe
+        self.min_backoff = min_backoff
+        self.max_backoff = max(min_backoff, max_backoff)
+        self._sleep = sleep
+        self._clock = clock
+        self._rng = rng or random.Random()
+
+    def delays(self) -> Iterator[float]:
+        """How long to wait after each failed probe: somewhere between half and all of the current back-off."""
+        backoff = self.min_backoff
+        while True:
+            yield backoff * (1 + self._rng.random()) / 2
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def wait(self, timeout: float = math.inf) -> float:
+        """Block until the server answers a probe and return how many seconds that took.
+
+        Raises AWWatcherAskAwayError if it does not answer within timeout seconds.
+        """
+        started = self._clock()
+        deadline = started + timeout
+        for delay in self.delays():
+            metrics.count("readiness_probes")
+            if self.probe():
+                return self._clock() - started
+            if (remaining := deadline - self._clock()) <= 0:
+                raise AWWatcherAskAwayError(f"The server was not ready after {timeout} seconds.")
+            self._sleep(min(delay, remaining))
+        raise AssertionError  # The delays never run out.
+
+    async def wait_async(self) -> float:
+        """Like wait with no timeout, but only blocks the event loop's default executor for one probe at a time."""
+        started = self._clock()
+        for delay in self.delays():
+            metrics.count("readiness_probes")
+            if await asyncio.to_thread(self.probe):
+                return self._clock() - started
+            await asyncio.sleep(delay)
+        raise AssertionError  # The delays never run out.
@@ -0,0 +1,269 @@
+"""Find and fix overlapping and duplicate absences in the aw-watcher-ask-away bucket, and join fragmented ones.
+
+Older versions of the watcher sometimes asked about the same absence twice (see AWAskAwayState.has_event), which
+left overlapping records behind. Answering the same thing for absences a short return apart (lunch, then lunch again)
+leaves a run of fragments that make every later read bigger, which compaction joins into one record.
+
+The bucket is read a page at a time in time order and checked with one sweep, so only the problems found are kept in
+memory and not the whole bucket. Nothing is changed on the server until the whole
+bucket has been read, so a fix is never read back in as a new record.
+"""
+
+import datetime
+from collections.abc import Iterable, Iterator
+from typing import NamedTuple
+
+import aw_core
+
+from aw_watcher_ask_away.core import (
+    DATA_KEY,
+    EPOCH,
+    LOCAL_TIMEZONE,
+    OVERLAP_THRESH,
+    AWAskAwayClient,
+    Span,
+    from_micros,
+    logger,
+    to_micros,
+)
+
+PAGE = datetime.timedelta(days=30)
+"""How much of the bucket to request at once."""
+STRATEGIES = ("merge", "trim", "delete")
+COMPACT_WITHIN = 5 * 60
+"""How many seconds apart two records with the same message can be and still be joined by default."""
+
+
+class Record(NamedTuple):
+    """A logged absence along with its id on the server, so it can be deleted."""
+
+    start: int
+    end: int
+    message: str
+    event_id: int | None = None
+
+    @classmethod
+    def from_event(cls, event: aw_core.Event) -> "Record":
+        span = Span.from_event(event, DATA_KEY)
+        return cls(span.start, span.end, span.label, event.id)
+
+    def to_event(self) -> aw_core.Event:
+        return Span(self.start, self.end, self.message).to_event(DATA_KEY)
+
+    @property
+    def duration(self) -> int:
+        return self.end - self.start
+
+    def __str__(self):
+        return f"{self.message!r} ({self.duration / 60_000_000:.1f} minutes)"
+
+
+class Problem(NamedTuple):
+    kind: str
+    """Either "duplicate" or "overlap", or "fragment" for records that compaction joins."""
+    first: Record
+    second: Record
+
+    def __str__(self):
+        start = from_micros(self.second.start).astimezone(LOCAL_TIMEZONE)
+        return f"{start:%Y-%m-%d %H:%M} {self.kind}: {self.first} and {self.second}"
+
+
+def oldest_start(client: AWAskAwayClient) -> datetime.datetime:
+    """A time at or before the start of every record in the bucket.
+
+    Backfill logs absences from before the bucket was created, so when the bucket was created is not enough. Instead
+    this does a binary search, to the second, for the first time that any record starts by.
+    """
+    created = datetime.datetime.fromisoformat(client.client.get_buckets()[client.bucket_id]["created"])
+
+    def any_start_by(end: datetime.datetime) -> bool:
+        return bool(client.client.get_events(client.bucket_id, limit=1, end=end))
+
+    if not any_start_by(created):
+        return created
+    low, high = EPOCH, created
+    while high - low > datetime.timedelta(seconds=1):
+        middle = low + (high - low) / 2
+        if any_start_by(middle):
+            high = middle
+        else:
+            low = middle
+    return low
+
+
+def iter_records(client: AWAskAwayClient, since: datetime.datetime, until: datetime.datetime) -> Iterator[Record]:
+    """Every record in the bucket that touches since to until, in start order, one page in memory at a time.
+
+    The server trims the records that cross the edge of a page to it, so those are fetched whole by their id. A record
+    that reaches into the next page is only yielded with the first page it is in.
+    """
+    page_start = since
+    yielded: set[int | None] = set()
+    while page_start < until:
+        page_end = min(page_start + PAGE, until)
+        events = client.get_whole_events(client.bucket_id, start=page_start, end=page_end)
+        reaching = set()
+        for record in sorted(Record.from_event(event) for event in events):
+            if record.end >= to_micros(page_end):
+                reaching.add(record.event_id)
+            if record.event_id not in yielded:
+                yield record
+        yielded = reaching
+        page_start = page_end
+
+
+class Repair:
+    """Plan the fixes for the problems found in one sweep over records sorted by start.
+
+    The sweep keeps the record that reaches the furthest so far. A record that starts before it ends is a problem:
+    a duplicate if most of the shorter one is covered, an overlap otherwise. Duplicates are always fixed by deleting
+    the later record. Overlaps are fixed with the strategy:
+
+    merge
+        Extend the first record over the second and add the second's message to it, then delete the second.
+    trim
+        Move the start of the second record to the end of the first, deleting it if nothing is left.
+    delete
+        Delete the second record.
+
+    Without a strategy the problems are only reported.
+    """
+
+    def __init__(self, strategy: str | None = None, duplicate_thresh: float = OVERLAP_THRESH):
+        self.strategy = strategy
+        self.duplicate_thresh = duplicate_thresh
+        self.scanned = 0
+        self.problems: list[Problem] = []
+        self.changes: dict[int | None, Record | None] = {}
+        """What to replace each record with, by the id it has on the server. None to delete it."""
+
+    def scan(self, records: Iterable[Record]):
+        reach: Record | None = None
+        for record in records:
+            self.scanned += 1
+            if reach is None or record.start >= reach.end:
+                reach = record
+                continue
+            overlap = min(record.end, reach.end) - record.start
+            shorter = min(record.duration, reach.duration)
+            is_duplicate = shorter <= 0 or overlap / shorter > self.duplicate_thresh
+            problem = Problem("duplicate" if is_duplicate else "overlap", reach, record)
+            self.problems.append(problem)
+            reach = self._fix(problem)
+
+    def _fix(self, problem: Problem) -> Record:
+        """Plan the fix for the problem and return the record that reaches the furthest afterwards."""
+        kind, first, second = problem
+        if self.strategy is None:
+            return second if second.end > first.end else first
+        if kind == "duplicate" or self.strategy == "delete" or (self.strategy == "trim" and second.end <= first.end):
+            self.changes[second.event_id] = None
+            return first
+        if self.strategy == "trim":
+            trimmed = self.changes[second.event_id] = second._replace(start=first.end)
+            return trimmed
+        if self.strategy == "merge":
+            messages = [first.message] if second.message in (first.message, "") else [first.message, second.message]
+            merged = first._replace(end=max(first.end, second.end), message="; ".join(filter(None, messages)))
+            self.changes[first.event_id] = merged
+            self.changes[second.event_id] = None
+            return merged
+        raise ValueError(self.strategy)
+
+    @property
+    def counts(self) -> tuple[int, int]:
+        """How many records would be deleted and how many rewritten."""
+        deleted = sum(1 for record in self.changes.values() if record is None)
+        return deleted, len(self.changes) - deleted
+
+    def apply(self, client: AWAskAwayClient, batch_size: int):
+        """Make the planned changes on the server, a batch at a time.
+
+        A changed record is inserted again and the old one deleted, since the server cannot update a record in
+        place. The new records of a batch are inserted before the old ones are deleted, so if this is interrupted the
+        worst case is a duplicate that the next repair picks up, never a lost record.
+        """
+        changes = list(self.changes.items())
+        for batch_start in range(0, len(changes), batch_size):
+            batch = changes[batch_start : batch_start + batch_size]
+            if inserts := [record.to_event() for _, record in batch if record is not None]:
+                client.client.insert_events(client.bucket_id, inserts)
+            for event_id, _ in batch:
+                client.client.delete_event(client.bucket_id, event_id)  # pyright: ignore[reportArgumentType]
+            logger.info(f"Repaired {min(batch_start + batch_size, len(changes))} of {len(changes)} records.")
+
+
+class Compaction(Repair):
+    """Plan joining each run of records with the same message that are at most within seconds apart into one.
+
+    The watcher does the same as it logs absences with --compact-within, this is for what was logged before. The first
+    record of a run is extended over the others and they are deleted.
+    """
+
+    def __init__(self, within: float = COMPACT_WITHIN):
+        super().__init__()
+        self.within = within
+
+    def scan(self, records: Iterable[Record]):
+        run: Record | None = None
+        for record in records:
+            self.scanned += 1
+            if run is None or record.message != run.message or record.start - run.end > self.within * 1_000_000:
+                run = record
+                continue
+            self.problems.append(Problem("fragment", run, record))
+            run = self.changes[run.event_id] = run._replace(end=max(run.end, record.end))
+            self.changes[record.event_id] = None
+
+
+def repair(
+    client: AWAskAwayClient,
+    since: datetime.datetime,
+    until: datetime.datetime,
+    strategy: str | None,
+    batch_size: int,
+    *,
+    dry_run: bool = False,
+) -> Repair:
+    """Print the problems in the bucket and fix them with the strategy, unless dry_run is set."""
+    plan = Repair(strategy)
+    plan.scan(iter_records(client, since, until))
+    for problem in plan.problems:
+        print(problem)  # noqa: T201
+    duplicates = sum(1 for problem in plan.problems if problem.kind == "duplicate")
+    print(  # noqa: T201
+        f"Scanned {plan.scanned} records, found {duplicates} duplicates and {len(plan.problems) - duplicates} "
+        "overlaps."
+    )
+    deleted, rewritten = plan.counts
+    if strategy is not None and dry_run:
+        print(f"Would delete {deleted} and rewrite {rewritten} records.")  # noqa: T201
+    elif strategy is not None:
+        plan.apply(client, batch_size)
+        print(f"Deleted {deleted} and rewrote {rewritten} records.")  # noqa: T201
+    return plan
+
+
+def compact(
+    client: AWAskAwayClient,
+    since: datetime.datetime,
+    until: datetime.datetime,
+    within: float,
+    batch_size: int,
+    *,
+    dry_run: bool = False,
+) -> Compaction:
+    """Join the fragmented records in the bucket, or only say what would be joined if dry_run is set."""
+    plan = Compaction(within)
+    plan.scan(iter_records(client, since, until))
+    deleted, rewritten = plan.counts
+    print(  # noqa: T201
+        f"Scanned {plan.scanned} records, {deleted + rewritten} of them are fragments that join into {rewritten}."
+    )
+    if dry_run:
+        print(f"Would delete {deleted} and rewrite {rewritten} records.")  # noqa: T201
+    else:
+        plan.apply(client, batch_size)
+        print(f"Deleted {deleted} and rewrote {rewritten} records.")  # noqa: T201
+    return plan
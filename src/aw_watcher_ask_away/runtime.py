@@ -0,0 +1,219 @@
+"""Poll for absences and ask about them at the same time.
+
+A dialog blocks the thread it runs on until it is closed, so if polling waited on it nothing would be fetched,
+posted or retried while you are typing. Instead the dialogs get a thread of their own and the rest runs on an asyncio
+event loop that hands them work through a queue and gets the answers back as futures.
+"""
+
+import asyncio
+import contextlib
+import datetime
+import logging
+import queue
+import threading
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from aw_watcher_ask_away import metrics
+from aw_watcher_ask_away.core import OVERLAP_THRESH, AbsenceIndex, AWAskAwayClient, Span, get_utc_now, to_micros
+from aw_watcher_ask_away.scheduler import PollScheduler
+
+if TYPE_CHECKING:
+    from aw_watcher_ask_away.readiness import Readiness
+
+logger = logging.getLogger(__name__)
+
+SNOOZE = 60
+"""How many seconds to wait before asking about an absence again after its prompt is cancelled."""
+SNOOZE_CHOICES = {
+    "5 minutes": datetime.timedelta(minutes=5),
+    "15 minutes": datetime.timedelta(minutes=15),
+    "1 hour": datetime.timedelta(hours=1),
+    "4 hours": datetime.timedelta(hours=4),
+}
+"""The snooze lengths offered by the dialog."""
+MAX_WAKE_WAIT = 60
+"""The most seconds to wait before checking for snoozes that are due. Snoozes are in wall clock time, which keeps
+going while the computer is suspended and the event loop's clock does not."""
+
+
+class Snooze(NamedTuple):
+    """What a prompt returns when you ask to be asked again later instead of answering."""
+
+    seconds: float
+
+
+class DialogWorker:
+    """Run functions one at a time on a thread that owns the Tk interpreter.
+
+    Tk only works from the thread that created it, so everything that touches a widget has to go through here. The
+    Tk root is created by whatever runs first.
+    """
+
+    def __init__(self):
+        self._requests: queue.SimpleQueue[tuple[Callable, tuple, Future] | None] = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="dialogs", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while (request := self._requests.get()) is not None:
+            fn, args, future = request
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:  # Whoever submitted it gets the exception from the future.
+                future.set_exception(e)
+
+    def submit(self, fn: Callable, *args: Any) -> Future:
+        future: Future = Future()
+        self._requests.put((fn, args, future))
+        return future
+
+    def stop(self, timeout: float = 1):
+        """Stop after anything already submitted. A dialog that is still open is left to die with the process."""
+        self._requests.put(None)
+        self._thread.join(timeout)
+
+
+class Runtime:
+    """The watch loop.
+
+    Polling and posting share a single worker thread so they never touch the state at once, while prompts wait on
+    the DialogWorker. Absences found while a prompt is open are queued up and asked about one after another. An
+    absence stays pending until its prompt is closed so the polls in the meantime do not queue it again.
+
+    Cancelling or snoozing a prompt puts that absence in the client's SnoozeQueue. It is queued again when it wakes
+    up, while other absences are still asked about in the meantime.
+    """
+
+    def __init__(
+        self,
+        client: AWAskAwayClient,
+        dialogs: DialogWorker,
+        ask: Callable[[Span, list[str]], "str | Snooze | None"],
+        scheduler: PollScheduler,
+        *,
+        depth: float,
+        length: float,
+        snooze: float = SNOOZE,
+        readiness: "Readiness | None" = None,
+    ):
+        """
+        Parameters
+        ----------
+        ask
+            Asks what you were doing during an absence given the recent answers. It runs on the dialog thread and
+            returns None if the prompt was cancelled, which snoozes the absence for `snooze` seconds, or a Snooze.
+        depth
+            The number of seconds to look into the past for events.
+        length
+            The number of seconds you need to be away before reporting on it.
+        readiness
+            Used to wait for the server to come back when a poll cannot reach it, instead of polling on the usual
+            schedule.
+        """
+        self.client = client
+        self.dialogs = dialogs
+        self.ask = ask
+        self.scheduler = scheduler
+        self.depth = depth
+        self.length = length
+        self.snooze = snooze
+        self.readiness = readiness
+        self._executor: ThreadPoolExecutor
+        self._queue: asyncio.Queue[Span]
+        self._pending = AbsenceIndex()
+        """The absences that are queued or being asked about."""
+        self._snoozes_changed: asyncio.Event
+
+    async def _in_state_thread(self, fn: Callable, *args: Any):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _poll(self) -> list[Span]:
+        return list(self.client.get_new_afk_events_to_note(seconds=self.depth, durration_thresh=self.length))
+
+    def _post(self, event: Span, message: str):
+        # Polls go on while the prompt is open, so it might have been logged somewhere else in the meantime.
+        if self.client.state.has_event(event):
+            logger.info(f"Not logging {message!r}, the absence was logged somewhere else while the prompt was open.")
+            return
+        self.client.post_event(event, message)
+
+    def _history(self) -> list[str]:
+        return [event.label for event in self.client.state.recent_events]
+
+    async def poll_forever(self):
+        while True:
+            for event in await self._in_state_thread(self._poll):
+                if not self.client.snoozed.is_snoozed(event):
+                    self._enqueue(event)
+            if self.readiness is not None and not self.client.connected:
+                logger.warning("Lost the connection to the server, waiting for it to come back.")
+                downtime = await self.readiness.wait_async()
+                logger.info(f"The server is back after {downtime:.1f} seconds.")
+                continue
+            self.scheduler.update(afk=self.client.is_afk)
+            await self.scheduler.sleep_async()
+
+    def _enqueue(self, event: Span):
+        if not self._pending.overlaps(event, OVERLAP_THRESH):
+            self._pending.add(event)
+            self._queue.put_nowait(event)
+
+    async def wake_forever(self):
+        """Queue snoozed absences again when they are due."""
+        while True:
+            self._snoozes_changed.clear()
+            wait = MAX_WAKE_WAIT
+            if (wake_at := self.client.snoozed.next_wake()) is not None:
+                wait = min(wait, (wake_at - to_micros(get_utc_now())) / 1_000_000)
+            if wait > 0:
+                with contextlib.suppress(TimeoutError):
+                    async with asyncio.timeout(wait):
+                        await self._snoozes_changed.wait()
+            for event in self.client.snoozed.pop_due(to_micros(get_utc_now())):
+                # It might have been logged somewhere else while it was snoozed.
+                if not await self._in_state_thread(self.client.state.has_event, event):
+                    self._enqueue(event)
+
+    async def _snooze(self, event: Span, seconds: float):
+        wake_at = to_micros(get_utc_now()) + int(seconds * 1_000_000)
+        self.client.snoozed.snooze(event, wake_at)
+        self._snoozes_changed.set()
+        await self._in_state_thread(self.client.save_cache)
+
+    async def prompt_forever(self):
+        while True:
+            event = await self._queue.get()
+            history = await self._in_state_thread(self._history)
+            with metrics.timer("prompt"):
+                response = await asyncio.wrap_future(self.dialogs.submit(self.ask, event, history))
+            if isinstance(response, Snooze):
+                metrics.count("prompts_snoozed")
+                await self._snooze(event, response.seconds)
+            elif response is None:
+                metrics.count("prompts_cancelled")
+                # So we do not spam you with the prompt again in like 5 seconds.
+                await self._snooze(event, self.snooze)
+            elif response:
+                metrics.count("prompts_answered")
+                logger.info(response)
+                await self._in_state_thread(self._post, event, response)
+            self._pending.remove(event)
+
+    async def run(self):
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="state")
+        self._queue = asyncio.Queue()
+        self._snoozes_changed = asyncio.Event()
+        try:
+            async with asyncio.TaskGroup() as tasks:
+                tasks.create_task(self.poll_forever())
+                tasks.create_task(self.prompt_forever())
+                tasks.create_task(self.wake_forever())
+        except ExceptionGroup as group:
+            # Only the first failure matters, the other task was just cancelled because of it.
+            raise group.exceptions[0] from None
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import time
+from collections.abc import Callable
+
+logger = logging.getLogger(__name__)
+
+SUSPEND_THRESH = 5
+"""How many more seconds the wall clock may move than the monotonic clock during a sleep before we call it a resume."""
+
+
+class PollScheduler:
+    """Decide how long to wait between polls of the afk bucket.
+
+    While you are away the interval doubles after every poll up to max_interval. As soon as you are back it drops
+    to min_interval so the prompt comes up quickly.
+
+    The monotonic clock stops while the computer is suspended but the wall clock does not. So when they disagree
+    after a sleep we know the computer was just resumed and poll right away. Long waits are split into chunks of
+    min_interval so a resume is noticed within min_interval seconds even while backed off.
+    """
+
+    def __init__(
+        self,
+        min_interval: float,
+        max_interval: float,
+        *,
+        wall_clock: Callable[[], float] = time.time,
+        monotonic_clock: Callable[[], float] = time.monotonic,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.interval = min_interval
+        self._wall_clock = wall_clock
+        self._monotonic_clock = monotonic_clock
+
+    def update(self, *, afk: bool | None):
+        """Pick the next interval given whether the last poll saw you as AFK."""
+        if afk:
+            self.interval = min(self.interval * 2, self.max_interval)
+        else:
+            self.interval = self.min_interval
+
+    async def sleep_async(self) -> bool:
+        """Sleep until the next poll.
+
+        This runs on the event loop so it stops as soon as it is cancelled, like when the watcher exits. Returns True if
+        we woke up early because the computer was resumed from suspend.
+        """
+        deadline = self._monotonic_clock() + self.interval
+        while (remaining := deadline - self._monotonic_clock()) > 0:
+            before = self._wall_clock(), self._monotonic_clock()
+            await asyncio.sleep(min(remaining, self.min_interval))
+            if self._resumed(*before):
+                return True
+        return False
+
+    def _resumed(self, wall_before: float, monotonic_before: float) -> bool:
+        drift = (self._wall_clock() - wall_before) - (self._monotonic_clock() - monotonic_before)
+        if drift > SUSPEND_THRESH:
+            logger.info(f"Resumed from suspend ({drift:.0f} seconds), polling now.")
+            self.interval = self.min_interval
+            return True
+        return False
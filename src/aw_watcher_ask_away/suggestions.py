@@ -0,0 +1,201 @@
+"""Suggest past answers as you type.
+
+Every answer ever logged is indexed by the words in it. The suggestions for what you have typed so far are the
+answers that have all the finished words and a word starting with the one you are typing, ranked by how often and how
+recently you gave them (and optionally how often you gave them around this time of day).
+"""
+
+import bisect
+import datetime
+import heapq
+import math
+import re
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from aw_watcher_ask_away.core import Span
+
+MAX_ANSWERS = 10_000
+"""The most distinct answers to remember. The ones given least recently are forgotten first."""
+HALF_LIFE = datetime.timedelta(days=30)
+"""How long it takes for an answer to count for half as much."""
+TOP_PER_WORD = 20
+"""How many of the best answers to keep ready for each word."""
+CACHE_SIZE = 256
+"""How many lookups to remember. They are forgotten whenever an answer is added."""
+
+
+def tokenize(text: str) -> list[str]:
+    return re.findall(r"[\w']+", text.lower())
+
+
+def _rank(count: int, last_used: int) -> float:
+    """The log2 of the count decayed by HALF_LIFE, up to a constant that only depends on when we look.
+
+    So ranks can be compared without knowing the time.
+    """
+    return math.log2(count) + last_used / (HALF_LIFE.total_seconds() * 1_000_000)
+
+
+class _Answer:
+    __slots__ = ("count", "last_used", "hours")
+
+    def __init__(self, count: int = 0, last_used: int = 0, hours: dict[int, int] | None = None):
+        self.count = count
+        self.last_used = last_used
+        """When the answer was last given, in epoch microseconds."""
+        self.hours = hours if hours is not None else {}
+        """How many times the answer was given in each local hour of the day."""
+
+
+class SuggestionIndex:
+    """An inverted index from words to the answers that contain them.
+
+    The words are also kept in a sorted list so the words starting with a prefix can be found with bisect. How often
+    and how recently an answer was given only changes when it is given again, so the ranking is a number stored per
+    answer instead of being worked out on every lookup.
+    """
+
+    def __init__(self, max_answers: int = MAX_ANSWERS):
+        self.max_answers = max_answers
+        self._answers: OrderedDict[str, _Answer] = OrderedDict()
+        """The answers, least recently given first."""
+        self._rank: dict[str, float] = {}
+        self._words: list[str] = []
+        self._answers_by_word: dict[str, set[str]] = {}
+        self._top_by_word: dict[str, list[str]] = {}
+        """The best TOP_PER_WORD answers for each word, worked out when first needed."""
+        self._cache: OrderedDict[tuple[str, int, int | None], list[str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._answers)
+
+    @classmethod
+    def from_spans(cls, spans: Iterable["Span"], max_answers: int = MAX_ANSWERS) -> "SuggestionIndex":
+        index = cls(max_answers)
+        for span in sorted(spans, key=lambda span: span.end):
+            index.add(span.label, span.end)
+        return index
+
+    def add(self, answer: str, timestamp: int):
+        """Note that the answer was given at the timestamp, in epoch microseconds."""
+        if not answer:
+            return
+        hour = datetime.datetime.fromtimestamp(timestamp / 1_000_000, datetime.UTC).astimezone().hour
+        with self._lock:
+            self._cache.clear()
+            if (stats := self._answers.get(answer)) is None:
+                stats = self._answers[answer] = _Answer()
+                for word in set(tokenize(answer)):
+                    if word not in self._answers_by_word:
+                        bisect.insort(self._words, word)
+                        self._answers_by_word[word] = set()
+                    self._answers_by_word[word].add(answer)
+            else:
+                self._answers.move_to_end(answer)
+            # The rank of this answer changes and nothing else, so only its words need a new top list.
+            for word in tokenize(answer):
+                self._top_by_word.pop(word, None)
+            stats.count += 1
+            stats.last_used = max(stats.last_used, timestamp)
+            stats.hours[hour] = stats.hours.get(hour, 0) + 1
+            self._rank[answer] = _rank(stats.count, stats.last_used)
+            while len(self._answers) > self.max_answers:
+                self._forget(next(iter(self._answers)))
+
+    def _forget(self, answer: str):
+        del self._answers[answer], self._rank[answer]
+        for word in set(tokenize(answer)):
+            self._top_by_word.pop(word, None)
+            answers = self._answers_by_word[word]
+            answers.discard(answer)
+            if not answers:
+                del self._answers_by_word[word]
+                del self._words[bisect.bisect_left(self._words, word)]
+
+    def _top(self, word: str) -> list[str]:
+        if (top := self._top_by_word.get(word)) is None:
+            answers = self._answers_by_word[word]
+            top = self._top_by_word[word] = heapq.nlargest(TOP_PER_WORD, answers, key=self._rank.__getitem__)
+        return top
+
+    def _candidates(self, text: str, n: int) -> set[str]:
+        """A set of answers that includes the best n for the text."""
+        words = tokenize(text)
+        if not words:
+            return set()
+        if text[-1].isspace():
+            finished, prefix = words, None
+        else:
+            finished, prefix = words[:-1], words[-1]
+
+        candidates = None
+        for word in sorted(finished, key=lambda word: len(self._answers_by_word.get(word, ()))):
+            answers = self._answers_by_word.get(word, set())
+            candidates = answers.copy() if candidates is None else candidates & answers
+            if not candidates:
+                return set()
+        if prefix is not None:
+            start = bisect.bisect_left(self._words, prefix)
+            stop = bisect.bisect_left(self._words, prefix + "\U0010ffff", start)
+            if candidates is None and n <= TOP_PER_WORD:
+                # The best n overall are among the best n for each word.
+                candidates = set().union(*(self._top(word)[:n] for word in self._words[start:stop]))
+            elif candidates is None:
+                candidates = set().union(*(self._answers_by_word[word] for word in self._words[start:stop]))
+            else:
+                # The finished words already narrowed it down, so checking each answer is cheaper than the union.
+                candidates = {
+                    answer for answer in candidates if any(word.startswith(prefix) for word in tokenize(answer))
+                }
+        return candidates or set()
+
+    def suggest(self, text: str, limit: int = 5, now: datetime.datetime | None = None) -> list[str]:
+        """The best few answers for what has been typed so far.
+
+        With now the answers you usually give around that hour of the day are ranked higher.
+        """
+        hour = None if now is None else now.astimezone().hour
+        key = (text, limit, hour)
+        with self._lock:
+            if (cached := self._cache.get(key)) is not None:
+                self._cache.move_to_end(key)
+                return cached
+
+            # Only rerank a few of the best so the lookup does not depend on how many answers match.
+            n = limit if hour is None else limit * 4
+            best = heapq.nlargest(n, self._candidates(text, n), key=self._rank.__getitem__)
+            if hour is not None:
+                best.sort(key=lambda answer: self._rank[answer] + self._hour_weight(answer, hour), reverse=True)
+            best = best[:limit]
+
+            self._cache[key] = best
+            if len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+            return best
+
+    def _hour_weight(self, answer: str, hour: int) -> float:
+        """Up to 1 (doubling the score) for answers always given within an hour of this one."""
+        stats = self._answers[answer]
+        near = sum(stats.hours.get((hour + offset) % 24, 0) for offset in (-1, 0, 1))
+        return near / stats.count
+
+    def to_json(self) -> list[Any]:
+        with self._lock:
+            return [[answer, s.count, s.last_used, s.hours] for answer, s in self._answers.items()]
+
+    @classmethod
+    def from_json(cls, data: list[Any], max_answers: int = MAX_ANSWERS) -> "SuggestionIndex":
+        index = cls(max_answers)
+        for answer, count, last_used, hours in data:
+            # JSON object keys are always strings.
+            index._answers[answer] = _Answer(count, last_used, {int(hour): n for hour, n in hours.items()})
+            index._rank[answer] = _rank(count, last_used)
+            for word in set(tokenize(answer)):
+                index._answers_by_word.setdefault(word, set()).add(answer)
+        index._words = sorted(index._answers_by_word)
+        return index
@@ -0,0 +1,97 @@
+"""An ActivityWatchClient that sends everything through one pooled, keep-alive HTTP session with timeouts.
+
+aw_client makes each request with requests.get and requests.post, which open a new connection every time and wait
+forever for an answer. With a poll every few seconds that is a lot of connection setup, and a hung server would hang
+the watcher along with it.
+"""
+
+import json
+from typing import Any
+
+import requests
+from aw_client.client import ActivityWatchClient, always_raise_for_request_errors
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CONNECT_TIMEOUT = 3
+READ_TIMEOUT = 10
+"""How many seconds to wait for a connection and for each response."""
+RETRIES = 2
+"""How many times to retry a request that failed in a way that is safe to retry."""
+POOL_SIZE = 10
+"""How many connections to keep open.
+
+Polling (with one request per afk bucket), the outbox and the cache check can each have a request in flight.
+"""
+
+
+def retry_policy(retries: int = RETRIES) -> Retry:
+    """Retry GETs on any connection problem or a 502/503/504, since they do not change anything.
+
+    Other requests are only retried when the connection could not be made, since then the server never saw them.
+    Inserts that might have reached the server are left to the outbox, which checks before sending them again.
+    """
+    return Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        other=0,
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        status_forcelist=(502, 503, 504),
+        backoff_factor=0.1,
+        raise_on_status=False,
+    )
+
+
+class PooledClient(ActivityWatchClient):
+    def __init__(
+        self,
+        *args,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        retries: int = RETRIES,
+        gzip: bool = False,
+        **kwargs,
+    ):
+        """
+        Parameters
+        ----------
+        gzip
+            Ask the server to compress responses. It saves bandwidth with a remote server, but on localhost it only
+            costs CPU, so by default responses are asked for uncompressed. Requests are never compressed since the
+            aw-server does not decompress them.
+        """
+        super().__init__(*args, **kwargs)
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.headers["Accept-Encoding"] = "gzip" if gzip else "identity"
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry_policy(retries))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @always_raise_for_request_errors
+    def _get(self, endpoint: str, params: dict | None = None) -> requests.Response:
+        return self.session.get(self._url(endpoint), params=params, timeout=self.timeout)
+
+    @always_raise_for_request_errors
+    def _post(self, endpoint: str, data: list[Any] | dict[str, Any], params: dict | None = None) -> requests.Response:
+        headers = {"Content-type": "application/json", "charset": "utf-8"}
+        return self.session.post(
+            self._url(endpoint),
+            data=bytes(json.dumps(data), "utf8"),
+            headers=headers,
+            params=params,
+            timeout=self.timeout,
+        )
+
+    @always_raise_for_request_errors
+    def _delete(self, endpoint: str, data: Any = None) -> requests.Response:
+        headers = {"Content-type": "application/json"}
+        return self.session.delete(
+            self._url(endpoint), data=json.dumps(data or {}), headers=headers, timeout=self.timeout
+        )
+
+    def disconnect(self):
+        super().disconnect()
+        self.session.close()
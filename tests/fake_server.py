@@ -0,0 +1,262 @@
+# ruff: noqa: EM102
+"""A stand-in for ActivityWatchClient that keeps the buckets in memory.
+
+It has the bucket, event and query methods the watcher uses, plus knobs for latency and errors and a way to act like
+aw-watcher-afk, so the watcher can be tested without a server. The end to end benchmark runs against it too.
+
+Like the aw-server, events are trimmed to the start and end they are asked for, and queries are run by aw-server's own
+query2 interpreter over those trimmed events.
+"""
+
+import datetime
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from typing import Any
+
+import aw_core
+from aw_query import query
+from aw_transform import heartbeat_merge
+from requests.exceptions import ConnectionError, RequestException
+
+from aw_watcher_ask_away.core import from_micros, get_utc_now, to_micros
+
+
+class FakeActivityWatchClient:
+    def __init__(
+        self,
+        *,
+        hostname: str = "host",
+        latency: float = 0,
+        error_rate: float = 0,
+        seed: int = 0,
+    ):
+        """
+        Parameters
+        ----------
+        latency
+            How many seconds every call takes.
+        error_rate
+            The chance that a call fails with a ConnectionError, like when the server is restarting.
+        """
+        self.client_hostname = hostname
+        self.server_address = "http://fake:5600"
+        self.testing = True
+        self.latency = latency
+        self.error_rate = error_rate
+        self.fail_next = 0
+        """Make this many of the next calls fail."""
+        self.error: type[RequestException] = ConnectionError
+        """What the failed calls raise, like HTTPError for a server that is up but answers with an error."""
+        self.lose_next = 0
+        """Make this many of the next writes go through but fail anyway, like when the response is lost."""
+        self.up = threading.Event()
+        """Calls wait while this is cleared, like when the server is still starting."""
+        self.up.set()
+        self.calls: Counter[str] = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.RLock()
+        self._buckets: dict[str, dict[str, Any]] = {}
+        self._events: dict[str, list[list]] = {}
+        """[start, end, data, id] in epoch microseconds, oldest first. The end is None for an event still going."""
+        self._ids = itertools.count(1)
+
+        self.afk_bucket_id = f"aw-watcher-afk_{hostname}"
+        self.create_bucket(self.afk_bucket_id, "afkstatus")
+        self.calls.clear()
+
+    def _call(self, name: str):
+        self.up.wait()
+        self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_next:
+            self.fail_next -= 1
+            raise self.error(f"Injected failure in {name}")
+        if self.error_rate and self._rng.random() < self.error_rate:
+            raise self.error(f"Injected failure in {name}")
+
+    def _respond(self, name: str):
+        if self.lose_next:
+            self.lose_next -= 1
+            raise ConnectionError(f"Injected lost response from {name}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def get_info(self) -> dict[str, Any]:
+        self._call("get_info")
+        return {"hostname": self.client_hostname, "version": "fake", "testing": self.testing}
+
+    def get_buckets(self) -> dict[str, dict[str, Any]]:
+        self._call("get_buckets")
+        with self._lock:
+            return {bucket_id: dict(bucket) for bucket_id, bucket in self._buckets.items()}
+
+    def create_bucket(
+        self,
+        bucket_id: str,
+        event_type: str,
+        queued: bool = False,  # noqa: ARG002, FBT001, FBT002
+        *,
+        hostname: str | None = None,
+    ):
+        """Make a bucket, for another computer if hostname is given, like a watcher running there would."""
+        self._call("create_bucket")
+        with self._lock:
+            self._buckets.setdefault(
+                bucket_id,
+                {
+                    "id": bucket_id,
+                    "type": event_type,
+                    "hostname": hostname or self.client_hostname,
+                    "created": get_utc_now().isoformat(),
+                },
+            )
+            self._events.setdefault(bucket_id, [])
+
+    def get_events(
+        self,
+        bucket_id: str,
+        limit: int = -1,
+        start: datetime.datetime | None = None,
+        end: datetime.datetime | None = None,
+    ) -> list[aw_core.Event]:
+        self._call("get_events")
+        return self.events(bucket_id, limit, start, end)
+
+    def events(
+        self,
+        bucket_id: str,
+        limit: int = -1,
+        start: datetime.datetime | None = None,
+        end: datetime.datetime | None = None,
+    ) -> list[aw_core.Event]:
+        """The events that intersect [start, end] trimmed to it, newest first, like the server.
+
+        This does not count as a call.
+        """
+        now = to_micros(get_utc_now())
+        lo = None if start is None else to_micros(start)
+        hi = None if end is None else to_micros(end)
+        with self._lock:
+            events = []
+            for event_start, stored_end, data, event_id in reversed(self._events[bucket_id]):
+                event_end = now if stored_end is None else stored_end
+                if (lo is None or event_end >= lo) and (hi is None or event_start <= hi):
+                    trimmed_start = event_start if lo is None else max(event_start, lo)
+                    trimmed_end = event_end if hi is None else min(event_end, hi)
+                    events.append((trimmed_start, trimmed_end, data, event_id))
+                    if len(events) == limit:
+                        break
+        return [self._to_event(*event) for event in events]
+
+    @staticmethod
+    def _to_event(start: int, end: int, data: dict, event_id: int) -> aw_core.Event:
+        # Events keep their timestamp in whole milliseconds, so round it down without moving the end.
+        start -= start % 1000
+        return aw_core.Event(
+            id=event_id, timestamp=from_micros(start), duration=from_micros(end) - from_micros(start), data=dict(data)
+        )
+
+    def get_event(self, bucket_id: str, event_id: int) -> aw_core.Event | None:
+        """The whole event, however far it reaches."""
+        self._call("get_event")
+        now = to_micros(get_utc_now())
+        with self._lock:
+            for start, end, data, stored_id in self._events[bucket_id]:
+                if stored_id == event_id:
+                    return self._to_event(start, now if end is None else end, data, event_id)
+        return None
+
+    def delete_event(self, bucket_id: str, event_id: int):
+        self._call("delete_event")
+        with self._lock:
+            self._events[bucket_id] = [e for e in self._events[bucket_id] if e[3] != event_id]
+        self._respond("delete_event")
+
+    def insert_event(self, bucket_id: str, event: aw_core.Event):
+        self._call("insert_event")
+        self._insert(bucket_id, [event])
+        self._respond("insert_event")
+
+    def insert_events(self, bucket_id: str, events: list[aw_core.Event]):
+        self._call("insert_events")
+        self._insert(bucket_id, events)
+        self._respond("insert_events")
+
+    def _insert(self, bucket_id: str, events: list[aw_core.Event]):
+        with self._lock:
+            stored = self._events[bucket_id]
+            for event in events:
+                start = to_micros(event.timestamp)
+                end = start + event.duration // datetime.timedelta(microseconds=1)
+                stored.append([start, end, dict(event.data), next(self._ids)])
+            stored.sort(key=lambda e: e[0])
+
+    def heartbeat(self, bucket_id: str, event: aw_core.Event, pulsetime: float):
+        """Merge the event into the latest one if it has the same data and is within pulsetime, or insert it."""
+        self._call("heartbeat")
+        with self._lock:
+            stored = self._events[bucket_id]
+            merged = None
+            if stored and stored[-1][1] is not None:
+                merged = heartbeat_merge(self._to_event(*stored[-1]), event, pulsetime)
+            if merged is not None:
+                stored[-1][1] = to_micros(merged.timestamp + merged.duration)
+            else:
+                self._insert(bucket_id, [event])
+        self._respond("heartbeat")
+
+    def query(self, program: str, timeperiods: list[tuple[datetime.datetime, datetime.datetime]]) -> list[Any]:
+        """Run a query2 program over each period, passing the results through JSON like the server's response."""
+        self._call("query")
+        datastore = _QueryDatastore(self, self._buckets)
+        results = [query("fake", program, start, end, datastore) for start, end in timeperiods]
+        return json.loads(json.dumps(results, default=self._to_json))
+
+    @staticmethod
+    def _to_json(value: Any) -> Any:
+        if isinstance(value, datetime.timedelta):
+            return value.total_seconds()
+        return value.isoformat()
+
+    def set_afk(self, afk: bool, at: int | None = None, bucket_id: str | None = None):  # noqa: FBT001
+        """Act like aw-watcher-afk noticing that you left or came back: end the current event and start a new one."""
+        at = to_micros(get_utc_now()) if at is None else at
+        with self._lock:
+            events = self._events[bucket_id or self.afk_bucket_id]
+            if events and events[-1][1] is None:
+                events[-1][1] = at
+            events.append([at, None, {"status": "afk" if afk else "not-afk"}, next(self._ids)])
+
+
+class _QueryBucket:
+    def __init__(self, server: FakeActivityWatchClient, bucket_id: str):
+        self.server = server
+        self.bucket_id = bucket_id
+
+    def get(
+        self, limit: int = -1, starttime: datetime.datetime | None = None, endtime: datetime.datetime | None = None
+    ) -> list[aw_core.Event]:
+        return self.server.events(self.bucket_id, limit, starttime, endtime)
+
+
+class _QueryDatastore:
+    """The part of aw-server's Datastore that the query2 interpreter reads buckets through."""
+
+    def __init__(self, server: FakeActivityWatchClient, buckets: dict[str, dict[str, Any]]):
+        self.server = server
+        self._buckets = buckets
+
+    def buckets(self) -> dict[str, dict[str, Any]]:
+        return self._buckets
+
+    def __getitem__(self, bucket_id: str) -> _QueryBucket:
+        return _QueryBucket(self.server, bucket_id)
@@ -0,0 +1,145 @@
+import json
+import random
+import re
+
+from aw_watcher_ask_away.abbreviations import AbbreviationIndex, AbbreviationStore, AbbreviationTrie, Expander
+
+
+def _type(expander: Expander, text: str) -> str:
+    """Type the text one character at a time, expanding abbreviations like the dialog does."""
+    typed = ""
+    for char in text:
+        if finished := expander.feed(char):
+            length, expansion = finished
+            typed = typed[: len(typed) - length] + expansion
+        typed += char
+    return typed
+
+
+def _regex_expand(abbreviations: dict[str, str], text: str) -> str:
+    """The regex expansion the dialog used to run after every key."""
+    typed = ""
+    for char in text:
+        typed += char
+        abbr = re.search(r"(['\w]+)\s$", typed)
+        if abbr and abbr.group(1) in abbreviations:
+            before = typed[: abbr.start(1)]
+            typed = before + abbreviations[abbr.group(1)] + typed[-1]
+    return typed
+
+
+def test_expander():
+    trie = AbbreviationTrie([("brb", "be right back"), ("s", "is"), ("ty vm", "thank you very much")])
+    assert _type(Expander(trie), "brb (brb) what's s ty vm brbx ") == (
+        "be right back (brb) what's is thank you very much brbx "
+    )
+
+    trie.remove("s")
+    trie.add("ty", "thank you")
+    # The shorter abbreviation finishes first.
+    assert _type(Expander(trie), "s ty vm ") == "s thank you vm "
+    assert len(trie) == 3
+
+
+def test_reset_only_looks_at_the_end():
+    trie = AbbreviationTrie([("brb", "be right back"), ("ty vm", "thank you very much")])
+    expander = Expander(trie)
+    expander.reset("a long sentence ending in ty")
+    assert expander.token == "ty"
+    assert expander.feed(" ") is None
+    assert expander.feed("v") is None
+    assert expander.feed("m") is None
+    assert expander.feed(" ") == (5, "thank you very much")
+
+    expander.reset("xbrb")
+    assert expander.feed(" ") is None
+
+
+def test_completions():
+    trie = AbbreviationTrie([("meet", "meeting"), ("me", "myself"), ("mtg", "meeting"), ("x", "y")])
+    expander = Expander(trie)
+    _type(expander, "a m")
+    assert expander.completions() == [("me", "myself"), ("meet", "meeting"), ("mtg", "meeting")]
+    _type(expander, "e")
+    assert expander.completions(1) == [("me", "myself")]
+    trie.remove("me")
+    assert trie.completions("me") == [("meet", "meeting")]
+    assert trie.get("m") is None
+    trie.remove("meet")
+    assert "e" not in trie.root.children["m"].children
+
+
+def test_matches_regex_expansion():
+    rng = random.Random(0)
+    alphabet = "ab'c "
+    abbreviations = {"".join(rng.choices("abc", k=rng.randint(1, 3))): rng.choice(["x", "yy", "a b"]) for _ in range(8)}
+    trie = AbbreviationTrie(abbreviations.items())
+    for _ in range(200):
+        text = "".join(rng.choices(alphabet, k=rng.randint(0, 30)))
+        assert _type(Expander(trie), text) == _regex_expand(abbreviations, text)
+
+
+def test_store_saves_once_after_a_burst(tmp_path):
+    path = tmp_path / "abbreviations.json"
+    store = AbbreviationStore(path, save_delay=60)
+    store.update({f"a{i}": f"expansion {i}" for i in range(5000)})
+    del store["a0"]
+    assert not path.exists()
+    store.flush()
+    saved = json.loads(path.read_text())
+    assert len(saved) == 4999
+    assert "a0" not in saved
+    assert store.trie.get("a1") == "expansion 1"
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_store_merges_changes_from_another_instance(tmp_path):
+    path = tmp_path / "abbreviations.json"
+    path.write_text(json.dumps({"brb": "be right back", "ty": "thank you"}))
+    first = AbbreviationStore(path, save_delay=60)
+    second = AbbreviationStore(path, save_delay=60)
+    expander = Expander(first.trie)
+
+    second["omw"] = "on my way"
+    del second["ty"]
+    second.flush()
+    first["lol"] = "laughing"
+    first.flush()
+    first.reload_if_changed()
+    assert dict(first) == {"brb": "be right back", "omw": "on my way", "lol": "laughing"}
+    assert _type(expander, "omw ty ") == "on my way ty "
+
+    second.reload_if_changed()
+    assert dict(second) == dict(first)
+
+
+def test_store_keeps_a_broken_file(tmp_path):
+    path = tmp_path / "abbreviations.json"
+    path.write_text('{"brb": "be ri')
+    store = AbbreviationStore(path, save_delay=60)
+    assert dict(store) == {}
+    assert (tmp_path / "abbreviations.broken.json").read_text() == '{"brb": "be ri'
+
+
+def test_index_matches_a_scan():
+    rng = random.Random(7)
+    words = ["be", "right", "back", "Thank", "you", "on", "my", "way", "lunch"]
+    abbreviations = {f"a{i}": " ".join(rng.choices(words, k=3)) for i in range(2000)}
+    index = AbbreviationIndex(abbreviations.items())
+
+    def scan(query: str) -> list[str]:
+        query = query.casefold()
+        return sorted(k for k, v in abbreviations.items() if query in k.casefold() or query in v.casefold())
+
+    # Typing, deleting and typing something else, with changes in between.
+    for query in ["t", "th", "tha", "thank y", "thank", "a1", "a12", "", "LUNCH", "unch"]:
+        assert index.search(query) == scan(query)
+        key = f"a{rng.randrange(2500)}"
+        if key in abbreviations and rng.random() < 0.5:
+            del abbreviations[key]
+            index.remove(key)
+        else:
+            abbreviations[key] = "thank you for lunch"
+            index.add(key, abbreviations[key])
+    assert len(index) == len(abbreviations)
+    assert index.matches("a1", "A1")
@@ -0,0 +1,83 @@
+import datetime
+import random
+
+import aw_core
+import pytest
+
+from aw_watcher_ask_away import core
+from aw_watcher_ask_away.outbox import Outbox
+
+from .fake_server import FakeActivityWatchClient
+
+np = pytest.importorskip("numpy")
+backfill = pytest.importorskip("aw_watcher_ask_away.backfill")
+
+
+def _random_intervals(rng: random.Random, n: int, max_length: int) -> list[tuple[int, int]]:
+    intervals = []
+    for _ in range(n):
+        start = rng.randrange(100_000)
+        intervals.append((start, start + rng.choice([0, rng.randrange(1, max_length)])))
+    return intervals
+
+
+def test_find_gaps_matches_sweep():
+    rng = random.Random(0)
+    for _ in range(100):
+        intervals = _random_intervals(rng, 200, 1000)
+        starts, ends = (np.array(column, dtype=np.int64) for column in zip(*intervals, strict=True))
+        gap_starts, gap_ends = backfill.find_gaps(starts, ends)
+        assert list(zip(gap_starts.tolist(), gap_ends.tolist(), strict=True)) == list(core.find_gaps(intervals))
+
+
+def test_find_gaps_empty():
+    gap_starts, gap_ends = backfill.find_gaps(np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+    assert len(gap_starts) == len(gap_ends) == 0
+
+
+def test_find_logged_matches_absence_index():
+    rng = random.Random(0)
+    for _ in range(50):
+        gaps = list(core.find_gaps(_random_intervals(rng, 100, 2000)))
+        # Some logged absences span several gaps and some overlap each other.
+        logged = _random_intervals(rng, 30, 10_000)
+        index = core.AbsenceIndex([core.Span(*interval) for interval in logged])
+
+        gap_starts, gap_ends = (np.array(column, dtype=np.int64) for column in zip(*gaps, strict=True))
+        logged_starts, logged_ends = (np.array(column, dtype=np.int64) for column in zip(*logged, strict=True))
+        for thresh in (0.0, 0.5, 0.95):
+            expected = [index.overlaps(core.Span(*gap), thresh) for gap in gaps]
+            actual = backfill.find_logged(gap_starts, gap_ends, logged_starts, logged_ends, thresh).tolist()
+            assert actual == expected
+
+
+def test_backfill_with_pages_and_outbox(tmp_path):
+    hour = datetime.timedelta(hours=1)
+    until = core.get_utc_now().replace(microsecond=0)
+    since = until - 2 * backfill.PAGE
+    boundary = since + backfill.PAGE
+    server = FakeActivityWatchClient()
+    outbox = Outbox(server, tmp_path / "outbox.jsonl")  # pyright: ignore[reportArgumentType]
+    client = core.AWAskAwayClient(server, outbox=outbox)  # pyright: ignore[reportArgumentType]
+    for start, end, status in [
+        (since, boundary - hour, "not-afk"),
+        (boundary - hour, boundary + hour, "afk"),
+        (boundary + hour, boundary + 2 * hour, "not-afk"),
+        (boundary + 2 * hour, boundary + 3 * hour, "afk"),
+        (boundary + 3 * hour, until, "not-afk"),
+    ]:
+        server.insert_event(
+            server.afk_bucket_id, aw_core.Event(timestamp=start, duration=end - start, data={"status": status})
+        )
+    # Lunch crosses from one page into the next, so the server trims it in both.
+    lunch = core.Span(core.to_micros(boundary - hour), core.to_micros(boundary + hour), "lunch")
+    server.insert_event(client.bucket_id, lunch.to_event())
+    # The walk was answered, but is still waiting in the outbox.
+    walk = core.Span(core.to_micros(boundary + 2 * hour), core.to_micros(boundary + 3 * hour))
+    client.post_event(walk, "walk")
+
+    gap_starts, gap_ends = backfill.find_unlogged_absences(client, since, until, 600)
+    assert list(zip(gap_starts.tolist(), gap_ends.tolist(), strict=True)) == [walk[:2]]
+    asked = []
+    backfill.backfill(client, since, until, 600, 10, ask=lambda span: asked.append(span) or "walk")
+    assert asked == []
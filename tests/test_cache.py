@@ -0,0 +1,90 @@
+import datetime
+import threading
+
+from aw_watcher_ask_away.cache import CACHE_VERSION, StateCache, write_atomically
+from aw_watcher_ask_away.core import DATA_KEY, AWAskAwayClient, Span, get_utc_now, to_micros
+from aw_watcher_ask_away.outbox import Outbox
+from aw_watcher_ask_away.readiness import Readiness
+
+from .fake_server import FakeActivityWatchClient
+
+
+def test_restart_uses_cache(tmp_path):
+    fake = FakeActivityWatchClient()
+    cache = StateCache(tmp_path / "state.json")
+    first = AWAskAwayClient(fake, cache=cache)  # pyright: ignore[reportArgumentType]
+    start = to_micros(get_utc_now() - datetime.timedelta(hours=1))
+    gap = Span(start, start + 600_000_000)
+    first.post_event(gap, "lunch")
+
+    # Another instance logs an absence while this one is not running.
+    end = to_micros(get_utc_now()) + 1_000_000
+    other = Span(end - 600_000_000, end, "walk")
+    fake.insert_event(first.bucket_id, other.to_event(DATA_KEY))
+
+    fake.calls.clear()
+    fake.up.clear()
+    second = AWAskAwayClient(fake, cache=cache)  # pyright: ignore[reportArgumentType]
+    assert not fake.calls  # Started without waiting on the server.
+    assert second.afk_bucket_ids == ["aw-watcher-afk_host"]
+    assert second.state.has_event(gap)
+    assert [e.label for e in second.state.recent_events] == ["lunch"]
+    assert second.suggestions.suggest("lu") == ["lunch"]
+
+    fake.up.set()
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread():
+            thread.join(timeout=5)
+    second._apply_cache_check()
+    assert second.state.has_event(other._replace(label=""))
+    assert [e.label for e in second.state.recent_events] == ["lunch", "walk"]
+    assert second.suggestions.suggest("w") == ["walk"]
+
+
+def test_cache_for_other_server_is_ignored(tmp_path):
+    cache = StateCache(tmp_path / "state.json")
+    cache.save("http://localhost:5666", "host", {"saved_at": 0})
+    assert cache.load("http://localhost:5600", "host") is None
+    assert cache.load("http://localhost:5666", "host") == {
+        "saved_at": 0,
+        "key": [CACHE_VERSION, "http://localhost:5666", "host"],
+    }
+
+
+def test_cache_is_checked_once_the_server_is_back(tmp_path):
+    fake = FakeActivityWatchClient()
+    cache = StateCache(tmp_path / "state.json")
+    AWAskAwayClient(fake, cache=cache).save_cache()  # pyright: ignore[reportArgumentType]
+    # Down for longer than a fixed number of retries would wait.
+    fake.fail_next = 20
+    probes = []
+    readiness = Readiness(lambda: bool(probes.append(None)) or True, min_backoff=0.001, max_backoff=0.001)
+    restored = AWAskAwayClient(fake, cache=cache, readiness=readiness)  # pyright: ignore[reportArgumentType]
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread():
+            thread.join(timeout=5)
+    assert len(probes) == 20
+    assert restored._missed_logged_events == []
+
+
+def test_restart_knows_about_answers_in_the_outbox(tmp_path):
+    fake = FakeActivityWatchClient()
+    cache = StateCache(tmp_path / "state.json")
+    first = AWAskAwayClient(fake, cache=cache)  # pyright: ignore[reportArgumentType]
+    first.save_cache()
+    # Queued, but the watcher stopped before saving the cache again.
+    start = to_micros(get_utc_now() - datetime.timedelta(hours=1))
+    lunch = Span(start, start + 600_000_000, "lunch")
+    Outbox(fake, tmp_path / "outbox.jsonl").put(first.bucket_id, lunch)  # pyright: ignore[reportArgumentType]
+
+    outbox = Outbox(fake, tmp_path / "outbox.jsonl")  # pyright: ignore[reportArgumentType]
+    second = AWAskAwayClient(fake, cache=cache, outbox=outbox)  # pyright: ignore[reportArgumentType]
+    assert second.state.has_event(lunch._replace(label=""))
+
+
+def test_write_atomically_replaces_the_file(tmp_path):
+    path = tmp_path / "state.json"
+    path.write_text("old")
+    write_atomically(path, "new")
+    assert path.read_text() == "new"
+    assert [p.name for p in tmp_path.iterdir()] == ["state.json"]
@@ -1,9 +1,34 @@
 # ruff: noqa: E501
 import datetime
+import json
+import random
+from copy import deepcopy
+from itertools import pairwise
 
 import aw_core
+import aw_transform
+import pytest
 
-from aw_watcher_ask_away.core import AWAskAwayState
+from aw_watcher_ask_away import core
+from aw_watcher_ask_away.core import (
+    ALL_HOSTS,
+    AbsenceIndex,
+    AFKTimeline,
+    AWAskAwayClient,
+    AWAskAwayState,
+    AWWatcherAskAwayError,
+    SnoozeQueue,
+    Span,
+    find_afk_buckets,
+    from_micros,
+    get_gaps,
+    get_utc_now,
+    squash_overlaps,
+    to_micros,
+)
+
+from . import fake_server
+from .fake_server import FakeActivityWatchClient
 
 AFK = "afk"
 NOT_AFK = "not-afk"
@@ -14,7 +39,7 @@ FIRST_DATE = datetime.datetime(1970, 1, 1, tzinfo=datetime.UTC)
 TupleEvent = tuple[int | datetime.datetime, int, str]
 
 
-def _tuple_to_event(tup: TupleEvent) -> aw_core.Event:
+def _tuple_to_aw_event(tup: TupleEvent) -> aw_core.Event:
     match tup[0]:
         case int():
             timestamp = FIRST_DATE + datetime.timedelta(seconds=tup[0])
@@ -25,8 +50,13 @@ def _tuple_to_event(tup: TupleEvent) -> aw_core.Event:
     return aw_core.Event(timestamp=timestamp, duration=tup[1], data={"status": tup[2]})
 
 
-def _event_to_tuple(event: aw_core.Event) -> tuple[int, int]:
-    return (int(event.timestamp.timestamp()), event.duration.seconds)
+def _tuple_to_event(tup: TupleEvent) -> Span:
+    # Go through aw_core.Event so the events get the same rounding as ones from the server.
+    return Span.from_event(_tuple_to_aw_event(tup), "status")
+
+
+def _event_to_tuple(event: Span) -> tuple[int, int]:
+    return (event.start // 1_000_000, event.duration // 1_000_000)
 
 
 def test_get_unseen_afk_events_initial():
@@ -52,21 +82,21 @@ def test_get_unseen_afk_events_initial():
     now = datetime.datetime.now().astimezone(datetime.UTC)
     events = list(state.get_unseen_afk_events([*init_events, _tuple_to_event((now, 10, NOT_AFK))], 10, 21))
     assert len(events) == 1
-    assert events[0].timestamp == FIRST_DATE + datetime.timedelta(seconds=80 + 100)
-    assert int(events[0].duration.total_seconds()) == int(
+    assert from_micros(events[0].start) == FIRST_DATE + datetime.timedelta(seconds=80 + 100)
+    assert events[0].duration // 1_000_000 == int(
         (now - (FIRST_DATE + datetime.timedelta(seconds=80 + 100))).total_seconds()
     )
 
 
 def test_double_ask_1():
-    # 2023-09-26 12:08:03 [DEBUG]: Checking for unseen in: [('2023-09-26T12:04:55.820000-04:00', 5, 'not-afk'), ('2023-09-26T11:58:16.969000-04:00', 398, 'afk'), ('2023-09-26T11:58:16.969000-04:00', 190, 'afk'), ('2023-09-26T11:55:10.545000-04:00', 186, 'not-afk'), ('2023-09-26T11:55:10.545000-04:00', 15, 'not-afk'), ('2023-09-26T11:49:27.192000-04:00', 343, 'afk'), ('2023-09-26T11:49:27.192000-04:00', 190, 'afk'), ('2023-09-26T11:11:22.127000-04:00', 2285, 'not-afk'), ('2023-09-26T11:00:43.666000-04:00', 638, 'afk'), ('2023-09-26T11:00:43.666000-04:00', 190, 'afk')]  (aw_watcher_ask_away.core:164)  # noqa: E501
-    # 2023-09-26 12:08:03 [DEBUG]: Found event to note: {'id': None, 'timestamp': datetime.datetime(2023, 9, 26, 15, 58, 16, 969000, tzinfo=datetime.timezone.utc), 'duration': datetime.timedelta(seconds=398, microseconds=851000), 'data': {'message': 'talk to nikhil'}}  (aw_watcher_ask_away.core:181)  # noqa: E501
-    # 2023-09-26 12:08:22 [DEBUG]: Checking for unseen in: [('2023-09-26T12:08:11.328000-04:00', 10, 'not-afk'), ('2023-09-26T12:05:00.965000-04:00', 190, 'afk'), ('2023-09-26T12:05:00.965000-04:00', 190, 'afk'), ('2023-09-26T12:04:55.820000-04:00', 5, 'not-afk'), ('2023-09-26T11:58:16.969000-04:00', 398, 'afk'), ('2023-09-26T11:58:16.969000-04:00', 190, 'afk'), ('2023-09-26T11:55:10.545000-04:00', 186, 'not-afk'), ('2023-09-26T11:55:10.545000-04:00', 15, 'not-afk'), ('2023-09-26T11:49:27.192000-04:00', 343, 'afk'), ('2023-09-26T11:49:27.192000-04:00', 190, 'afk')]  (aw_watcher_ask_away.core:164)  # noqa: E501
-    # 2023-09-26 12:08:22 [DEBUG]: Found event to note: {'id': None, 'timestamp': datetime.datetime(2023, 9, 26, 15, 58, 16, 969000, tzinfo=datetime.timezone.utc), 'duration': datetime.timedelta(seconds=594, microseconds=359000), 'data': {'message': 'Lunch: Talking to James and Ben about virtualization'}}  (aw_watcher_ask_away.core:181)  # noqa: E501
+    # 2023-09-26 12:08:03 [DEBUG]: Checking for unseen in: [('2023-09-26T12:04:55.820000-04:00', 5, 'not-afk'), ('2023-09-26T11:58:16.969000-04:00', 398, 'afk'), ('2023-09-26T11:58:16.969000-04:00', 190, 'afk'), ('2023-09-26T11:55:10.545000-04:00', 186, 'not-afk'), ('2023-09-26T11:55:10.545000-04:00', 15, 'not-afk'), ('2023-09-26T11:49:27.192000-04:00', 343, 'afk'), ('2023-09-26T11:49:27.192000-04:00', 190, 'afk'), ('2023-09-26T11:11:22.127000-04:00', 2285, 'not-afk'), ('2023-09-26T11:00:43.666000-04:00', 638, 'afk'), ('2023-09-26T11:00:43.666000-04:00', 190, 'afk')]  (aw_watcher_ask_away.core:164)
+    # 2023-09-26 12:08:03 [DEBUG]: Found event to note: {'id': None, 'timestamp': datetime.datetime(2023, 9, 26, 15, 58, 16, 969000, tzinfo=datetime.timezone.utc), 'duration': datetime.timedelta(seconds=398, microseconds=851000), 'data': {'message': 'talk to nikhil'}}  (aw_watcher_ask_away.core:181)
+    # 2023-09-26 12:08:22 [DEBUG]: Checking for unseen in: [('2023-09-26T12:08:11.328000-04:00', 10, 'not-afk'), ('2023-09-26T12:05:00.965000-04:00', 190, 'afk'), ('2023-09-26T12:05:00.965000-04:00', 190, 'afk'), ('2023-09-26T12:04:55.820000-04:00', 5, 'not-afk'), ('2023-09-26T11:58:16.969000-04:00', 398, 'afk'), ('2023-09-26T11:58:16.969000-04:00', 190, 'afk'), ('2023-09-26T11:55:10.545000-04:00', 186, 'not-afk'), ('2023-09-26T11:55:10.545000-04:00', 15, 'not-afk'), ('2023-09-26T11:49:27.192000-04:00', 343, 'afk'), ('2023-09-26T11:49:27.192000-04:00', 190, 'afk')]  (aw_watcher_ask_away.core:164)
+    # 2023-09-26 12:08:22 [DEBUG]: Found event to note: {'id': None, 'timestamp': datetime.datetime(2023, 9, 26, 15, 58, 16, 969000, tzinfo=datetime.timezone.utc), 'duration': datetime.timedelta(seconds=594, microseconds=359000), 'data': {'message': 'Lunch: Talking to James and Ben about virtualization'}}  (aw_watcher_ask_away.core:181)
 
     # fmt: off
-    first = [                                                                                                                                                          ("2023-09-26T12:04:55.820000-04:00", 5, "not-afk"), ("2023-09-26T11:58:16.969000-04:00", 398, "afk"), ("2023-09-26T11:58:16.969000-04:00", 190, "afk"), ("2023-09-26T11:55:10.545000-04:00", 186, "not-afk"), ("2023-09-26T11:55:10.545000-04:00", 15, "not-afk"), ("2023-09-26T11:49:27.192000-04:00", 343, "afk"), ("2023-09-26T11:49:27.192000-04:00", 190, "afk"), ("2023-09-26T11:11:22.127000-04:00", 2285, "not-afk"), ("2023-09-26T11:00:43.666000-04:00", 638, "afk"), ("2023-09-26T11:00:43.666000-04:00", 190, "afk")]  # noqa: E501
-    second = [("2023-09-26T12:08:11.328000-04:00", 10, "not-afk"), ("2023-09-26T12:05:00.965000-04:00", 190, "afk"), ("2023-09-26T12:05:00.965000-04:00", 190, "afk"), ("2023-09-26T12:04:55.820000-04:00", 5, "not-afk"), ("2023-09-26T11:58:16.969000-04:00", 398, "afk"), ("2023-09-26T11:58:16.969000-04:00", 190, "afk"), ("2023-09-26T11:55:10.545000-04:00", 186, "not-afk"), ("2023-09-26T11:55:10.545000-04:00", 15, "not-afk"), ("2023-09-26T11:49:27.192000-04:00", 343, "afk"), ("2023-09-26T11:49:27.192000-04:00", 190, "afk")]  # noqa: E501
+    first = [                                                                                                                                                          ("2023-09-26T12:04:55.820000-04:00", 5, "not-afk"), ("2023-09-26T11:58:16.969000-04:00", 398, "afk"), ("2023-09-26T11:58:16.969000-04:00", 190, "afk"), ("2023-09-26T11:55:10.545000-04:00", 186, "not-afk"), ("2023-09-26T11:55:10.545000-04:00", 15, "not-afk"), ("2023-09-26T11:49:27.192000-04:00", 343, "afk"), ("2023-09-26T11:49:27.192000-04:00", 190, "afk"), ("2023-09-26T11:11:22.127000-04:00", 2285, "not-afk"), ("2023-09-26T11:00:43.666000-04:00", 638, "afk"), ("2023-09-26T11:00:43.666000-04:00", 190, "afk")]
+    second = [("2023-09-26T12:08:11.328000-04:00", 10, "not-afk"), ("2023-09-26T12:05:00.965000-04:00", 190, "afk"), ("2023-09-26T12:05:00.965000-04:00", 190, "afk"), ("2023-09-26T12:04:55.820000-04:00", 5, "not-afk"), ("2023-09-26T11:58:16.969000-04:00", 398, "afk"), ("2023-09-26T11:58:16.969000-04:00", 190, "afk"), ("2023-09-26T11:55:10.545000-04:00", 186, "not-afk"), ("2023-09-26T11:55:10.545000-04:00", 15, "not-afk"), ("2023-09-26T11:49:27.192000-04:00", 343, "afk"), ("2023-09-26T11:49:27.192000-04:00", 190, "afk")]
     # fmt: on
     first = [_tuple_to_event(tup) for tup in first]
     second = [_tuple_to_event(tup) for tup in second]
@@ -78,8 +108,8 @@ def test_double_ask_1():
 
     second_unseen = list(state.get_unseen_afk_events(second, INF, 3 * 60))
     assert len(second_unseen) == 1
-    assert second_unseen[0].timestamp == datetime.datetime.fromisoformat("2023-09-26T12:05:00.820000-04:00")
-    assert int(second_unseen[0].duration.total_seconds()) == 190
+    assert from_micros(second_unseen[0].start) == datetime.datetime.fromisoformat("2023-09-26T12:05:00.820000-04:00")
+    assert second_unseen[0].duration // 1_000_000 == 190
 
 
 def test_double_ask_suspend_afk():
@@ -111,5 +141,227 @@ def test_double_ask_suspend_afk():
         seconds=1724.216
     )
     expected_end = datetime.datetime.fromisoformat("2023-10-13T08:47:38.792000-04:00")
-    assert second_unseen[0].timestamp == expected_start
-    assert second_unseen[0].duration.total_seconds() == (expected_end - expected_start).total_seconds()
+    assert from_micros(second_unseen[0].start) == expected_start
+    assert datetime.timedelta(microseconds=second_unseen[0].duration) == expected_end - expected_start
+
+
+def test_afk_timeline_merge_replaces_refetched_events():
+    timeline = AFKTimeline()
+    first = [_tuple_to_event(tup) for tup in [(120, 0, NOT_AFK), (60, 60, AFK), (0, 60, NOT_AFK)]]
+    timeline.merge(first, to_micros(FIRST_DATE))
+    assert timeline.cursor == 120_000_000
+
+    # The zero length not-afk event was overwritten and the afk event got extended by a heartbeat.
+    second = [_tuple_to_event(tup) for tup in [(130, 10, NOT_AFK), (60, 70, AFK)]]
+    timeline.merge(second, timeline.fetch_start)
+    assert [_event_to_tuple(e) for e in timeline.events] == [(130, 10), (60, 70), (0, 60)]
+    assert timeline.cursor == 130_000_000
+
+
+def test_afk_timeline_prune_keeps_gap_start():
+    timeline = AFKTimeline()
+    events = [(300, 10, NOT_AFK), (100, 200, AFK), (50, 50, NOT_AFK), (40, 10, AFK), (0, 40, NOT_AFK)]
+    timeline.merge([_tuple_to_event(tup) for tup in events], to_micros(FIRST_DATE))
+    timeline.prune(250_000_000)
+    # The not-afk event at 50 is needed to know that the gap ending at 300 started at 100.
+    assert [_event_to_tuple(e) for e in timeline.events] == [(300, 10), (100, 200), (50, 50)]
+
+    state = AWAskAwayState([])
+    assert [_event_to_tuple(e) for e in state.get_unseen_afk_events(timeline.events, INF, 10)] == [(100, 200)]
+
+
+def test_polls_against_a_trimming_server(monkeypatch):
+    """The server trims events to the range asked for, which must not shorten the events we already hold."""
+    minute = datetime.timedelta(minutes=1)
+    now = FIRST_DATE + 2 * 60 * minute
+    monkeypatch.setattr(core, "get_utc_now", lambda: now)
+    monkeypatch.setattr(fake_server, "get_utc_now", lambda: now)
+    server = FakeActivityWatchClient()
+    client = AWAskAwayClient(server)  # pyright: ignore[reportArgumentType]
+    start = now
+    changes = {0: False, 30: True, 40: False, 70: True, 74: False}
+    asked = []
+    for seconds in range(0, 80 * 60, 30):
+        now = start + datetime.timedelta(seconds=seconds)
+        if (afk := changes.get(seconds / 60)) is not None:
+            server.set_afk(afk, at=to_micros(now))
+        for absence in client.get_new_afk_events_to_note(seconds=10 * 60, durration_thresh=5 * 60):
+            asked.append(((absence.start - to_micros(start)) / 60e6, absence.duration / 60e6))
+            client.post_event(absence, "away")
+    # Away from 70 to 74 is too short to ask about, and the time in between was not an absence.
+    assert asked == [(30, 10)]
+
+
+def _linear_overlaps(logged: list[Span], new: Span, overlap_thresh: float) -> bool:
+    for recent in logged:
+        overlap = min(recent.end, new.end) - max(recent.start, new.start)
+        if overlap / new.duration > overlap_thresh:
+            return True
+    return False
+
+
+def test_absence_index_matches_linear_scan():
+    rng = random.Random(0)
+    # Include some overlapping records because old versions of the watcher logged those.
+    logged = [_tuple_to_event((rng.randrange(10_000), rng.randrange(1, 300), AFK)) for _ in range(200)]
+    index = AbsenceIndex(logged)
+    for _ in range(1000):
+        new = _tuple_to_event((rng.randrange(10_000), rng.randrange(1, 300), AFK))
+        for thresh in (0.0, 0.5, 0.95):
+            assert index.overlaps(new, thresh) == _linear_overlaps(logged, new, thresh)
+
+
+def test_absence_index_remembers_more_than_ten():
+    state = AWAskAwayState([])
+    gaps = [_tuple_to_event((i * 100, 50, AFK)) for i in range(50)]
+    for gap in gaps:
+        state.add_event(gap, "message")
+    assert len(state.recent_events) == 10
+    assert all(state.has_event(gap) for gap in gaps)
+
+    state.logged.prune(2500_000_000)
+    assert not state.has_event(gaps[0])
+    assert state.has_event(gaps[25])
+
+
+def _reference_gaps(events: list[aw_core.Event]) -> list[tuple[int, int]]:
+    # The implementation from before the sweep line engine: period_union, then gaps between consecutive events.
+    flattened = aw_transform.sort_by_timestamp(aw_transform.period_union(deepcopy(events), []))
+    return [
+        (
+            int((first.timestamp + first.duration).timestamp()),
+            (second.timestamp - first.timestamp - first.duration).seconds,
+        )
+        for first, second in pairwise(flattened)
+        if first.timestamp + first.duration < second.timestamp
+    ]
+
+
+def test_gaps_match_period_union():
+    rng = random.Random(0)
+    for _ in range(200):
+        # Zero length, touching and overlapping events are all common in the afk bucket.
+        events = [_tuple_to_aw_event((rng.randrange(1000), rng.choice([0, 5, 10, 50]), NOT_AFK)) for _ in range(20)]
+        spans = [Span.from_event(e, "status") for e in events]
+        assert [_event_to_tuple(e) for e in get_gaps(spans)] == _reference_gaps(events)
+        assert [_event_to_tuple(e) for e in get_gaps(squash_overlaps(spans))] == _reference_gaps(events)
+
+
+def test_find_afk_buckets():
+    buckets = {
+        "aw-watcher-afk_laptop": {"hostname": "laptop"},
+        "aw-watcher-afk_desktop": {"hostname": "desktop"},
+        "aw-watcher-window_laptop": {"hostname": "laptop"},
+    }
+    assert find_afk_buckets(buckets, ["laptop"]) == ["aw-watcher-afk_laptop"]
+    assert find_afk_buckets(buckets, ["laptop", "desktop"]) == ["aw-watcher-afk_desktop", "aw-watcher-afk_laptop"]
+    assert find_afk_buckets(buckets, [ALL_HOSTS]) == ["aw-watcher-afk_desktop", "aw-watcher-afk_laptop"]
+    with pytest.raises(AWWatcherAskAwayError):
+        find_afk_buckets(buckets, ["server"])
+    # A lone afk bucket is used even if its hostname does not match.
+    assert find_afk_buckets({"aw-watcher-afk_old-name": {}}, ["laptop"]) == ["aw-watcher-afk_old-name"]
+
+
+def two_computers(now: datetime.datetime) -> FakeActivityWatchClient:
+    def event(minutes_ago: int, minutes: int, status: str) -> aw_core.Event:
+        return aw_core.Event(
+            timestamp=now - datetime.timedelta(minutes=minutes_ago), duration=minutes * 60, data={"status": status}
+        )
+
+    # Away from the laptop from 30 to 10 minutes ago, but on the desktop from 25 to 20 minutes ago.
+    server = FakeActivityWatchClient(hostname="laptop")
+    server.create_bucket("aw-watcher-afk_desktop", "afkstatus", hostname="desktop")
+    server.insert_events("aw-watcher-afk_laptop", [event(10, 10, NOT_AFK), event(30, 20, AFK), event(60, 30, NOT_AFK)])
+    server.insert_events("aw-watcher-afk_desktop", [event(20, 20, AFK), event(25, 5, NOT_AFK), event(60, 35, AFK)])
+    return server
+
+
+@pytest.mark.parametrize(
+    ("hosts", "expected"),
+    [
+        (["laptop"], [(30, 20)]),
+        # Being on the desktop splits the absence into two that are each too short to ask about.
+        ([ALL_HOSTS], []),
+    ],
+)
+def test_merged_afk_buckets(hosts, expected):
+    now = get_utc_now()
+    client = AWAskAwayClient(two_computers(now), afk_hosts=hosts)  # pyright: ignore[reportArgumentType]
+    found = list(client.get_new_afk_events_to_note(seconds=3600, durration_thresh=12 * 60))
+    now_micros = to_micros(now)
+    assert [(round((now_micros - e.start) / 60e6), round(e.duration / 60e6)) for e in found] == expected
+    assert client.is_afk is False
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_query_finds_the_same_absences(seed):
+    rng = random.Random(seed)
+    now = get_utc_now()
+    server = FakeActivityWatchClient(hostname="laptop")
+    # Each computer alternates between active and away, with some zero length events and some time switched off.
+    for host in ["laptop", "desktop"]:
+        bucket_id = f"aw-watcher-afk_{host}"
+        server.create_bucket(bucket_id, "afkstatus", hostname=host)
+        at = now - datetime.timedelta(hours=6)
+        status = rng.choice([AFK, NOT_AFK])
+        while (end := at + datetime.timedelta(minutes=(minutes := rng.choice([0, 1, 5, 20, 45])))) < now:
+            server.insert_event(
+                bucket_id,
+                aw_core.Event(timestamp=at, duration=datetime.timedelta(minutes=minutes), data={"status": status}),
+            )
+            at = end + datetime.timedelta(minutes=rng.choice([0, 0, 0, 30]))
+            status = AFK if status == NOT_AFK else NOT_AFK
+
+    for depth in [30 * 60, 3 * 60 * 60]:
+        local = AWAskAwayClient(server, afk_hosts=[ALL_HOSTS])  # pyright: ignore[reportArgumentType]
+        queried = AWAskAwayClient(server, afk_hosts=[ALL_HOSTS], use_query=True)  # pyright: ignore[reportArgumentType]
+        expected = list(local.get_new_afk_events_to_note(seconds=depth, durration_thresh=60))
+        # Twice, since the next query starts from where the first one found the period before the window.
+        for _ in range(2):
+            assert list(queried.get_new_afk_events_to_note(seconds=depth, durration_thresh=60)) == expected
+            assert queried.is_afk == local.is_afk
+    assert server.calls["query"] >= 4
+
+
+def test_join_event():
+    minute = 60_000_000
+    state = AWAskAwayState([])
+    lunch = state.add_event(Span(0, 30 * minute), "lunch")
+    assert state.join_event(Span(36 * minute, 40 * minute), "lunch", 5 * 60) is None  # Too far apart.
+    assert state.join_event(Span(33 * minute, 40 * minute), "walk", 5 * 60) is None
+    joined = state.join_event(Span(33 * minute, 40 * minute), "lunch", 5 * 60)
+    assert joined == Span(0, 40 * minute, "lunch")
+    assert list(state.logged) == [joined]
+    assert list(state.recent_events) == [joined]
+    assert state.has_event(lunch)
+    assert state.has_event(Span(33 * minute, 40 * minute))
+
+
+def test_snooze_queue():
+    queue = SnoozeQueue()
+    lunch, walk, coffee = Span(0, 100), Span(200, 300), Span(400, 500)
+    queue.snooze(lunch, 30)
+    queue.snooze(walk, 10)
+    queue.snooze(coffee, 20)
+    # The ends of an absence can move a little between polls.
+    assert queue.is_snoozed(Span(0, 101))
+    assert not queue.is_snoozed(Span(100, 200))
+    assert queue.next_wake() == 10
+
+    assert queue.pop_due(25) == [walk, coffee]
+    assert not queue.is_snoozed(walk)
+
+    restored = SnoozeQueue.from_json(json.loads(json.dumps(queue.to_json())))
+    assert restored.next_wake() == 30
+    assert restored.pop_due(30) == [lunch]
+    assert len(restored) == 0
+
+
+def test_is_afk_everywhere_ignores_computers_that_stopped_reporting():
+    cutoff = datetime.datetime(2024, 1, 1, 12, tzinfo=datetime.UTC)
+    reporting = core.to_micros(cutoff) + 60_000_000
+    stopped = core.to_micros(cutoff) - 60_000_000
+    afk = Span(reporting - 10_000_000, reporting, "afk")
+    assert core.is_afk_everywhere([afk, Span(0, stopped, "not-afk")], cutoff) is True
+    assert core.is_afk_everywhere([afk, afk._replace(label="not-afk")], cutoff) is False
+    assert core.is_afk_everywhere([Span(0, stopped, "afk")], cutoff) is None
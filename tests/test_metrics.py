@@ -0,0 +1,86 @@
+import json
+import pstats
+import threading
+
+import pytest
+
+from aw_watcher_ask_away import metrics
+from aw_watcher_ask_away.core import AWAskAwayClient
+
+from .fake_server import FakeActivityWatchClient
+
+
+@pytest.fixture()
+def recorder():
+    yield metrics.enable()
+    metrics.disable()
+
+
+def test_disabled_does_nothing():
+    assert metrics.timer("poll") is metrics.timer("post")
+    with metrics.timer("poll"):
+        metrics.count("polls")
+
+
+def test_counts_and_times(recorder):
+    metrics.count("polls")
+    metrics.count("polls", 2)
+    with metrics.timer("get_events"):
+        pass
+    metrics.observe("get_events", 0.5)
+
+    snapshot = recorder.snapshot()
+    assert snapshot["counters"] == {"polls": 3}
+    assert snapshot["timings"]["get_events"]["count"] == 2
+    assert snapshot["timings"]["get_events"]["max"] == 0.5
+    assert snapshot["timings"]["get_events"]["sum"] >= 0.5
+
+
+def test_prometheus_format(recorder):
+    metrics.count("polls", 4)
+    metrics.observe("get_events", 0.25)
+    text = recorder.to_prometheus()
+    assert "# TYPE aw_watcher_ask_away_polls_total counter\naw_watcher_ask_away_polls_total 4\n" in text
+    assert "aw_watcher_ask_away_get_events_seconds_sum 0.25\n" in text
+    assert "aw_watcher_ask_away_get_events_seconds_count 1\n" in text
+    assert "aw_watcher_ask_away_get_events_seconds_max 0.25\n" in text
+
+
+def test_writer(recorder, tmp_path):
+    metrics.count("polls")
+    writer = metrics.MetricsWriter(recorder, tmp_path / "metrics.jsonl")
+    writer.write()
+    metrics.count("polls")
+    writer.write()
+    lines = [json.loads(line) for line in (tmp_path / "metrics.jsonl").read_text().splitlines()]
+    assert [line["counters"]["polls"] for line in lines] == [1, 2]
+
+    writer = metrics.MetricsWriter(recorder, tmp_path / "metrics.prom")
+    writer.write()
+    writer.write()
+    assert (tmp_path / "metrics.prom").read_text() == recorder.to_prometheus()
+
+
+def test_polls_are_counted(recorder):
+    fake = FakeActivityWatchClient()
+    client = AWAskAwayClient(fake)  # pyright: ignore[reportArgumentType]
+    fake.error_rate = 1  # The server goes away after startup.
+    assert list(client.get_new_afk_events_to_note(600, 60)) == []
+    snapshot = recorder.snapshot()
+    assert snapshot["counters"]["polls"] == 1
+    assert snapshot["counters"]["server_errors"] == 1
+    # Loading the logged absences at startup and the failed poll.
+    assert snapshot["timings"]["get_events"]["count"] == 2
+
+
+def test_profile_includes_threads(tmp_path):
+    def work_in_thread():
+        sum(range(1000))
+
+    with metrics.profile(tmp_path / "watcher.prof"):
+        thread = threading.Thread(target=work_in_thread)
+        thread.start()
+        thread.join()
+
+    functions = {name for _, _, name in pstats.Stats(str(tmp_path / "watcher.prof")).stats}  # pyright: ignore
+    assert "work_in_thread" in functions
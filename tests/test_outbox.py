@@ -0,0 +1,87 @@
+import pytest
+from requests.exceptions import ConnectionError
+
+from aw_watcher_ask_away.core import DATA_KEY, Span
+from aw_watcher_ask_away.outbox import Outbox
+
+from .fake_server import FakeActivityWatchClient
+
+BUCKET = "aw-watcher-ask-away_host"
+
+
+def _spans(n):
+    # Microsecond timestamps that the server rounds to milliseconds.
+    return [Span(i * 1_000_000_007, i * 1_000_000_007 + 300_000_003, f"task {i}") for i in range(n)]
+
+
+def _logged(client):
+    return [Span.from_event(e, DATA_KEY) for e in reversed(client.events(BUCKET))]
+
+
+def test_queued_events_survive_restart(tmp_path):
+    client = FakeActivityWatchClient()
+    client.create_bucket(BUCKET, "afktask")
+    client.error_rate = 1
+    outbox = Outbox(client, tmp_path / "outbox.jsonl")
+    for span in _spans(3):
+        outbox.put(BUCKET, span)
+    with pytest.raises(ConnectionError):
+        outbox.flush()
+    assert outbox.depth == 3
+
+    client.error_rate = 0
+    restarted = Outbox(client, tmp_path / "outbox.jsonl")
+    assert restarted.pending(BUCKET) == _spans(3)
+    restarted.flush()
+    assert restarted.depth == 0
+    assert [span.label for span in _logged(client)] == ["task 0", "task 1", "task 2"]
+    assert (tmp_path / "outbox.jsonl").read_text() == ""
+    assert Outbox(client, tmp_path / "outbox.jsonl").depth == 0
+
+
+def test_retry_after_lost_response_does_not_duplicate(tmp_path):
+    client = FakeActivityWatchClient()
+    client.create_bucket(BUCKET, "afktask")
+    outbox = Outbox(client, tmp_path / "outbox.jsonl")
+    for span in _spans(2):
+        outbox.put(BUCKET, span)
+
+    client.lose_next = 1
+    with pytest.raises(ConnectionError):
+        outbox.flush()
+    assert len(client.events(BUCKET)) == 2
+    assert outbox.depth == 2
+
+    outbox.put(BUCKET, _spans(3)[2])
+    outbox.flush()
+    assert outbox.depth == 0
+    assert [span.label for span in _logged(client)] == ["task 0", "task 1", "task 2"]
+    assert outbox.last_flush_latency is not None
+
+
+def test_heartbeats_extend_the_event_before_them(tmp_path):
+    minute = 60_000_000
+    client = FakeActivityWatchClient()
+    client.create_bucket(BUCKET, "afktask")
+    outbox = Outbox(client, tmp_path / "outbox.jsonl")
+    outbox.put(BUCKET, Span(0, 30 * minute, "lunch"))
+    outbox.put(BUCKET, Span(33 * minute, 40 * minute, "lunch"), 5 * 60)
+    outbox.put(BUCKET, Span(45 * minute, 50 * minute, "walk"))
+    outbox.flush()
+    assert _logged(client) == [
+        Span(0, 40 * minute, "lunch"),
+        Span(45 * minute, 50 * minute, "walk"),
+    ]
+
+    # Sending a heartbeat again after its response was lost changes nothing.
+    outbox.put(BUCKET, Span(52 * minute, 55 * minute, "walk"), 5 * 60)
+    client.lose_next = 1
+    with pytest.raises(ConnectionError):
+        outbox.flush()
+    restarted = Outbox(client, tmp_path / "outbox.jsonl")
+    assert restarted.depth == 1
+    restarted.flush()
+    assert _logged(client) == [
+        Span(0, 40 * minute, "lunch"),
+        Span(45 * minute, 55 * minute, "walk"),
+    ]
@@ -0,0 +1,49 @@
+import math
+import random
+
+import pytest
+
+from aw_watcher_ask_away.core import AWWatcherAskAwayError
+from aw_watcher_ask_away.readiness import Readiness
+
+
+class FakeServer:
+    """Starts answering probes at up_at seconds on a fake clock."""
+
+    def __init__(self, up_at: float):
+        self.up_at = up_at
+        self.now = 0.0
+        self.probes: list[float] = []
+
+    def probe(self) -> bool:
+        self.probes.append(self.now)
+        return self.now >= self.up_at
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+    def readiness(self, **kwargs) -> Readiness:
+        return Readiness(self.probe, sleep=self.sleep, clock=lambda: self.now, rng=random.Random(0), **kwargs)
+
+
+def test_delays_back_off_with_jitter():
+    delays = FakeServer(0).readiness(min_backoff=0.05, max_backoff=1).delays()
+    backoffs = [0.05, 0.1, 0.2, 0.4, 0.8, 1, 1, 1]
+    for backoff in backoffs:
+        assert backoff / 2 <= next(delays) <= backoff
+
+
+@pytest.mark.parametrize("up_at", [0, 0.01, 1, 30])
+def test_ready_soon_after_the_server_is(up_at):
+    server = FakeServer(up_at)
+    waited = server.readiness(max_backoff=5).wait()
+    assert waited >= up_at
+    # At worst we wait one full back-off after the server came up.
+    assert waited <= max(up_at * 2, 0.05) and waited <= up_at + 5
+
+
+def test_gives_up_at_the_deadline():
+    server = FakeServer(math.inf)
+    with pytest.raises(AWWatcherAskAwayError):
+        server.readiness().wait(10)
+    assert server.now == pytest.approx(10)
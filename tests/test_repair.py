@@ -0,0 +1,133 @@
+import datetime
+import random
+
+import pytest
+
+from aw_watcher_ask_away.core import EPOCH, AWAskAwayClient, Span, to_micros
+from aw_watcher_ask_away.repair import PAGE, STRATEGIES, Compaction, Record, Repair, iter_records, oldest_start, repair
+
+from .fake_server import FakeActivityWatchClient
+
+MINUTE = 60_000_000
+
+
+def _record(start: int, minutes: int, message: str, event_id: int) -> Record:
+    return Record(start * MINUTE, (start + minutes) * MINUTE, message, event_id)
+
+
+LUNCH = _record(0, 30, "lunch", 1)
+LUNCH_AGAIN = _record(0, 30, "lunch", 2)
+WALK = _record(20, 30, "walk", 3)
+COFFEE = _record(60, 10, "coffee", 4)
+
+
+def test_finds_duplicates_and_overlaps():
+    plan = Repair()
+    plan.scan([LUNCH, LUNCH_AGAIN, WALK, COFFEE])
+    assert [(p.kind, p.first.event_id, p.second.event_id) for p in plan.problems] == [
+        ("duplicate", 1, 2),
+        ("overlap", 1, 3),
+    ]
+    assert plan.changes == {}
+
+
+@pytest.mark.parametrize(
+    ("strategy", "changes"),
+    [
+        ("merge", {2: None, 1: _record(0, 50, "lunch; walk", 1), 3: None}),
+        ("trim", {2: None, 3: _record(30, 20, "walk", 3)}),
+        ("delete", {2: None, 3: None}),
+    ],
+)
+def test_strategies(strategy, changes):
+    plan = Repair(strategy)
+    plan.scan([LUNCH, LUNCH_AGAIN, WALK, COFFEE])
+    assert plan.changes == changes
+
+
+def test_fixes_leave_no_overlaps():
+    rng = random.Random(0)
+    records = sorted(_record(rng.randrange(10_000), rng.randrange(1, 60), "x", i) for i in range(1000))
+    for strategy in ("merge", "trim", "delete"):
+        plan = Repair(strategy)
+        plan.scan(records)
+        fixed = [plan.changes.get(r.event_id, r) for r in records]
+        check = Repair()
+        check.scan(sorted(r for r in fixed if r is not None))
+        assert check.problems == []
+
+
+def test_compaction_joins_runs():
+    records = [
+        _record(0, 30, "lunch", 1),
+        _record(33, 7, "lunch", 2),
+        _record(42, 10, "lunch", 3),
+        _record(70, 10, "lunch", 4),  # Too long after the others.
+        _record(81, 5, "walk", 5),
+        _record(86, 5, "coffee", 6),
+        _record(91, 5, "walk", 7),  # Not right after the other walk.
+    ]
+    plan = Compaction(within=5 * 60)
+    plan.scan(records)
+    assert plan.changes == {1: _record(0, 52, "lunch", 1), 2: None, 3: None}
+    assert plan.counts == (2, 1)
+    assert [p.kind for p in plan.problems] == ["fragment", "fragment"]
+
+
+def _server(records: list[Record]) -> tuple[FakeActivityWatchClient, AWAskAwayClient]:
+    """A server with the records, which gets their ids right as long as they are numbered from 1 in order."""
+    server = FakeActivityWatchClient()
+    client = AWAskAwayClient(server)  # pyright: ignore[reportArgumentType]
+    server.insert_events(client.bucket_id, [r.to_event() for r in records])
+    server.calls.clear()
+    return server, client
+
+
+def _logged(server: FakeActivityWatchClient, client: AWAskAwayClient) -> list[tuple[int, int, str]]:
+    return sorted(Record.from_event(event)[:3] for event in server.events(client.bucket_id))
+
+
+def test_pages_yield_each_record_once():
+    page = PAGE // datetime.timedelta(minutes=1)
+    # Some records cross the page boundaries, the server trims those to the page.
+    records = [_record(i * page // 3 - 10, 20, str(i), i) for i in range(1, 12)]
+    server, client = _server(records)
+    until = EPOCH + 4 * PAGE
+    assert list(iter_records(client, EPOCH, until)) == records
+    assert server.calls["get_events"] == 4
+
+
+def test_compaction_keeps_records_that_cross_a_page():
+    page = PAGE // datetime.timedelta(minutes=1)
+    walk = _record(2 * page - 10, 20, "walk", 3)
+    server, client = _server([_record(page - 40, 25, "lunch", 1), _record(page - 10, 20, "lunch", 2), walk])
+    plan = Compaction(within=5 * 60)
+    # A whole second since, so the second half of lunch would pass as a record that starts in the next page.
+    plan.scan(iter_records(client, EPOCH + datetime.timedelta(seconds=1), EPOCH + 3 * PAGE))
+    assert plan.scanned == 3
+    assert plan.changes == {1: _record(page - 40, 50, "lunch", 1), 2: None}
+    plan.apply(client, batch_size=10)
+    assert _logged(server, client) == [_record(page - 40, 50, "lunch", 1)[:3], walk[:3]]
+
+
+@pytest.mark.parametrize("strategy", STRATEGIES)
+def test_fixes_records_that_cross_a_page(strategy):
+    page = PAGE // datetime.timedelta(minutes=1)
+    server, client = _server([_record(page - 10, 20, "lunch", 1), _record(page - 5, 20, "walk", 2)])
+    plan = repair(client, EPOCH, EPOCH + 2 * PAGE, strategy, batch_size=10)
+    assert [(p.first.duration, p.second.duration) for p in plan.problems] == [(20 * MINUTE, 20 * MINUTE)]
+    expected = {
+        "merge": [_record(page - 10, 25, "lunch; walk", 1)],
+        "trim": [_record(page - 10, 20, "lunch", 1), _record(page + 10, 5, "walk", 2)],
+        "delete": [_record(page - 10, 20, "lunch", 1)],
+    }
+    assert _logged(server, client) == [r[:3] for r in expected[strategy]]
+
+
+def test_oldest_start_finds_records_from_before_the_bucket():
+    server, client = _server([])
+    assert oldest_start(client) == datetime.datetime.fromisoformat(server.get_buckets()[client.bucket_id]["created"])
+    # Backfilled from long before the bucket was created.
+    start = EPOCH + 20 * 365 * datetime.timedelta(days=1)
+    server.insert_event(client.bucket_id, Span(to_micros(start), to_micros(start) + 10 * MINUTE, "lunch").to_event())
+    assert start - datetime.timedelta(seconds=1) <= oldest_start(client) <= start
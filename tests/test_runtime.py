@@ -0,0 +1,227 @@
+import asyncio
+import contextlib
+import threading
+import time
+
+from requests.exceptions import HTTPError
+
+from aw_watcher_ask_away.cache import StateCache
+from aw_watcher_ask_away.core import DATA_KEY, AWAskAwayClient, Span, get_utc_now, to_micros
+from aw_watcher_ask_away.readiness import Readiness
+from aw_watcher_ask_away.runtime import DialogWorker, Runtime, Snooze
+from aw_watcher_ask_away.scheduler import PollScheduler
+
+from .fake_server import FakeActivityWatchClient
+
+MINUTE = 60_000_000
+
+
+def _server(*absences: tuple[int, int]) -> tuple[FakeActivityWatchClient, list[Span]]:
+    """A server where you were away for each (from, to) minutes ago and are back now, with those absences."""
+    fake = FakeActivityWatchClient()
+    now = _now()
+    fake.set_afk(False, at=now - 90 * MINUTE)
+    return fake, [_away(fake, now, *absence) for absence in absences]
+
+
+def _now() -> int:
+    # Whole milliseconds, which is all the timestamps of events keep.
+    return to_micros(get_utc_now()) // 1000 * 1000
+
+
+def _away(fake: FakeActivityWatchClient, now: int, start: int, end: int) -> Span:
+    fake.set_afk(True, at=now - start * MINUTE)
+    fake.set_afk(False, at=now - end * MINUTE)
+    return Span(now - start * MINUTE, now - end * MINUTE)
+
+
+async def _wait_for(done, timeout=5):
+    async with asyncio.timeout(timeout):
+        while not done():
+            await asyncio.sleep(0.01)
+
+
+def _posted(fake: FakeActivityWatchClient, client: AWAskAwayClient) -> list[Span]:
+    return [Span.from_event(event, DATA_KEY) for event in reversed(fake.events(client.bucket_id))]
+
+
+def test_polling_continues_while_a_prompt_is_open():
+    fake, [lunch] = _server((50, 40))
+    client = AWAskAwayClient(fake)  # pyright: ignore[reportArgumentType]
+    answer = threading.Event()
+    asked = []
+
+    def ask(event, history):
+        asked.append((event, history))
+        answer.wait()
+        return "lunch" if event == lunch else "walk"
+
+    dialogs = DialogWorker()
+    runtime = Runtime(client, dialogs, ask, PollScheduler(0.01, 0.01), depth=3600, length=300)
+
+    async def main():
+        task = asyncio.create_task(runtime.run())
+        await _wait_for(lambda: fake.calls["get_events"] >= 3)
+        # Another absence shows up while the first prompt is still open.
+        walk = _away(fake, _now(), 30, 20)
+        polls = fake.calls["get_events"]
+        await _wait_for(lambda: fake.calls["get_events"] >= polls + 3)
+        assert asked == [(lunch, [])]
+        answer.set()
+        await _wait_for(lambda: len(_posted(fake, client)) == 2)
+        task.cancel()
+        return walk
+
+    walk = asyncio.run(main())
+    dialogs.stop()
+    assert _posted(fake, client) == [lunch._replace(label="lunch"), walk._replace(label="walk")]
+    assert asked == [(lunch, []), (walk, ["lunch"])]
+
+
+def test_cancelled_prompt_is_asked_again_after_snooze():
+    fake, [lunch] = _server((50, 40))
+    client = AWAskAwayClient(fake)  # pyright: ignore[reportArgumentType]
+    responses = iter([None, "lunch"])
+    dialogs = DialogWorker()
+    runtime = Runtime(
+        client, dialogs, lambda *_: next(responses), PollScheduler(0.01, 0.01), depth=3600, length=300, snooze=0.1
+    )
+
+    async def main():
+        task = asyncio.create_task(runtime.run())
+        await _wait_for(lambda: _posted(fake, client))
+        task.cancel()
+
+    asyncio.run(main())
+    dialogs.stop()
+    assert _posted(fake, client) == [lunch._replace(label="lunch")]
+
+
+def test_waits_for_the_server_after_losing_it():
+    fake, [lunch] = _server((50, 40))
+    client = AWAskAwayClient(fake)  # pyright: ignore[reportArgumentType]
+    fake.error_rate = 1
+    probes = []
+
+    def probe():
+        probes.append(None)
+        # The server comes back on the third probe.
+        if len(probes) < 3:
+            return False
+        fake.error_rate = 0
+        return True
+
+    dialogs = DialogWorker()
+    runtime = Runtime(
+        client,
+        dialogs,
+        lambda *_: "lunch",
+        PollScheduler(0.01, 0.01),
+        depth=3600,
+        length=300,
+        readiness=Readiness(probe, min_backoff=0.01, max_backoff=0.01),
+    )
+
+    async def main():
+        task = asyncio.create_task(runtime.run())
+        await _wait_for(lambda: _posted(fake, client))
+        task.cancel()
+
+    asyncio.run(main())
+    dialogs.stop()
+    assert len(probes) == 3
+    assert _posted(fake, client) == [lunch._replace(label="lunch")]
+
+
+def test_answer_for_an_absence_logged_elsewhere_is_dropped():
+    fake, [lunch] = _server((50, 40))
+    client = AWAskAwayClient(fake)  # pyright: ignore[reportArgumentType]
+    from_web = lunch._replace(label="lunch from the web UI")
+
+    def ask(event, history):  # noqa: ARG001
+        # Logged from the web UI while the prompt is open, which the next poll picks up like the cache check does.
+        fake.insert_event(client.bucket_id, from_web.to_event(DATA_KEY))
+        client._missed_logged_events = [from_web]
+        while client._missed_logged_events is not None:
+            time.sleep(0.01)
+        return "lunch"
+
+    dialogs = DialogWorker()
+    runtime = Runtime(client, dialogs, ask, PollScheduler(0.01, 0.01), depth=3600, length=300)
+
+    async def main():
+        task = asyncio.create_task(runtime.run())
+        await asyncio.sleep(0.3)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    dialogs.stop()
+    assert _posted(fake, client) == [from_web]
+
+
+def test_keeps_the_schedule_when_the_server_fails_requests():
+    fake, _ = _server((50, 40))
+    client = AWAskAwayClient(fake)  # pyright: ignore[reportArgumentType]
+    fake.error = HTTPError
+    fake.error_rate = 1
+    probes = []
+
+    def probe():
+        probes.append(None)
+        return True
+
+    dialogs = DialogWorker()
+    runtime = Runtime(
+        client,
+        dialogs,
+        lambda *_: "lunch",
+        PollScheduler(0.05, 0.05),
+        depth=3600,
+        length=300,
+        readiness=Readiness(probe),
+    )
+
+    async def main():
+        task = asyncio.create_task(runtime.run())
+        await asyncio.sleep(0.3)
+        task.cancel()
+
+    asyncio.run(main())
+    dialogs.stop()
+    # The server answers, so there is nothing to wait for, but it is not polled any faster either.
+    assert probes == []
+    assert fake.calls["get_events"] <= 10
+
+
+def test_snoozing_one_absence_does_not_hold_up_others(tmp_path):
+    fake, [lunch, walk] = _server((50, 40), (30, 20))
+    cache = StateCache(tmp_path / "state.json")
+    client = AWAskAwayClient(fake, cache=cache)  # pyright: ignore[reportArgumentType]
+    asked = []
+    snoozed_on_disk = []
+
+    def ask(event, history):  # noqa: ARG001
+        asked.append(event)
+        if event == lunch and asked.count(lunch) == 1:
+            return Snooze(0.2)
+        if event == lunch:
+            snoozed_on_disk.extend(cache.load(fake.server_address, fake.client_hostname)["snoozed"])
+        return "lunch" if event == lunch else "walk"
+
+    dialogs = DialogWorker()
+    runtime = Runtime(client, dialogs, ask, PollScheduler(0.01, 0.01), depth=3600, length=300)
+
+    async def main():
+        task = asyncio.create_task(runtime.run())
+        await _wait_for(lambda: len(_posted(fake, client)) == 2)
+        task.cancel()
+
+    asyncio.run(main())
+    dialogs.stop()
+    # The walk is asked about while lunch is snoozed, then lunch once it wakes up.
+    assert asked == [lunch, walk, lunch]
+    assert _posted(fake, client) == [lunch._replace(label="lunch"), walk._replace(label="walk")]
+    # The snooze was saved, so it would have survived a restart.
+    assert [Span(*span) for _, *span in snoozed_on_disk] == [lunch]
@@ -0,0 +1,68 @@
+import asyncio
+import contextlib
+
+from aw_watcher_ask_away.scheduler import PollScheduler
+
+
+class FakeClocks:
+    def __init__(self):
+        self.wall = 0.0
+        self.monotonic = 0.0
+        self.sleeps: list[float] = []
+        self.suspend_on_sleep: int | None = None
+
+    async def sleep(self, seconds: float):
+        if self.suspend_on_sleep == len(self.sleeps):
+            self.wall += 3600  # The wall clock keeps going while suspended, the monotonic clock does not.
+        self.sleeps.append(seconds)
+        self.wall += seconds
+        self.monotonic += seconds
+
+    def scheduler(self, min_interval: float, max_interval: float):
+        return PollScheduler(
+            min_interval,
+            max_interval,
+            wall_clock=lambda: self.wall,
+            monotonic_clock=lambda: self.monotonic,
+        )
+
+
+def test_backs_off_while_afk_and_resets_on_return():
+    scheduler = FakeClocks().scheduler(5, 60)
+    intervals = []
+    for _ in range(6):
+        scheduler.update(afk=True)
+        intervals.append(scheduler.interval)
+    assert intervals == [10, 20, 40, 60, 60, 60]
+
+    scheduler.update(afk=False)
+    assert scheduler.interval == 5
+
+
+def test_sleep_async_is_chunked_and_wakes_on_resume(monkeypatch):
+    clocks = FakeClocks()
+    monkeypatch.setattr(asyncio, "sleep", clocks.sleep)
+    scheduler = clocks.scheduler(5, 60)
+    scheduler.interval = 20
+    assert not asyncio.run(scheduler.sleep_async())
+    assert clocks.sleeps == [5, 5, 5, 5]
+
+    clocks.sleeps.clear()
+    clocks.suspend_on_sleep = 1
+    scheduler.interval = 20
+    assert asyncio.run(scheduler.sleep_async())
+    assert clocks.sleeps == [5, 5]
+    assert scheduler.interval == 5
+
+
+def test_sleep_async_stops_when_cancelled():
+    async def main():
+        task = asyncio.create_task(PollScheduler(60, 60).sleep_async())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        # Right away, not once the minute is up.
+        async with asyncio.timeout(1):
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+    asyncio.run(main())
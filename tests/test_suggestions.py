@@ -0,0 +1,69 @@
+import datetime
+import random
+import time
+
+from aw_watcher_ask_away.core import Span, to_micros
+from aw_watcher_ask_away.suggestions import SuggestionIndex
+
+DAY = 86_400_000_000
+NOW = to_micros(datetime.datetime(2023, 10, 1, 12, tzinfo=datetime.UTC))
+
+
+def test_ranking():
+    index = SuggestionIndex()
+    for _ in range(3):
+        index.add("lunch with sam", NOW - 60 * DAY)
+    index.add("lunch break", NOW - DAY)
+    index.add("lunch break", NOW - DAY)
+    index.add("laundry", NOW)
+    index.add("", NOW)
+
+    # Two recent uses beat three from two months ago, which count for a quarter as much as three today.
+    assert index.suggest("l") == ["lunch break", "laundry", "lunch with sam"]
+    assert index.suggest("LUNCH w") == ["lunch with sam"]
+    assert index.suggest("lunch ") == ["lunch break", "lunch with sam"]
+    assert index.suggest("with lu") == ["lunch with sam"]
+    assert index.suggest("dinner") == []
+    assert index.suggest(" ") == []
+    assert index.suggest("l", limit=1) == ["lunch break"]
+
+
+def test_time_of_day():
+    index = SuggestionIndex()
+    morning = to_micros(datetime.datetime(2023, 10, 1, 8).astimezone())
+    evening = to_micros(datetime.datetime(2023, 10, 1, 19).astimezone())
+    index.add("standup", morning)
+    index.add("shower", evening)
+    assert index.suggest("s") == ["shower", "standup"]
+    assert index.suggest("s", now=datetime.datetime(2023, 10, 2, 8, 30).astimezone()) == ["standup", "shower"]
+
+
+def test_bounded_and_persisted():
+    index = SuggestionIndex.from_spans(
+        [Span(NOW + i, NOW + i + 1, f"task {i}") for i in range(5)] + [Span(NOW, NOW + 10, "task 0")], max_answers=3
+    )
+    # task 0 was given again most recently so task 1 and 2 were forgotten.
+    assert len(index) == 3
+    assert sorted(index.suggest("task")) == ["task 0", "task 3", "task 4"]
+    assert index.suggest("1") == []
+
+    restored = SuggestionIndex.from_json(index.to_json(), max_answers=3)
+    assert restored.suggest("task") == index.suggest("task")
+    restored.add("task 5", NOW + 20)
+    assert sorted(restored.suggest("task")) == ["task 0", "task 4", "task 5"]
+
+
+def test_lookups_are_fast():
+    rng = random.Random(0)
+    words = ["".join(rng.choices("abcdefghij", k=rng.randint(2, 8))) for _ in range(3000)]
+    index = SuggestionIndex(max_answers=50_000)
+    for i in range(50_000):
+        index.add(" ".join(rng.choices(words, k=3)), NOW + i * 1_000_000)
+
+    queries = ["".join(rng.choices("abcdefghij", k=rng.randint(1, 3))) for _ in range(200)]
+    queries += [f"{rng.choice(words)} {rng.choice('abcdefghij')}" for _ in range(200)]
+    started = time.perf_counter()
+    for query in queries:
+        index.suggest(query)
+    # Generous so this is not flaky, the median lookup is far under a millisecond.
+    assert (time.perf_counter() - started) / len(queries) < 0.005
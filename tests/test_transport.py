@@ -0,0 +1,77 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from requests.exceptions import RequestException
+
+from aw_watcher_ask_away.transport import PooledClient
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive.
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):  # noqa: N802
+        server = self.server
+        server.requests.append((self.path, self.client_address))  # pyright: ignore[reportAttributeAccessIssue]
+        if server.hang:  # pyright: ignore[reportAttributeAccessIssue]
+            time.sleep(1)
+        if server.unavailable:  # pyright: ignore[reportAttributeAccessIssue]
+            server.unavailable -= 1  # pyright: ignore[reportAttributeAccessIssue]
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps({"hostname": "host", "testing": True}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture()
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.requests = []  # pyright: ignore[reportAttributeAccessIssue]
+    server.hang = False  # pyright: ignore[reportAttributeAccessIssue]
+    server.unavailable = 0  # pyright: ignore[reportAttributeAccessIssue]
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _client(server, name, **kwargs):
+    # Each test needs its own name since aw_client only allows one instance per name.
+    return PooledClient(client_name=name, host="127.0.0.1", port=server.server_address[1], **kwargs)
+
+
+def test_reuses_the_connection(server):
+    client = _client(server, "test-transport-reuse")
+    for _ in range(5):
+        assert client.get_info()["hostname"] == "host"
+    # Every request came from the same client port, so it was one connection.
+    assert len({address for _, address in server.requests}) == 1
+
+
+def test_retries_gets_when_unavailable(server):
+    client = _client(server, "test-transport-retry")
+    server.unavailable = 2
+    assert client.get_info()["hostname"] == "host"
+    assert len(server.requests) == 3
+
+
+def test_times_out_on_a_hung_server(server):
+    client = _client(server, "test-transport-timeout", read_timeout=0.1, retries=0)
+    server.hang = True
+    started = time.perf_counter()
+    # A read timeout comes out as a ConnectionError once urllib3 has given up retrying, so just check it gave up.
+    with pytest.raises(RequestException):
+        client.get_info()
+    assert time.perf_counter() - started < 0.5